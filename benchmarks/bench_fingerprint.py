@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+
+#------------------------------------------------------------------------------
+#  bench_fingerprint.py                                                      --
+#                                                                            --
+#  Simulated phones of a few models, each probing every 30-90 seconds and    --
+#  from a new randomized MAC every few bursts, some for SSIDs of their own.  --
+#  Runs the probe requests through probeparser and probedb.DeviceLinker in   --
+#  time order, compares the number of logical devices with the number of     --
+#  phones and counts the MACs linked to a device of another phone.           --
+#                                                                            --
+#  usage: python3 bench_fingerprint.py [--phones 2000] [--models 20]         --
+#------------------------------------------------------------------------------
+
+import argparse
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import probedb
+import probeparser
+from makesample import RadiotapHeader, Dot11Header, Element, RandomMAC
+
+
+def ModelElements(Random):
+  #What one phone model puts after the SSID: rates, HT capabilities and a
+  #few other elements in an order of its own
+  Rates = Element(1, bytes(Random.sample([0x02, 0x04, 0x0b, 0x16, 0x0c, 0x12, 0x18, 0x24], 4)))
+  Other = [Element(50, b'\x30\x48\x60\x6c'),
+           Element(45, bytes(Random.randint(0, 255) for i in range(26))),
+           Element(127, bytes(Random.randint(0, 255) for i in range(8))),
+           Element(191, bytes(Random.randint(0, 255) for i in range(12))),
+           Element(221, b'\x00\x50\xf2\x08\x00\x10\x00'),
+           Element(221, bytes(Random.randint(0, 255) for i in range(3)) + b'\x01\x00')]
+  Random.shuffle(Other)
+  return Element(3, b'\x06').join([Rates] + Other[0:Random.randint(3, 6)])
+
+
+def Simulate(Phones, Models, Minutes, Rotate, Directed, Seed=1):
+  #Returns [(time, MAC, raw frame)] in capture order and the true phone of
+  #each MAC.  Every phone probes in bursts 30-90 seconds apart, the probes
+  #of one burst are a few milliseconds apart.
+  Random   = random.Random(Seed)
+  random.seed(Seed)
+  Elements = [ModelElements(Random) for i in range(Models)]
+  SSIDs    = [b'Network ' + str(i).encode() for i in range(Phones)]
+  Owned    = []
+  Interval = []
+  Bursts   = []
+  for Phone in range(Phones):
+    Owned.append(Random.sample(SSIDs, Random.randint(1, 3)) if Random.random() < Directed else [])
+    Interval.append(Random.uniform(30, 90))
+    Bursts.append((Random.uniform(0, Interval[Phone]), Phone))
+  heapq.heapify(Bursts)
+
+  Frames = []
+  Owner  = {}
+  MACs   = [None] * Phones
+  Start  = time.time()
+  while (Bursts[0][0] < Minutes * 60):
+    Time, Phone = Bursts[0]
+    heapq.heapreplace(Bursts, (Time + Interval[Phone] * Random.uniform(0.8, 1.2), Phone))
+    if (MACs[Phone] == None or Random.random() < 1.0 / Rotate):
+      MACs[Phone] = RandomMAC(True)
+      Owner[MACs[Phone]] = Phone
+    Model = Elements[Phone % Models]
+    for SSID in [b''] + Owned[Phone]:
+      Raw = (RadiotapHeader(-Random.randint(30, 90)) +
+             Dot11Header(4, 0, 'ff:ff:ff:ff:ff:ff', MACs[Phone], 'ff:ff:ff:ff:ff:ff') +
+             Element(0, SSID) + Model)
+      Frames.append((Start + Time, MACs[Phone].upper().replace(':', '-'), Raw))
+      Time = Time + Random.uniform(0.002, 0.02)
+  return Frames, Owner
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe randomized MAC linking benchmark")
+  parser.add_argument('--phones',   type=int,   default=2000, help="simulated phones")
+  parser.add_argument('--models',   type=int,   default=20,   help="phone models (probe signatures)")
+  parser.add_argument('--minutes',  type=int,   default=60,   help="simulated capture time")
+  parser.add_argument('--rotate',   type=int,   default=5,    help="a phone takes a new MAC every N bursts on average")
+  parser.add_argument('--directed', type=float, default=0.3,  help="share of phones that probe for SSIDs of their own")
+  parser.add_argument('--quiet',    type=int,   default=probedb.QUIET_SECONDS, help="seconds a logical device must be quiet before a new MAC links to it")
+  args = parser.parse_args()
+
+  Frames, Owner = Simulate(args.phones, args.models, args.minutes, args.rotate, args.directed)
+  Linker  = probedb.DeviceLinker(probeparser.FrameSignature, len(Owner), args.quiet)
+  Start   = time.perf_counter()
+  for Now, MAC, Raw in Frames:
+    Frame = probeparser.ExtractFrame(Raw)
+    LogicalID, Rows = Linker.Link(MAC, Frame, Frame.Info, '', Now)
+  Elapsed = time.perf_counter() - Start
+
+  #A MAC is linked wrongly when most MACs of its logical device belong to
+  #another phone.  Counted apart for devices whose fingerprint has SSIDs in
+  #it and for wildcard only ones, which only the timing tells apart.
+  Shared = 0
+  Wrong  = {True: 0, False: 0}
+  MACs   = {True: 0, False: 0}
+  for Device in Linker.Devices.values():
+    Phones   = [Owner[MAC.lower().replace('-', ':')] for MAC in Device.MACs]
+    Most     = max(Phones.count(Phone) for Phone in set(Phones))
+    Wildcard = (len(Device.Fingerprint) == 1)
+    Shared   = Shared + (1 if Most < len(Phones) else 0)
+    Wrong[Wildcard] = Wrong[Wildcard] + len(Phones) - Most
+    MACs[Wildcard]  = MACs[Wildcard] + len(Phones)
+
+  Devices = len(Linker.Devices)
+  print(len(Frames), "probe requests from", len(Owner), "MACs of", args.phones, "phones")
+  print("{:.1f}us per probe request (parse and link)".format(1000000.0 * Elapsed / len(Frames)))
+  print("estimated", Devices, "devices for", args.phones, "phones: count error {:+.1f}%".format(100.0 * (Devices - args.phones) / args.phones))
+  print(Shared, "logical devices shared by phones,", sum(Wrong.values()), "MACs linked to another phone: linking error {:.1f}%".format(100.0 * sum(Wrong.values()) / len(Owner)))
+  for Wildcard, Label in ((False, "with SSIDs of their own"), (True, "wildcard probes only")):
+    if (MACs[Wildcard] > 0):
+      print("  {:24} {:6} MACs, linking error {:.1f}%".format(Label, MACs[Wildcard], 100.0 * Wrong[Wildcard] / MACs[Wildcard]))
+  print(Linker.Report())
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+
+#------------------------------------------------------------------------------
+#  bench_follow.py                                                           --
+#                                                                            --
+#  Simulated weeks of driving: every day visits a few of a pool of places,   --
+#  each with its own stationary devices and a stream of passers-by, and a    --
+#  handful of planted followers turn up at some of the stops.  Times         --
+#  probefollow.FindFollowers on the schema 2 database and reports where      --
+#  the followers ended up in the ranking.                                    --
+#                                                                            --
+#  usage: python3 bench_follow.py [--days 28] [--followers 5] [--dir d]      --
+#------------------------------------------------------------------------------
+
+import argparse
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import probedb
+import probefollow
+
+
+def Simulate(conn, Days, Places, Stops, Followers, Seed=1):
+  #Home is place 0 and the first stop of every day.  A stop lasts 30-90
+  #minutes with a sighting every few seconds: the place's own devices,
+  #new random MACs passing by and, at 40% of stops, the followers.
+  Random = random.Random(Seed)
+  Spots  = [(43.65 + Random.uniform(-0.15, 0.15), -79.38 + Random.uniform(-0.2, 0.2)) for i in range(Places)]
+  Devices = {}
+
+  def DeviceID(MAC):
+    if MAC not in Devices:
+      Devices[MAC] = len(Devices) + 1
+    return Devices[MAC]
+
+  Rows  = []
+  Start = int(time.time()) - Days * 86400
+  Next  = 0x020000000000
+  for Day in range(Days):
+    When = Start + Day * 86400 + 8 * 3600
+    for Stop in [0] + Random.sample(range(1, Places), Stops - 1):
+      Lat, Lon = Spots[Stop]
+      Follow   = Random.random() < 0.4
+      for Second in range(0, Random.randint(30, 90) * 60, 5):
+        Kind = Random.random()
+        if (Kind < 0.5):
+          MAC = 0x3c0000000000 + Stop * 1000 + Random.randint(0, 40)
+        elif (Kind < 0.9 or not Follow):
+          Next = Next + 1
+          MAC  = Next
+        else:
+          MAC = 0xa40000000000 + Random.randint(1, Followers)
+        Rows.append(((When + Second) * 1000, DeviceID(MAC),
+                     Lat + Random.uniform(-0.0005, 0.0005), Lon + Random.uniform(-0.0005, 0.0005),
+                     Random.randint(-90, -30)))
+      When = When + 2 * 3600
+
+  conn.executemany("insert into Devices (DeviceID, MAC, DeviceType, Vendor, FriendlyName) values (?,?,'mobile','','--')",
+                   [(ID, MAC) for MAC, ID in Devices.items()])
+  conn.executemany('insert into Observations (Time, DeviceID, Lat, Lon, Signal) values (?,?,?,?,?)', Rows)
+  conn.commit()
+  return len(Rows), len(Devices)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe following device benchmark")
+  parser.add_argument('--days',      type=int, default=28,  help="days of driving")
+  parser.add_argument('--places',    type=int, default=60,  help="places the stops are picked from")
+  parser.add_argument('--stops',     type=int, default=6,   help="stops a day, home included")
+  parser.add_argument('--followers', type=int, default=5,   help="planted followers")
+  parser.add_argument('--dir', default=tempfile.gettempdir(), help="directory for the test database")
+  args = parser.parse_args()
+
+  FileName = os.path.join(args.dir, 'bench_follow_' + str(args.days) + '.db')
+  if os.path.exists(FileName):
+    os.remove(FileName)
+  conn = probedb.Connect(FileName, 'fast')
+  probedb.CreateSchemaV2(conn)
+  Start = time.perf_counter()
+  Sightings, Devices = Simulate(conn, args.days, args.places, args.stops, args.followers)
+  print(Sightings, "sightings of", Devices, "devices built in {:.1f}s".format(time.perf_counter() - Start))
+
+  Start   = time.perf_counter()
+  Results = probefollow.FindFollowers(conn, 2)
+  Elapsed = time.perf_counter() - Start
+  Planted = [Rank + 1 for Rank, Result in enumerate(Results) if Result[1].startswith('A4-00-00-00-00-')]
+  print("{} MACs reported in {:.2f}s, peak RSS {:.1f}MB".format(len(Results), Elapsed,
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0))
+  print("planted followers ranked", Planted, "of", len(Results))
+  conn.close()
+  os.remove(FileName)
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+#------------------------------------------------------------------------------
+#  bench_insert.py                                                           --
+#                                                                            --
+#  Measures GPSLog insert throughput: one commit per row (the old            --
+#  InsertGPSLog) against the batching GPSLogWriter, under each storage       --
+#  profile.                                                                  --
+#                                                                            --
+#  usage: python3 bench_insert.py [--rows N] [--dir /path/on/sdcard]         --
+#                                 [--profile wal]                            --
+#------------------------------------------------------------------------------
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import probedb
+import probewriter
+
+
+SchemaFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'sqlite', 'CreateTables.sql')
+
+
+def CreateDatabase(Directory, Name):
+  FileName = os.path.join(Directory, Name)
+  for Suffix in ('', '-wal', '-shm', '-journal'):
+    if os.path.exists(FileName + Suffix):
+      os.remove(FileName + Suffix)
+  conn = sqlite3.connect(FileName)
+  with open(SchemaFile) as f:
+    #the schema file has sqlite3 shell dot commands in it
+    conn.executescript('\n'.join(Line for Line in f if not Line.startswith('.')))
+  conn.close()
+  return FileName
+
+
+def MakeRows(Count):
+  random.seed(1)
+  Rows = []
+  for i in range(Count):
+    MAC = ':'.join('%02x' % random.randint(0,255) for j in range(6))
+    Rows.append(('2026-10-18 12:00:00', '43.6', '-79.3', str(-random.randint(30,90)), '6', '0-4',
+                 'mobile', MAC, '--', 'Apple, Inc.', b'Home', None))
+  return Rows
+
+
+def PerRowCommit(FileName, Rows, Profile):
+  conn  = probedb.Connect(FileName, Profile)
+  Start = time.perf_counter()
+  for Row in Rows:
+    cur = conn.cursor()
+    cur.execute(probedb.GPSLOG_INSERT, Row)
+    conn.commit()
+  Elapsed = time.perf_counter() - Start
+  conn.close()
+  return Elapsed
+
+
+def GroupCommit(FileName, Rows, BatchRows, BatchMilliseconds, Profile):
+  Writer = probewriter.GPSLogWriter(FileName, BatchRows, BatchMilliseconds, Profile=Profile)
+  Writer.start()
+  Start = time.perf_counter()
+  for Row in Rows:
+    Writer.Add(Row)
+  Writer.Stop()
+  Elapsed = time.perf_counter() - Start
+  return Elapsed, Writer
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe insert benchmark")
+  parser.add_argument('--rows', type=int, default=5000, help="rows to insert")
+  parser.add_argument('--dir', default=tempfile.gettempdir(), help="directory for the test database (use the SD card for real numbers)")
+  parser.add_argument('--commit-rows', type=int, default=500)
+  parser.add_argument('--commit-ms', type=int, default=1000)
+  parser.add_argument('--profile', action='append', choices=sorted(probedb.StorageProfiles), help="storage profile to test (repeatable, default: all)")
+  args = parser.parse_args()
+
+  Rows     = MakeRows(args.rows)
+  Profiles = args.profile or sorted(probedb.StorageProfiles)
+
+  for Profile in Profiles:
+    print("--" + Profile)
+    FileName = CreateDatabase(args.dir, 'bench_insert_row.db')
+    Elapsed  = PerRowCommit(FileName, Rows, Profile)
+    print("commit per row : {:10.0f} rows/sec".format(len(Rows) / Elapsed))
+
+    FileName = CreateDatabase(args.dir, 'bench_insert_group.db')
+    Elapsed, Writer = GroupCommit(FileName, Rows, args.commit_rows, args.commit_ms, Profile)
+    print("group commit   : {:10.0f} rows/sec".format(len(Rows) / Elapsed))
+    print(Writer.Summary())
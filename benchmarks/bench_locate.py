@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+
+#------------------------------------------------------------------------------
+#  bench_locate.py                                                           --
+#                                                                            --
+#  Simulated drive-bys: every router is passed on a road some way off, its   --
+#  beacons heard with  RSSI = P0 - 10 n log10(d) + noise.  Times the         --
+#  probelocate.py estimators on all of them at once and reports how far      --
+#  the estimates are from the real positions.                                --
+#                                                                            --
+#  usage: python3 bench_locate.py [--routers 200000] [--samples 20]          --
+#------------------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import probedb
+import probelocate
+
+
+def Simulate(Routers, Samples, Noise, Exponent, Seed=1):
+  #Each router sits 5-60m from a straight road at a random heading and is
+  #heard over a 300m stretch of it.  Returns the keys, the N x 3 samples
+  #and the true router positions.
+  Random  = numpy.random.default_rng(Seed)
+  Lat0    = 43.65 + Random.uniform(-0.1, 0.1, Routers)
+  Lon0    = -79.38 + Random.uniform(-0.1, 0.1, Routers)
+  Scale   = probedb.METERS_PER_DEGREE * numpy.cos(numpy.radians(Lat0))
+  Heading = Random.uniform(0, numpy.pi, Routers)
+  Offset  = Random.uniform(5, 60, Routers)
+  P0      = Random.uniform(-45, -30, Routers)
+
+  Group = numpy.repeat(numpy.arange(Routers), Samples)
+  Along = Random.uniform(-150, 150, Routers * Samples)
+  #road position relative to the router, in meters east/north
+  East  = numpy.cos(Heading)[Group] * Along - numpy.sin(Heading)[Group] * Offset[Group]
+  North = numpy.sin(Heading)[Group] * Along + numpy.cos(Heading)[Group] * Offset[Group]
+  Distance = numpy.maximum(numpy.hypot(East, North), 1.0)
+  Signal   = numpy.round(P0[Group] - 10 * Exponent * numpy.log10(Distance) + Random.normal(0, Noise, len(Group)))
+
+  Keys   = Group.tolist()
+  Points = numpy.stack([Lat0[Group] + North / probedb.METERS_PER_DEGREE,
+                        Lon0[Group] + East / Scale[Group],
+                        Signal], axis=1)
+  return Keys, Points, Lat0, Lon0
+
+
+def Errors(Results, Lat0, Lon0):
+  Lat = numpy.array([Row[1] for Row in Results])
+  Lon = numpy.array([Row[2] for Row in Results])
+  return numpy.hypot((Lat - Lat0) * probedb.METERS_PER_DEGREE,
+                     (Lon - Lon0) * probedb.METERS_PER_DEGREE * numpy.cos(numpy.radians(Lat0)))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe router location benchmark")
+  parser.add_argument('--routers',  type=int,   default=200000, help="simulated routers")
+  parser.add_argument('--samples',  type=int,   default=20,     help="beacons heard per router")
+  parser.add_argument('--noise',    type=float, default=4.0,    help="RSSI noise (dB, 1 sigma)")
+  parser.add_argument('--exponent', type=float, default=probelocate.PATH_LOSS_EXPONENT)
+  args = parser.parse_args()
+
+  Keys, Samples, Lat0, Lon0 = Simulate(args.routers, args.samples, args.noise, args.exponent)
+  print(args.routers, "routers,", len(Keys), "samples")
+  print("{:10} {:>10} {:>12} {:>12} {:>10}".format('method', 'seconds', 'median err', '90% err', 'fitted'))
+  for Method in ('centroid', 'fit'):
+    Start   = time.perf_counter()
+    Results = probelocate.EstimateChunk(Keys, Samples, Method, args.exponent)
+    Elapsed = time.perf_counter() - Start
+    Error   = Errors(Results, Lat0, Lon0)
+    Fitted  = sum(1 for Row in Results if Row[6] == 'fit')
+    print("{:10} {:10.2f} {:11.1f}m {:11.1f}m {:10}".format(Method, Elapsed, numpy.median(Error), numpy.percentile(Error, 90), Fitted))
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+#------------------------------------------------------------------------------
+#  bench_parser.py                                                           --
+#                                                                            --
+#  Compares frames/sec of the probeparser fast path against full scapy      --
+#  dissection (RadioTap + haslayer/getlayer) on a recorded pcap.             --
+#                                                                            --
+#  usage: python3 bench_parser.py capture.pcap [--repeat N]                  --
+#------------------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import probeparser
+
+
+def ScapyPath(Frames):
+  #What packet_callback did before the fast path
+  from scapy.layers.dot11 import RadioTap, Dot11Beacon, Dot11Elt
+  for Raw in Frames:
+    packet = RadioTap(Raw)
+    if packet.haslayer(Dot11Beacon):
+      SSID = packet.getlayer(Dot11Elt).info
+    elif (packet.type == 0 and packet.subtype == 0x04):
+      SSID = packet.info
+    Signal = packet.dBm_AntSignal
+    MAC    = packet.addr2
+
+
+def FastPath(Frames):
+  Fallbacks = 0
+  for Raw in Frames:
+    Frame = probeparser.ParseFrame(Raw)
+    if (Frame is None):
+      Fallbacks = Fallbacks + 1
+  return Fallbacks
+
+
+def TimeIt(Function, Frames, Repeat):
+  Best = None
+  for i in range(Repeat):
+    Start   = time.perf_counter()
+    Result  = Function(Frames)
+    Elapsed = time.perf_counter() - Start
+    if (Best is None or Elapsed < Best):
+      Best = Elapsed
+  return Best, Result
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe frame parser benchmark")
+  parser.add_argument('pcap', help="radiotap pcap file")
+  parser.add_argument('--repeat', type=int, default=3, help="runs per parser, best time is reported")
+  args = parser.parse_args()
+
+  Frames = [Raw for Timestamp, Raw in probeparser.ReadPcap(args.pcap)]
+  print("Frames:", len(Frames))
+
+  Elapsed, Fallbacks = TimeIt(FastPath, Frames, args.repeat)
+  FastRate = len(Frames) / Elapsed
+  print("fast path : {:12.0f} frames/sec  ({} fell back to scapy)".format(FastRate, Fallbacks))
+
+  try:
+    Elapsed, Result = TimeIt(ScapyPath, Frames, args.repeat)
+    ScapyRate = len(Frames) / Elapsed
+    print("scapy     : {:12.0f} frames/sec".format(ScapyRate))
+    print("speedup   : {:12.1f}x".format(FastRate / ScapyRate))
+  except ImportError:
+    print("scapy     : not installed, skipped")
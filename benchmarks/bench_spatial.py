@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+
+#------------------------------------------------------------------------------
+#  bench_spatial.py                                                          --
+#                                                                            --
+#  Times "sightings within N meters of a spot" on the synthetic database     --
+#  from bench_reports.py, through the SightingIndex R*Tree and by scanning   --
+#  the table, for schema 1 (GPSLog) and schema 2 (Observations).             --
+#                                                                            --
+#  usage: python3 bench_spatial.py [--rows 10000000] [--meters 200]          --
+#------------------------------------------------------------------------------
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import probedb
+from bench_reports import BuildDatabase, TimeQuery, Plan
+
+
+def ScanQuery(Schema, Since):
+  #the same circle without the index: every sighting is looked at
+  Source = 'GPSLogView' if Schema >= 2 else 'GPSLog'
+  Where  = ''
+  if (Since != None):
+    Where = ' and ' + probedb.EpochColumn(Schema) + ' >= :Since'
+  return ('select ' + probedb.RecentColumns + ' from ' + Source +
+          ''' where Lat between :MinLat and :MaxLat and Lon between :MinLon and :MaxLon''' + Where + '''
+                and ((Lat - :Lat) * 111320.0) * ((Lat - :Lat) * 111320.0)
+                  + ((Lon - :Lon) * :LonScale) * ((Lon - :Lon) * :LonScale) <= :Meters * :Meters''')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe spatial query benchmark")
+  parser.add_argument('--rows',    type=int,   default=10000000, help="sightings in the synthetic table")
+  parser.add_argument('--days',    type=int,   default=30,       help="days the sightings are spread over")
+  parser.add_argument('--meters',  type=float, default=200,      help="radius around the spot")
+  parser.add_argument('--repeat',  type=int,   default=3,        help="runs per query, the best is reported")
+  parser.add_argument('--dir', default=tempfile.gettempdir(), help="directory for the test database")
+  parser.add_argument('--plan', action='store_true', help="print the query plans")
+  args = parser.parse_args()
+
+  FileName = os.path.join(args.dir, 'bench_reports_' + str(args.rows) + '.db')
+  Start = time.perf_counter()
+  if BuildDatabase(FileName, args.rows, args.days, 20000, 2000):
+    print("built", args.rows, "rows in {:.1f}s".format(time.perf_counter() - Start))
+
+  conn = probedb.Connect(FileName, 'wal')
+  probedb.CreateSupportTables(conn)
+
+  #the middle of the area BuildDatabase scatters the sightings over
+  Params = probedb.AreaParams(43.65, -79.35, args.meters)
+  Day    = int(time.time()) - 86400
+
+  print("{:24} {:>10} {:>10} {:>8}".format('query', 'rtree', 'scan', 'rows'))
+  for Schema in (1, 2):
+    Start = time.perf_counter()
+    Indexed = probedb.RebuildSightingIndex(conn, Schema)
+    print("schema", Schema, "index built:", Indexed, "sightings in {:.1f}s".format(time.perf_counter() - Start))
+    for Name, Since in (('all time', None), ('last 24h', Day)):
+      Params['Since'] = Since
+      SQL  = probedb.SightingsInAreaQuery(Schema, Since, None, Radius=True)
+      Scan = ScanQuery(Schema, Since)
+      Indexed, Count = TimeQuery(conn, SQL, args.repeat, Params)
+      Scanned = TimeQuery(conn, Scan, 1, Params)[0]
+      print("{:24} {:9.1f}ms {:9.1f}ms {:8}".format('schema ' + str(Schema) + ' ' + Name, Indexed * 1000, Scanned * 1000, Count))
+      if args.plan:
+        print(Plan(conn, SQL, Params))
+  conn.close()
@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+#------------------------------------------------------------------------------
+#  bench_startup.py                                                          --
+#                                                                            --
+#  Import time and peak RSS of the modules gpsprobe.py loads at startup,     --
+#  with pandas (as before) and without it (reports on sqlite3 cursors).      --
+#  Each case runs in a fresh interpreter; the best time is reported.         --
+#                                                                            --
+#  usage: python3 bench_startup.py [--repeat 5]                              --
+#------------------------------------------------------------------------------
+
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+
+
+Root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, Root)
+
+#what gpsprobe.py imports, minus its own windows and the GPS daemon client
+Modules = ['argparse', 'netaddr', 'logging', 'traceback', 'scapy.all', 'probeparser',
+           'probedb', 'probevendor', 'threading', 'queue', 'sqlite3', 'curses', 'inspect']
+
+Child = '''
+import resource, sys, time
+sys.path.insert(0, %r)
+Start = time.perf_counter()
+for Name in %r:
+  try:
+    __import__(Name)
+  except ImportError:
+    pass
+print(time.perf_counter() - Start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def Measure(ModuleList, Repeat):
+  Best = None
+  for i in range(Repeat):
+    Output = subprocess.check_output([sys.executable, '-c', Child % (Root, ModuleList)])
+    Seconds, RSS = Output.split()
+    if (Best == None or float(Seconds) < Best[0]):
+      Best = (float(Seconds), int(RSS))
+  return Best
+
+
+def Available(Name):
+  return importlib.util.find_spec(Name.split('.')[0]) != None
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe startup import benchmark")
+  parser.add_argument('--repeat', type=int, default=5, help="runs per case, the fastest is reported")
+  args = parser.parse_args()
+
+  Missing = [Name for Name in Modules + ['pandas'] if not Available(Name)]
+  if Missing:
+    print("not installed (skipped):", ', '.join(Missing))
+
+  for Label, ModuleList in (('with pandas', Modules + ['pandas']), ('without pandas', Modules)):
+    Seconds, RSS = Measure(ModuleList, args.repeat)
+    #ru_maxrss is in kilobytes on Linux
+    print("{:16} {:8.3f}s  peak RSS {:8.1f}MB".format(Label, Seconds, RSS / 1024.0))
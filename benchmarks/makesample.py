@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+
+#------------------------------------------------------------------------------
+#  makesample.py                                                             --
+#                                                                            --
+#  Writes a synthetic radiotap pcap full of beacons, probe requests and      --
+#  data frames, for benchmarking on machines without a monitor mode radio.   --
+#  A real capture from the street is always the better benchmark.            --
+#                                                                            --
+#  usage: python3 makesample.py sample.pcap [frames]                         --
+#------------------------------------------------------------------------------
+
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import probeparser
+
+
+def RadiotapHeader(Signal):
+  #present: flags, rate, channel, dBm_AntSignal
+  Present = probeparser.RT_FLAGS | probeparser.RT_RATE | probeparser.RT_CHANNEL | probeparser.RT_DBM_ANTSIGNAL
+  Body    = struct.pack('<BBHHb', 0, 2, 2437, 0x00a0, Signal)
+  return struct.pack('<BBHI', 0, 0, 8 + len(Body), Present) + Body
+
+
+def MACBytes(MAC):
+  return bytes(int(x,16) for x in MAC.split(':'))
+
+
+def Element(ID, Data):
+  return struct.pack('<BB', ID, len(Data)) + Data
+
+
+def Dot11Header(Subtype, Type, Addr1, Addr2, Addr3):
+  FC = (Subtype << 4) | (Type << 2)
+  return struct.pack('<BBH', FC, 0, 0) + MACBytes(Addr1) + MACBytes(Addr2) + MACBytes(Addr3) + b'\x00\x00'
+
+
+def RandomMAC(Randomized):
+  Octets = [random.randint(0,255) for i in range(6)]
+  if (Randomized):
+    Octets[0] = (Octets[0] | 0x02) & 0xfe
+  else:
+    Octets[0] = Octets[0] & 0xfc
+  return ':'.join('%02x' % o for o in Octets)
+
+
+def MakeFrames(Count, Seed=1):
+  random.seed(Seed)
+  Routers = [RandomMAC(False) for i in range(200)]
+  Phones  = [RandomMAC(i % 3 == 0) for i in range(2000)]
+  SSIDs   = [b'Home', b'Linksys', b'NETGEAR55', b'xfinitywifi', b'CoffeeShop', b'']
+  Rates   = Element(1, b'\x02\x04\x0b\x16\x0c\x12\x18\x24')
+  Start   = 1760000000.0
+
+  Frames = []
+  for i in range(Count):
+    Signal = -random.randint(30,95)
+    Kind   = random.random()
+    if (Kind < 0.45):
+      Router = random.choice(Routers)
+      Body   = struct.pack('<QHH', i, 100, 0x0431) + Element(0, random.choice(SSIDs)) + Rates
+      Raw    = RadiotapHeader(Signal) + Dot11Header(8, 0, 'ff:ff:ff:ff:ff:ff', Router, Router) + Body
+    elif (Kind < 0.65):
+      Phone = random.choice(Phones)
+      Body  = Element(0, random.choice(SSIDs)) + Rates
+      Raw   = RadiotapHeader(Signal) + Dot11Header(4, 0, 'ff:ff:ff:ff:ff:ff', Phone, 'ff:ff:ff:ff:ff:ff') + Body
+    else:
+      #data frame from a phone to a router
+      Raw = RadiotapHeader(Signal) + Dot11Header(0, 2, random.choice(Routers), random.choice(Phones), random.choice(Routers)) + os.urandom(random.randint(40,400))
+    Frames.append((Start + i * 0.002, Raw))
+  return Frames
+
+
+if __name__ == '__main__':
+  if (len(sys.argv) < 2):
+    print("usage: makesample.py output.pcap [frames]")
+    sys.exit(1)
+  Count = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+  probeparser.WritePcap(sys.argv[1], MakeFrames(Count))
+  print("Wrote", Count, "frames to", sys.argv[1])
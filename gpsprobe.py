@@ -68,6 +68,32 @@
 #  Oct 19, 2024                                                              --
 #   - adapting for dual wifi                                                 --
 #------------------------------------------------------------------------------
+#  Oct 18, 2026                                                              --
+#   - optional bounded capture queue so sniff never waits on processing      --
+#   - fast path frame parser (probeparser.py), scapy only as a fallback      --
+#   - kernel side BPF capture filter for beacons and probe requests          --
+#   - pcap replay mode with per stage timing for benchmarking                --
+#   - database rows are committed in batches by a writer thread              --
+#   - selectable storage profile (WAL) with background checkpoints           --
+#   - LRU cache in front of the netaddr vendor lookups                       --
+#   - vendor lookups use a compiled OUI table (probevendor.py build)         --
+#   - repeated router beacons are suppressed within a time window            --
+#   - probe requests can be aggregated into per device sessions              --
+#   - optional normalized schema 2 (Devices, SSIDs, Observations)            --
+#   - schema 2 distinct devices counts read a (Time, Device, SSID) index     --
+#   - optional daily or weekly shard files, old ones are simply deleted      --
+#   - background rollup of old sightings into hourly per device summaries    --
+#   - unknown devices report reads a summary table kept by the writer        --
+#   - recent intruders report pages by (time, rowid) key instead of offset   --
+#   - reports stream rows from sqlite cursors, pandas only for --export      --
+#   - record count comes from a counter table instead of count(*)            --
+#   - FriendlyName table synced as a diff, skipped if the list is unchanged  --
+#   - R*Tree index over sighting positions, report n: sightings near here    --
+#   - --export to .parquet/.arrow streams in chunks through pyarrow          --
+#   - --export to .geojson/.kml writes device tracks and router points       --
+#   - --locate-routers estimates router positions with numpy (probelocate)   --
+#   - randomized MACs linked into logical devices by probe fingerprint       --
+#------------------------------------------------------------------------------
 
 
 # To Do:
@@ -94,19 +120,24 @@ from scapy.all import *
 from pprint import pprint
 from logging.handlers import RotatingFileHandler
 from FriendlyNameList import FriendlyNameList
+import probeparser
+import probedb
+import probeexport
+import probewriter
+import probevendor
 
 from gps import *
 from time import *
 from datetime import datetime, timedelta
 import time
 import threading
+import queue
 from threading import Event, Thread
 from configparser import SafeConfigParser
 
 #Database support
 import sqlite3
 from sqlite3 import Error
-import pandas 
  
 #For capturing keypresses and drawing text boxes
 import curses
@@ -160,6 +191,8 @@ ScrollSpeed   = 0.001
 Filter        = "NoFriendly"   # none, NoFriendlyRouter, NoFriendly
 GPSLogRecordCount = 0
 PauseOutput   = False
+CaptureFilter = None    #FilterStats for the kernel capture filter
+Stages        = None    #StageTimer for the packet callback
 
 FriendlyCount = 0
 RecordCount   = 0
@@ -190,10 +223,40 @@ parser.add_argument('-l', '--log',   action='store_true', help="enable scrolling
 parser.add_argument('-g', '--gps',   action='store_true', help="Enable GPS functions")
 parser.add_argument('-u', '--unicornhat', action='store_true', help="use unicorn hat display")
 parser.add_argument('-m', '--mobileonly', action='store_true', help="mobile only")
+parser.add_argument('-Q', '--queue', action='store_true', help="capture into a bounded queue processed by a worker thread")
+parser.add_argument('--queue-size', type=int, default=2000, help="maximum packets waiting in the capture queue")
+parser.add_argument('-P', '--fastparse', action='store_true', help="capture raw frames and parse headers without full scapy dissection")
+parser.add_argument('--database', default='/home/pi/sqlite/GPSProbe', help="SQLite database file")
+parser.add_argument('--commit-rows', type=int, default=500, help="commit to the database every N rows")
+parser.add_argument('--commit-ms', type=int, default=1000, help="commit at least every N milliseconds (maximum data lost on power failure)")
+parser.add_argument('--storage-profile', default='default', choices=sorted(probedb.StorageProfiles), help="SQLite tuning: default (rollback journal), wal, fast (wal without fsync)")
+parser.add_argument('--checkpoint-seconds', type=int, default=30, help="seconds between background WAL checkpoints")
+parser.add_argument('--shards', default='none', choices=['none'] + list(probedb.ShardPeriods), help="write sightings to a new database file every day or week (DATABASE-d20261018)")
+parser.add_argument('--shard-keep-days', type=int, default=0, help="delete shard files that ended more than N days ago (0 = keep everything)")
+parser.add_argument('--rollup-days', type=int, default=0, help="replace sightings in the main database older than N days with hourly per device rollups (0 = keep raw rows)")
+parser.add_argument('--rollup-chunk', type=int, default=2000, help="raw rows rolled up per transaction")
+parser.add_argument('--export', help="write the logged sightings to this .csv or .xlsx file (needs pandas), .parquet/.arrow file (needs pyarrow) or .geojson/.kml map and exit")
+parser.add_argument('--export-hours', type=int, default=0, help="export only the last N hours (0 = everything)")
+parser.add_argument('--locate-routers', choices=['fit','centroid'], help="estimate router positions from their beacons (needs numpy, see probelocate.py), before --export if both are given, and exit")
+parser.add_argument('--near-meters', type=float, default=100, help="radius of the sightings near here report (key n)")
+parser.add_argument('--near-hours', type=int, default=0, help="sightings near here report covers the last N hours (0 = everything)")
+parser.add_argument('--vendor-cache-size', type=int, default=4096, help="number of MAC vendor (OUI) lookups to remember")
+parser.add_argument('--oui-table', default=probevendor.DEFAULT_TABLE, help="compiled OUI table from 'probevendor.py build' (netaddr is used if it is missing)")
+parser.add_argument('--beacon-window', type=int, default=0, help="log a router beacon at most once per N seconds per MAC/SSID/channel, 60 is a good start (0 = log all)")
+parser.add_argument('--beacon-rssi-delta', type=int, default=10, help="log a suppressed beacon anyway if its signal moved more than N dBm")
+parser.add_argument('--probe-log', default='raw', choices=['raw','sessions','both'], help="log probe requests as raw GPSLog rows, as ProbeSessions rows, or both")
+parser.add_argument('--session-idle', type=int, default=300, help="close a probe session after the device has been quiet for N seconds")
+parser.add_argument('--link-macs', type=int, default=0, help="link randomized MACs to logical devices by probe fingerprint, remembering the last N of them (0 = off)")
+parser.add_argument('--link-quiet', type=int, default=probedb.QUIET_SECONDS, help="link a new randomized MAC only to a logical device that has been quiet for N seconds")
+parser.add_argument('--schema', type=int, choices=[1,2], help="database layout: 1 = GPSLog text rows, 2 = normalized Devices/SSIDs/Observations (default: whatever the database already uses)")
+parser.add_argument('--replay', help="feed frames from a radiotap pcap file instead of a live interface")
+parser.add_argument('--replay-speed', type=float, default=0, help="replay at this multiple of recorded time (0 = as fast as possible)")
+parser.add_argument('--capture-filter', default=probeparser.DEFAULT_FILTER, help="management subtypes the kernel passes to us, comma separated (beacon,probe-req,probe-resp,...), 'mgt' for all management frames or 'none'")
 args = parser.parse_args()
 
 #Report pagination
 StartRow   = 0
+PageKeys   = {}   #(Filter, StartRow) -> (SortTime, SortDB, SortID) of the row before that page
 
 
 
@@ -204,6 +267,7 @@ global Window1
 global Window2
 global Window3
 global Window4
+global StatusWindow2
 global stdscr
 global IPAddress
 stdscr = curses.initscr()
@@ -212,7 +276,8 @@ stdscr = curses.initscr()
 curses.curs_set(0)
 
 
-if not args.interface:
+if not args.interface and not args.replay and not args.export and not args.locate_routers:
+  curses.endwin()
   print ("error: capture interface not given, try --help")
   sys.exit(-1)
 
@@ -230,6 +295,13 @@ if (args.unicornhat):
 
 DEBUG = args.debug
 
+try:
+  CaptureSubtypes = probeparser.ParseFilterOption(args.capture_filter)
+except ValueError as ErrorMessage:
+  curses.endwin()
+  print ("error:",ErrorMessage)
+  sys.exit(-1)
+
 
   
 #--------------------------------------
@@ -462,8 +534,202 @@ class GpsPoller(threading.Thread):
         #print  (getattr(GPSReport,'ept','nan'),"\t")
         #print  (getattr(gpsd,'speed','nan'),"\t")
         #print  (getattr(GPSReport,'climb','nan'),"\t")
- 
- 
+
+
+
+
+class CaptureQueue(object):
+  #Bounded hand-off between the sniff thread and the packet workers.
+  #The sniff callback only puts packets here: raw frame bytes with
+  #--fastparse, or the packet scapy has already dissected otherwise.  If the
+  #workers fall behind and the queue is full, the packet is dropped and
+  #counted instead of blocking the capture.
+  def __init__(self,MaxSize):
+    self.MaxSize      = MaxSize
+    self.Packets      = queue.Queue(maxsize=MaxSize)
+    self.Enqueued     = 0    #only updated by the sniff thread
+    self.Dequeued     = 0    #only updated by the worker
+    self.Dropped      = 0
+    self.MaxDepth     = 0
+    self.StartTime    = time.time()
+    self.LastTime     = self.StartTime
+    self.LastEnqueued = 0
+    self.LastDequeued = 0
+    self.EnqueueRate  = 0.0
+    self.DequeueRate  = 0.0
+
+
+  def Put(self,packet):
+    try:
+      self.Packets.put_nowait(packet)
+      self.Enqueued = self.Enqueued + 1
+      Depth = self.Packets.qsize()
+      if (Depth > self.MaxDepth):
+        self.MaxDepth = Depth
+    except queue.Full:
+      self.Dropped = self.Dropped + 1
+
+
+  def Get(self,Timeout):
+    #raises queue.Empty if nothing arrives within Timeout seconds
+    packet = self.Packets.get(timeout=Timeout)
+    self.Dequeued = self.Dequeued + 1
+    return packet
+
+
+  def Done(self):
+    #the worker has finished with the packet it last took off the queue
+    self.Packets.task_done()
+
+
+  def Join(self):
+    #wait until every queued packet has been through the callback
+    self.Packets.join()
+
+
+  def Depth(self):
+    return self.Packets.qsize()
+
+
+  def UpdateRates(self):
+    #packets per second since the last call
+    Now     = time.time()
+    Elapsed = Now - self.LastTime
+    if (Elapsed > 0):
+      self.EnqueueRate  = (self.Enqueued - self.LastEnqueued) / Elapsed
+      self.DequeueRate  = (self.Dequeued - self.LastDequeued) / Elapsed
+      self.LastEnqueued = self.Enqueued
+      self.LastDequeued = self.Dequeued
+      self.LastTime     = Now
+
+
+  def Summary(self):
+    Elapsed = time.time() - self.StartTime
+    if (Elapsed <= 0):
+      Elapsed = 1
+    return ("Queued: "     + str(self.Enqueued) +
+            "  Processed: " + str(self.Dequeued) +
+            "  Dropped: "   + str(self.Dropped) +
+            "  MaxDepth: "  + str(self.MaxDepth) + "/" + str(self.MaxSize) +
+            "  In/s: "      + "{:.1f}".format(self.Enqueued / Elapsed) +
+            "  Out/s: "     + "{:.1f}".format(self.Dequeued / Elapsed))
+
+
+
+
+class PacketWorker(threading.Thread):
+  #Takes packets off the capture queue and runs the normal packet callback.
+  #There is only one of these because the callback owns the curses windows.
+  #Setup runs on the worker thread before the first packet.
+  def __init__(self,PacketQueue,Callback,Setup=None):
+    threading.Thread.__init__(self, name="PacketWorker")
+    self.daemon      = True
+    self.PacketQueue = PacketQueue
+    self.Callback    = Callback
+    self.Setup       = Setup
+    self.StatsTime   = time.time()
+    self.running     = True
+
+  def run(self):
+    if (self.Setup != None):
+      self.Setup()
+    while self.running:
+      try:
+        packet = self.PacketQueue.Get(0.5)
+      except queue.Empty:
+        packet = None
+
+      if (packet != None):
+        try:
+          self.Callback(packet)
+        except Exception as ErrorMessage:
+          TraceMessage = traceback.format_exc()
+          AdditionalInfo = "Processing a queued packet"
+          ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
+        finally:
+          self.PacketQueue.Done()
+
+      #refresh queue statistics once a second
+      if (time.time() - self.StatsTime >= 1):
+        self.PacketQueue.UpdateRates()
+        ShowQueueStats(self.PacketQueue)
+        self.StatsTime = time.time()
+
+
+
+
+class StageTimer(object):
+  #Accumulates time spent in each stage of the packet callback.
+  #Begin() at the top of the callback, then Mark('stage') at the end of each
+  #stage charges the time since the previous mark to that stage.
+  def __init__(self):
+    self.Stages    = OrderedDict()
+    self.Counts    = OrderedDict()
+    self.LastMark  = time.perf_counter()
+
+  def Begin(self):
+    self.LastMark = time.perf_counter()
+
+  def Mark(self,Stage):
+    Now = time.perf_counter()
+    self.Stages[Stage] = self.Stages.get(Stage,0.0) + (Now - self.LastMark)
+    self.Counts[Stage] = self.Counts.get(Stage,0) + 1
+    self.LastMark = Now
+
+  def Summary(self):
+    Lines = []
+    Total = sum(self.Stages.values())
+    for Stage, Seconds in self.Stages.items():
+      Percent = (100.0 * Seconds / Total) if Total > 0 else 0
+      Average = 1000000.0 * Seconds / self.Counts[Stage]
+      Lines.append("  {:<10} {:9.3f}s  {:5.1f}%  {:9.1f}us/call".format(Stage,Seconds,Percent,Average))
+    return "\n".join(Lines)
+
+
+
+
+def ReplayPcap(FileName,Callback,Speed,Subtypes):
+  #Feed a recorded capture through the normal packet pipeline.
+  #Speed 0 replays as fast as possible, otherwise frames are released at
+  #Speed times the recorded rate.  Frames the capture filter would have
+  #dropped in the kernel are skipped here.
+  Frames     = 0
+  Filtered   = 0
+  FirstStamp = None
+  StartTime  = time.time()
+
+  for Timestamp, Raw in probeparser.ReadPcap(FileName):
+    if not probeparser.FilterFrame(Raw,Subtypes):
+      Filtered = Filtered + 1
+      continue
+
+    if (Speed > 0):
+      if (FirstStamp == None):
+        FirstStamp = Timestamp
+      Wait = (Timestamp - FirstStamp) / Speed - (time.time() - StartTime)
+      if (Wait > 0):
+        time.sleep(Wait)
+
+    Frames = Frames + 1
+    if (args.fastparse):
+      Callback(Raw)
+    else:
+      Callback(RadioTap(Raw))
+
+  return Frames, Filtered
+
+
+
+
+def ShowQueueStats(PacketQueue):
+  global StatusWindow2
+
+  OutputLine = ("Q:" + str(PacketQueue.Depth()) + "/" + str(PacketQueue.MaxSize) +
+                " In:"   + str(int(PacketQueue.EnqueueRate)) + "/s" +
+                " Out:"  + str(int(PacketQueue.DequeueRate)) + "/s" +
+                " Drop:" + str(PacketQueue.Dropped))
+  StatusWindow2.ScrollPrint(OutputLine,3)
+
 
 
 def ShowIPAddress():
@@ -756,6 +1022,7 @@ def CreateTextWindows():
 
   global stdscr
   global StatusWindow
+  global StatusWindow2
   global TitleWindow
   global Window1
   global Window2
@@ -783,7 +1050,7 @@ def CreateTextWindows():
 
 
   #Window1 Coordinates
-  Window1Height = 12
+  Window1Height = 13
   Window1Length = 40
   Window1x1 = 0
   Window1y1 = 1
@@ -791,7 +1058,7 @@ def CreateTextWindows():
   Window1y2 = Window1y1 + Window1Height
 
   #Window2 Coordinates
-  Window2Height = 12
+  Window2Height = 13
   Window2Length = 40
   Window2x1 = Window1x2 + 1
   Window2y1 = 1
@@ -799,7 +1066,7 @@ def CreateTextWindows():
   Window2y2 = Window2y1 + Window2Height
 
   #Window3 Coordinates
-  Window3Height = 12
+  Window3Height = 13
   Window3Length = 70
   Window3x1 = Window2x2 + 1
   Window3y1 = 1
@@ -807,7 +1074,7 @@ def CreateTextWindows():
   Window3y2 = Window3y1 + Window3Height
 
   #Window4 Coordinates
-  Window4Height = 32
+  Window4Height = 31
   Window4Length = 152
   Window4x1 = 0
   Window4y1 = Window1y2 
@@ -837,7 +1104,7 @@ def CreateTextWindows():
     # Create windows
     TitleWindow   = ProbeWindow('TitleWindow',1,50,0,0,0,50,'N',0) 
     StatusWindow  = ProbeWindow('StatusWindow',1,50,0,51,0,100,'N',0) 
-    StatusWindow2 = ProbeWindow('StatusWindow2',1,30,0,101,0,130,'N',0) 
+    StatusWindow2 = ProbeWindow('StatusWindow2',1,51,0,101,0,152,'N',0) 
     Window1       = ProbeWindow('Window1',Window1Height,Window1Length,Window1y1,Window1x1,Window1y2,Window1x2,'Y',2)
     Window2       = ProbeWindow('Window2',Window2Height,Window2Length,Window2y1,Window2x1,Window2y2,Window2x2,'Y',3)
     Window3       = ProbeWindow('Window3',Window3Height,Window3Length,Window3y1,Window3x1,Window3y2,Window3x2,'Y',4)
@@ -919,6 +1186,7 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
   def StoreMAC(MAC,DeviceType,LogTimeString):
     global RouterList
     global MobileList
+    global UniqueMobile
     global DisplayBars 
     
     global Window1
@@ -934,6 +1202,7 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
     elif(DeviceType == 'mobile'):
       if (MAC not in MobileList):
         MobileList[MAC]=LogTimeString
+        UniqueMobile = len(MobileList)
         #print (*MobileList, sep = "\n")
 
 
@@ -987,6 +1256,7 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
     Key           = ''
     GPSTime = datetime.today()
 
+    Stages.Begin()
     stdscr.refresh()
 
 
@@ -1001,6 +1271,7 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
         LevelFinished = 'Y'
         Finished      = 'Y'
         return
+      Stages.Mark('keyboard')
 
       #Debug info
       Name = inspect.currentframe().f_code.co_name
@@ -1051,61 +1322,78 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
 
       #Add to packet counter
       PacketCount = PacketCount +1
-      Window1.WindowPrint(6,1,("Packets:    " + str(PacketCount)),2)
+      if (CaptureFilter != None and CaptureFilter.Update() > 0):
+        Window1.WindowPrint(6,1,("Packets:    " + str(PacketCount) + " of " + str(CaptureFilter.Seen)),2)
+      else:
+        Window1.WindowPrint(6,1,("Packets:    " + str(PacketCount)),2)
       Window1.TextWindow.refresh()
 
+      #Pull out the handful of fields we use.  Raw frames go through the
+      #fast path parser, anything it can't handle is dissected by scapy
+      Frame = probeparser.ExtractFrame(packet)
+      Stages.Mark('parse')
+
       #we want to record packet type no matter what
-      PacketType = str(packet.type) + '-' + str(packet.subtype)
-      #Window3.ScrollPrint(("PacketType:" + str(packet.type) + '-' + str(packet.subtype)),2)
+      PacketType = str(Frame.Type) + '-' + str(Frame.Subtype)
+      #Window3.ScrollPrint(("PacketType:" + str(Frame.Type) + '-' + str(Frame.Subtype)),2)
 
       # check for packets that show SSID of existing networks
-      if packet.haslayer(Dot11Beacon):
-        SSID = packet.getlayer(Dot11Elt).info
+      if Frame.IsBeacon():
+        SSID = Frame.Info
         DeviceType = 'router'
         RouterCount = RouterCount + 1
         
-        #print (packet.show)  
-        
-        if (SSID == '' or packet.getlayer(Dot11Elt).ID != 0):
-          SSID = 'HIDDEN'
+        if (SSID == b'' or Frame.ElementID != 0):
+          SSID = b'HIDDEN'
 
 
       
       #Look for management frames with probe subtype
-      elif (packet.haslayer(Dot11FCS) or packet.haslayer(Dot11)):
+      else:
 
         #probe response as address1 MAC of 'FF-FF-FF-FF-FF-FF-FF-FF'
         #which means the router is sending out a probe response
         
-        MACDest = str(netaddr.EUI(packet.addr1)).upper()
-        if ( MACDest == 'FF-FF-FF-FF-FF-FF-FF-FF') :
-          DeviceType = 'router'
+        if (Frame.Addr1 is not None):
+          MACDest = str(netaddr.EUI(Frame.Addr1)).upper()
+          if ( MACDest == 'FF-FF-FF-FF-FF-FF-FF-FF') :
+            DeviceType = 'router'
 
         #exit if not a probe request
-        if (packet.type != 0 or packet.subtype != 0x04):
+        if not Frame.IsProbeRequest():
+          Stages.Mark('discard')
           return
 
         DeviceType = 'mobile'
         MobileCount = MobileCount + 1
         
         # include the SSID in the probe frame
-        SSID = packet.info
+        SSID = Frame.Info
         
 
       #Signal strength
-      rssi_val = str(packet.dBm_AntSignal)
+      rssi_val = str(Frame.Signal)
 
     
       # parse mac address and look up the organization from the vendor octets
-      try:
-        MAC = netaddr.EUI(packet.addr2)
-        vendor = MAC.oui.registration().org
-      except netaddr.core.NotRegisteredError:
-        vendor = '--'
+      # the cache skips the registry for known OUIs and randomized MACs
+      MAC    = netaddr.EUI(Frame.Addr2)
+      vendor = Vendors.GetVendor(Frame.Addr2)
           
    
       #Get friendly name for recognized devices
       FriendlyName = GetFriendlyName(str(MAC))
+      Stages.Mark('vendor')
+
+
+      #Randomized MACs are linked to the logical device their probe
+      #fingerprint points to, which is logged with the sighting.  The
+      #Mobile count still counts MACs.
+      LogicalID = None
+      LinkRows  = []
+      if (DeviceType == 'mobile' and Linker != None):
+        LogicalID, LinkRows = Linker.Link(str(MAC), Frame, SSID, LogTimeString)
+        Stages.Mark('link')
       
 
       #Assemble fields for output to logfile  
@@ -1136,8 +1424,25 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
 
         try:
           #Log to the database
-          with conn:
-            InsertGPSLog(conn, (GPSTimeString, lat, lon, rssi_val, str(Channel), PacketType, DeviceType, str(MAC), FriendlyName, vendor, SSID))
+          #Routers beacon many times a second, only log the first one of each window
+          LogRow = True
+          if (DeviceType == 'router' and Beacons != None):
+            LogRow, SummaryRows = Beacons.Check(str(MAC), SSID, Channel, rssi_val, GPSTimeString)
+            for Row in SummaryRows:
+              Writer.AddRow(probedb.BEACON_SUPPRESSED_INSERT, Row)
+
+          #new or changed links of randomized MACs to logical devices
+          for Row in LinkRows:
+            Writer.AddRow(probedb.LOGICAL_DEVICE_UPSERT, Row)
+
+          #Probe requests are folded into per device sessions
+          if (DeviceType == 'mobile' and Sessions != None):
+            LogRow = (args.probe_log != 'sessions')
+            for Row in Sessions.Add(str(MAC), FriendlyName, vendor, rssi_val, Channel, SSID, lat, lon, GPSTimeString):
+              Writer.AddRow(probedb.PROBE_SESSION_INSERT, Row)
+
+          if (LogRow):
+            InsertGPSLog(conn, (GPSTimeString, lat, lon, rssi_val, str(Channel), PacketType, DeviceType, str(MAC), FriendlyName, vendor, SSID, LogicalID))
         
 
 
@@ -1160,7 +1465,8 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
           print("")
           print("")
 
-      StoreMAC(MAC,DeviceType,LogTimeString)
+      StoreMAC(str(MAC),DeviceType,LogTimeString)
+      Stages.Mark('database')
 
     except Exception as ErrorMessage:
       TraceMessage = traceback.format_exc()
@@ -1241,9 +1547,11 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
     Window1.WindowPrint(8,1,("Known Devices: " + str(FriendlyCount)),2)
     Window1.WindowPrint(9,1,("New Records:   " + str(RecordCount)),2)
     Window1.WindowPrint(10,1,("Record Count:  " + str(GPSLogRecordCount)),2)
+    Window1.WindowPrint(11,1,("Vendor Cache:  " + "{:.1f}%".format(Vendors.HitRate())),2)
     
 
     Window1.TextWindow.refresh()
+    Stages.Mark('display')
 
 
     #Display router and mobile counts on unicorn  hat
@@ -1251,6 +1559,7 @@ def build_packet_callback(time_fmt, logger, delimiter, mac_info, ssid, rssi):
       ShowDeviceCount()
       ShowSignalStrength(rssi_val,DeviceType)
       UpdateSignalStrength(rssi_val,DeviceType)
+      Stages.Mark('hat')
        
 
   
@@ -1357,27 +1666,29 @@ def findSSID(pkt):
 # Create sprites                     --
 #--------------------------------------
 
-StatusBarRouter = arcaderetroclock.Sprite(
-  16,
-  1,
-  100,
-  0,
-  0,
-  [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
-)
+#Only needed when the unicorn hat is attached (replay mode runs without one)
+if (HatDisplay):
+  StatusBarRouter = arcaderetroclock.Sprite(
+    16,
+    1,
+    100,
+    0,
+    0,
+    [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
+  )
 
-StatusBarRouter.BarLength = 0
+  StatusBarRouter.BarLength = 0
 
 
-StatusBarMobile = arcaderetroclock.Sprite(
-  16,
-  1,
-  0,
-  0,
-  200,
-  [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
-)
-StatusBarMobile.BarLength = 0
+  StatusBarMobile = arcaderetroclock.Sprite(
+    16,
+    1,
+    0,
+    0,
+    200,
+    [0,0,0,0,0,0,0,0,0,0,0,0,0,0,0,0]
+  )
+  StatusBarMobile.BarLength = 0
 
 
 
@@ -1505,12 +1816,21 @@ def create_connection(db_file):
   """
   conn = None
   try:
-      conn = sqlite3.connect(db_file)
+      conn = probedb.Connect(db_file,args.storage_profile)
   except Error as e:
       FinalCleanup(stdscr)
       print(e)
  
   return conn
+
+
+
+def OpenWorkerConnection():
+  #sqlite connections can only be used on the thread that opened them.  In
+  #queue mode the packet callback, and with it the reports the keyboard
+  #asks for, runs on the worker thread, so the worker opens its own.
+  global conn
+  conn = create_connection(database)
     
     
  
@@ -1522,26 +1842,40 @@ def InsertGPSLog(conn, fields):
   global Window2
   global RecordCount 
   global GPSLogRecordCount
+  global Writer
+  global WriterStatsTime
 
-  #Debug info
-  Name = inspect.currentframe().f_code.co_name
-  Window2.ScrollPrint ("Function: " + Name,2)
+  #The row is committed later, in a batch, by the writer thread
+  Writer.Add(fields)
+  RecordCount = RecordCount + 1
+  GPSLogRecordCount = GPSLogRecordCount + 1
 
-  try:
-    SQLQuery = ''' INSERT INTO GPSLog values (?,?,?,?,?,?,?,?,?,?,?) '''
-    cur = conn.cursor()
-    cur.execute(SQLQuery, fields)
-    conn.commit()
-    RecordCount = RecordCount + 1
-    GPSLogRecordCount = GPSLogRecordCount + 1
+  #show batch size and commit latency every few seconds
+  if (time.time() - WriterStatsTime >= 10 and Writer.Batches > 0):
+    Window2.ScrollPrint("DB batch: " + str(Writer.LastBatchRows) + " rows " + "{:.1f}ms".format(1000 * Writer.LastCommitSeconds),2)
+    WriterStatsTime = time.time()
 
-  except Exception as ErrorMessage:
-    TraceMessage = traceback.format_exc()
-    AdditionalInfo = "SQLQuery: " + SQLQuery
-    ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
 
 
-  return cur.lastrowid    
+def WriterError(ErrorMessage,TraceMessage,AdditionalInfo):
+  #Called from the writer thread when a batch could not be committed
+  ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
+
+
+
+def StopDatabaseThreads():
+  #Write out anything still held in memory, then commit and checkpoint
+  if (Beacons != None):
+    for Row in Beacons.Drain():
+      Writer.AddRow(probedb.BEACON_SUPPRESSED_INSERT, Row)
+  if (Sessions != None):
+    for Row in Sessions.Drain():
+      Writer.AddRow(probedb.PROBE_SESSION_INSERT, Row)
+  if (Rollup != None):
+    Rollup.Stop()
+  Writer.Stop()
+  if (Checkpointer != None):
+    Checkpointer.Stop()
 
 
 
@@ -1552,33 +1886,96 @@ def PopulateFriendlyName(FriendlyNameList):
   
   # Take the values from the FriendlyNameList (imported from file) and insert into
   # the SQLite database
-  # We wil first sort the values to make sure the values are entered in key order
-  # this will improve performance of lookups
-  # the table will also have an index 
-
-
-  cur = conn.cursor()
+  # Only the names that were added, changed or removed since the last start
+  # are written, in one transaction.  Nothing at all is written when the
+  # list hashes the same as last time.
+  # Returns the MACs that changed, None when every device needs refreshing
 
+  Changed = []
   try:
-    #truncate table 
-    SQLQuery = ''' delete from FriendlyName; '''
-    cur.execute(SQLQuery)
-  
-    SQLQuery = ''' INSERT INTO FriendlyName values (NULL,?,?) '''
-  
-    for key,value in FriendlyNameList.items():
-      cur.execute(SQLQuery, (key,value))
-
+    Changed = probedb.SyncFriendlyNames(conn,FriendlyNameList)
 
   except Exception as ErrorMessage:
+    conn.rollback()
     TraceMessage = traceback.format_exc()
-    AdditionalInfo = "SQLQuery: " + SQLQuery
+    AdditionalInfo = "Syncing FriendlyName table"
     ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
 
 
-  return cur.lastrowid    
+  return Changed
+
+
+
 
 
+def ReportDatabases(conn,Hours=None):
+  #main, plus the shards covering the last N hours, attached together.
+  #For all of them (None) there can be more shards than SQLite can attach,
+  #so they come one at a time (probedb.ShardsInTurn).
+  if (Shards == None):
+    return ['main']
+  if (Hours == None):
+    return Shards.Each(conn)
+  Databases = Shards.Attach(conn,Hours)
+  if (Shards.LeftOut > 0):
+    Window2.ScrollPrint("Only the newest " + str(len(Databases) - 1) + " shards attached, " + str(Shards.LeftOut) + " older ones left out",2)
+  return Databases
+
+
+
+
+def FormatValue(Value):
+  #SSIDs are stored as bytes
+  if isinstance(Value,bytes):
+    return Value.decode('UTF-8','replace')
+  return str(Value)
+
+
+def ShowCursorRows(cursor,Window):
+  #Streams query results into a text window a row at a time, nothing is
+  #held in memory
+  Window.ScrollPrint('\t'.join(Column[0] for Column in cursor.description),6)
+  Count = 0
+  for Row in cursor:
+    Window.ScrollPrint('\t'.join(FormatValue(Value) for Value in Row),2)
+    Count = Count + 1
+  Window.ScrollPrint("Rows: " + str(Count),6)
+  return Count
+
+
+def ExportSightings(conn,FileName,Hours):
+  #Analysis/export mode: sightings of the last N hours (0 = all of them)
+  #written to .csv or .xlsx.  pandas is only needed here, so it is imported
+  #here instead of slowing down every start.
+  #.parquet and .arrow are streamed a chunk at a time by probedb instead,
+  #so long drives never have to fit in memory.
+  #.geojson and .kml are maps: a track per device and a point per router,
+  #counted together.
+  Since = int(time.time()) - Hours * 3600 if Hours > 0 else None
+  if (probeexport.ExportFormat(FileName) != None):
+    return probeexport.ExportColumnar(conn,FileName,Schema,ReportDatabases(conn,Hours if Hours > 0 else None),Since)
+  if (probeexport.MapFormat(FileName) != None):
+    Tracks, Routers = probeexport.ExportMap(conn,FileName,Schema,ReportDatabases(conn,Hours if Hours > 0 else None),Since,SessionIdle=args.session_idle)
+    return Tracks + Routers
+
+  import pandas
+
+  if (Hours > 0):
+    Databases = ReportDatabases(conn,Hours)
+    Where     = " where " + probedb.SinceClause(Schema,Hours)
+  else:
+    Databases = ReportDatabases(conn)
+    Where     = ""
+
+  #one database at a time, the shards may not all fit attached at once
+  Results = pandas.concat([pandas.read_sql_query("select * from " + Database + "." + probedb.LogSource(Schema) + Where, conn)
+                           for Database in Databases], ignore_index=True)
+  if FileName.lower().endswith('.xlsx'):
+    Results.to_excel(FileName, index=False)
+  else:
+    Results.to_csv(FileName, index=False)
+  return len(Results)
+
 
 
 
@@ -1593,20 +1990,9 @@ def ShowDistinctDevices(conn):
 
   try:
     cursor = conn.cursor()
-    SQLQuery = """SELECT count(*),  
-                         FriendlyName,
-                         Vendor, 
-                         SSID 
-                    from GPSLog 
-                   where DateTime >= datetime('now','localtime','-24 Hour')
-                   group by FriendlyName,
-                            Vendor, 
-                            SSID
-                   order by FriendlyName ;
-    """
-
-    Results = pandas.read_sql_query(SQLQuery, conn)
-    print(Results)
+    SQLQuery = probedb.DistinctDevicesQuery(Schema,24,ReportDatabases(conn,24))
+    cursor.execute(SQLQuery)
+    ShowCursorRows(cursor,Window4)
     
 
   except Exception as ErrorMessage:
@@ -1626,8 +2012,8 @@ def ShowRecentCaptures(conn):
   global Window4
   global StartRow 
   global Filter
+  global PageKeys
   Output = ""
-  AndClause = ""
 
   
   #Pagination
@@ -1643,34 +2029,19 @@ def ShowRecentCaptures(conn):
   try:
     cursor = conn.cursor()
 
-    #Build the AND clause for the filter
-    if (Filter == "NoFriendly"):
-      AndClause = "and FriendlyName = '--'"
-    elif (Filter == 'NoFriendlyRouter'):
-      AndClause = "and (Device = 'mobile' or (Device = 'router' and FriendlyName <> '--'))"
-    else:
-      AndClause = ""
-
-    SQLQuery = """SELECT DateTime    ,
-                         Device      ,
-                         MACAddress  ,
-                         Lat         ,
-                         Lon         ,
-                         Signal      ,
-                         Channel     ,
-                         PktType     ,
-                         FriendlyName,
-                         Vendor      , 
-                         SSID       
-                    from GPSLog 
-                   where DateTime >= datetime('now','localtime','-72 Hour')
-                   """ + AndClause + """                    
-                   order by DateTime desc
-                   limit """ + str(StartRow) + "," + str(RowsToShow) + """ ;
-    """
-    Results = pandas.read_sql_query(SQLQuery, conn)
+    #Filter (NoFriendly, NoFriendlyRouter) becomes an AND clause in the query.
+    #Pages seek from the key the previous page ended on instead of skipping
+    #StartRow rows, so paging back through 72 hours stays fast.
+    Key    = PageKeys.get((Filter,StartRow))
+    Params = {}
+    if (Key != None):
+      Params = {'AfterTime': Key[0], 'AfterDB': Key[1], 'AfterID': Key[2]}
+    SQLQuery = probedb.RecentCapturesQuery(Schema,72,Filter,StartRow,RowsToShow,ReportDatabases(conn,72),Key != None)
+    cursor.row_factory = sqlite3.Row
+    cursor.execute(SQLQuery, Params)
 
-    for index, row in Results.iterrows():
+    for row in cursor:
+      PageKeys[(Filter,StartRow + RowsToShow)] = (row['SortTime'], row['SortDB'], row['SortID'])
 
       try:
         Output = ""
@@ -1717,18 +2088,16 @@ def ShowUnknownDevices(conn):
     cursor   = conn.cursor()
     SQLQuery = """
     
-      select count(*) as Hits,
-             max(DateTime) as LastSeen,
+      select Hits, LastSeen,
              Device, MACAddress, FriendlyName, Vendor, SSID  
-        from GPSLog               
+        from DeviceSummary
        where FriendlyName = '--'
-       group by Device, MACAddress, FriendlyName, Vendor, SSID  
-       order by DateTime;
+       order by LastSeen;
     """
  
     
-    Results = pandas.read_sql_query(SQLQuery, conn)
-    print(Results)
+    cursor.execute(SQLQuery)
+    ShowCursorRows(cursor,Window4)
 
   except Exception as ErrorMessage:
     TraceMessage = traceback.format_exc()
@@ -1747,19 +2116,28 @@ def ShowRecentDevices(conn):
   Name = inspect.currentframe().f_code.co_name
   Window2.ScrollPrint ("Function: " + Name,2)
 
+  SQLQuery = ""
   try:
     cursor = conn.cursor()
     
+    #the newest 30 of each database, staged one database at a time when
+    #there are more shards than can be attached
+    Source = probedb.StageParts(conn,'RecentDevices',lambda Database: """
+              select * from (select DateTime, PktType, Device, MACAddress, FriendlyName, Vendor, SSID
+                               from """ + Database + '.' + probedb.LogSource(Schema) + """
+                              order by """ + probedb.TimeColumn(Schema) + """ desc
+                              limit 30)""",
+                                ReportDatabases(conn))
     SQLQuery = """
     
       select DateTime, PktType, Device, MACAddress, FriendlyName, Vendor, SSID  
-        from GPSLog               
+        from """ + Source + """
       order by DateTime desc
       limit 30;"""
 
     
-    Results = pandas.read_sql_query(SQLQuery, conn)
-    print(Results)
+    cursor.execute(SQLQuery)
+    ShowCursorRows(cursor,Window4)
     
 
     #print('Total Row(s):', cursor.rowcount)
@@ -1774,25 +2152,63 @@ def ShowRecentDevices(conn):
 
 def GetDatabaseRecordCount(conn):
 
+  #The writer keeps RecordCounts up to date, so this reads one row.  Only
+  #the first start after upgrading has to count(*) everything.
+  RecordCount = 0
   try:
-    cursor = conn.cursor()
-    
-    SQLQuery = """
-      select count(*) as RecordCount from GPSLog;
-      """
-   
-    Results = pandas.read_sql_query(SQLQuery, conn)
-    RecordCount = Results['RecordCount'].values[0]
+    RecordCount = probedb.GetRecordCount(conn)
+    if (RecordCount == None):
+      print ("Counting records...")
+      RecordCount = probedb.ReconcileRecordCounts(conn,Schema,Shards.Overlapping() if Shards != None else [])
 
   except Exception as ErrorMessage:
     TraceMessage = traceback.format_exc()
-    AdditionalInfo = "SQLQuery: " + SQLQuery
+    AdditionalInfo = "Reading RecordCounts"
     ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
 
   return RecordCount
 
 
 
+
+def ShowNearbySightings(conn):
+
+  global Window2
+
+  #Debug info
+  Name = inspect.currentframe().f_code.co_name
+  Window2.ScrollPrint ("Function: " + Name,2)
+
+  #Everything logged within --near-meters of where we are now, found through
+  #the SightingIndex R*Tree instead of scanning every sighting
+  SQLQuery = ""
+  try:
+    Lat = probedb.ToFloat(gpsd.fix.latitude) if UseGPS else None
+    Lon = probedb.ToFloat(gpsd.fix.longitude) if UseGPS else None
+    #gpsd reports NaN (which is not equal to itself) until it has a fix
+    if (Lat == None or Lon == None or Lat != Lat or (Lat == 0 and Lon == 0)):
+      Window2.ScrollPrint("No GPS fix",1)
+      return
+
+    Since = None
+    if (args.near_hours > 0):
+      Since = int(time.time()) - args.near_hours * 3600
+    Params = probedb.AreaParams(Lat,Lon,args.near_meters)
+    Params['Since'] = Since
+    Databases = ReportDatabases(conn,args.near_hours if args.near_hours > 0 else None)
+
+    cursor   = conn.cursor()
+    SQLQuery = probedb.SightingsInAreaQuery(Schema,Since,None,Databases,Radius=True,Rows=1000,conn=conn,Params=Params)
+    cursor.execute("select " + probedb.RecentColumns + " from (" + SQLQuery + ")", Params)
+    ShowCursorRows(cursor,Window4)
+
+  except Exception as ErrorMessage:
+    TraceMessage = traceback.format_exc()
+    AdditionalInfo = "SQLQuery: " + SQLQuery
+    ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
+
+
+
 def ListFriendlyNames(conn):
 
   global stdscr
@@ -1813,8 +2229,8 @@ def ListFriendlyNames(conn):
       """
 
     
-    Results = pandas.read_sql_query(SQLQuery, conn)
-    #print(Results)
+    cursor.execute(SQLQuery)
+    ShowCursorRows(cursor,Window4)
 
   except Exception as ErrorMessage:
     TraceMessage = traceback.format_exc()
@@ -1850,6 +2266,7 @@ def ProcessKeypress(Key):
   global FriendlyCount
   global IPAddress
   global StartRow
+  global PageKeys
   global PauseOutput
 
   count  = 0
@@ -1874,7 +2291,10 @@ def ProcessKeypress(Key):
     arcaderetroclock.ShowScrollingBannerV(IPAddress,0,225,0,3,0.03)
 
   elif (Key == "q"):
-    arcaderetroclock.ShowScrollingBannerV("Quit!",200,0,0,3,0.02)
+    if (HatDisplay):
+      arcaderetroclock.ShowScrollingBannerV("Quit!",200,0,0,3,0.02)
+    #commit whatever the writer still holds
+    StopDatabaseThreads()
     FinalCleanup(stdscr)
 
     os._exit(1)
@@ -1886,6 +2306,7 @@ def ProcessKeypress(Key):
 
       Window2.ScrollPrint("Clear screen",2)
       StartRow = 0
+      PageKeys = {}
   elif (Key == "f"):
     #FriendlyNameList(conn)
     #arcaderetroclock.ShowScrollingBannerV("Friend Filter",200,0,0,3,0.01)
@@ -1899,7 +2320,9 @@ def ProcessKeypress(Key):
     #repopulate the friendlyname table to incorporate changes
     #FriendlyCount = PopulateFriendlyName(FriendlyNameList)
   elif (Key == "r"):
-    arcaderetroclock.ShowScrollingBannerV("Reboot!",100,0,0,3,0.01)
+    if (HatDisplay):
+      arcaderetroclock.ShowScrollingBannerV("Reboot!",100,0,0,3,0.01)
+    StopDatabaseThreads()
     FinalCleanup(stdscr)
     os.execl(sys.executable, sys.executable, *sys.argv)
   elif (Key == "1"):
@@ -1932,6 +2355,11 @@ def ProcessKeypress(Key):
     ShowRecentDevices(conn)
     arcaderetroclock.ShowScrollingBannerV("Recent devices",200,0,0,3,0.01)
 
+  elif (Key == "n"):
+    print ("--Report n: sightings near here")
+    ShowNearbySightings(conn)
+    arcaderetroclock.ShowScrollingBannerV("Near here",200,0,0,3,0.01)
+
   elif (Key == "9"):
     
     Window2.ScrollPrint("--Report 9: Recent Intruders",2)
@@ -1940,7 +2368,7 @@ def ProcessKeypress(Key):
 
   elif (Key == "0"):
     
-    StartRow = StartRow - Window4.DisplayRows
+    StartRow = max(0,StartRow - Window4.DisplayRows)
     Window2.ScrollPrint("--Report 9: Recent Intruders",2)
     ShowRecentCaptures(conn)
 
@@ -1979,6 +2407,7 @@ def PollKeyboard():
     or c == "c"
     or c == "f"
     or c == "i"
+    or c == "n"
     or c == "p"
     or c == "q"
     or c == "r"
@@ -2024,7 +2453,8 @@ def ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo):
   print("--------------------------------------------------------------")
   print("")
   print("")
-  arcaderetroclock.ShowScrollingBannerV("ERROR DETECTED!",255,0,0,3,0.03)
+  if (HatDisplay):
+    arcaderetroclock.ShowScrollingBannerV("ERROR DETECTED!",255,0,0,3,0.03)
 
 
 
@@ -2071,8 +2501,85 @@ LoadConfigData()
 #--------------------
 # Setup Database   --
 #--------------------
-database = "/home/pi/sqlite/GPSProbe"  
+database = args.database
 conn = create_connection(database)
+probedb.CreateSupportTables(conn)
+
+#Schema 2 keeps sightings in normalized tables (see probedb.py)
+Schema = probedb.GetSchemaVersion(conn)
+if (args.schema != None):
+  Schema = args.schema
+if (Schema >= 2):
+  probedb.CreateSchemaV2(conn)
+
+#Repeated router beacons are summarised instead of logged
+Beacons = None
+if (args.beacon_window > 0):
+  Beacons = probedb.BeaconSuppressor(args.beacon_window,args.beacon_rssi_delta)
+
+#Probe requests from the same device are aggregated into sessions
+Sessions = None
+if (args.probe_log != 'raw'):
+  Sessions = probedb.SessionAggregator(args.session_idle)
+
+#Randomized MACs of the same phone are linked to one logical device
+Linker = None
+if (args.link_macs > 0):
+  Linker = probedb.DeviceLinker(probeparser.FrameSignature,args.link_macs,args.link_quiet)
+
+#Sightings can go to one shard file per day or week instead
+Shards = None
+if (args.shards != 'none'):
+  Shards = probedb.ShardSet(database,args.shards,Schema,args.storage_profile,args.shard_keep_days)
+  Shards.Prune(conn=conn)
+
+#Export mode writes a file and stops, nothing is captured.  Router locations
+#are estimated first so a map export picks them up.
+if (args.export != None or args.locate_routers != None):
+  curses.endwin()
+  if (args.locate_routers != None):
+    #numpy is only needed here
+    import probelocate
+    Count = probelocate.LocateRouters(conn,Schema,ReportDatabases(conn),Method=args.locate_routers)
+    print ("Located", Count, "routers")
+  if (args.export != None):
+    Count = ExportSightings(conn,args.export,args.export_hours)
+    print ("Exported", Count, ("tracks and routers" if probeexport.MapFormat(args.export) != None else "sightings"), "to", args.export)
+  sys.exit(0)
+
+#Get count of records in GPSLog table (before the writer and the rollup
+#start changing it)
+GPSLogRecordCount = GetDatabaseRecordCount(conn)
+
+#The writer indexes sightings by position as it goes, the ones logged
+#before there was an index (or before migrating) are indexed once here
+try:
+  if not probedb.SightingIndexReady(conn,Schema):
+    print ("Building SightingIndex...")
+    probedb.RebuildSightingIndex(conn,Schema,Shards.Overlapping() if Shards != None else [])
+
+except Exception as ErrorMessage:
+  TraceMessage = traceback.format_exc()
+  AdditionalInfo = "Building SightingIndex"
+  ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
+
+#Rows are committed by the writer thread in batches
+Writer = probewriter.GPSLogWriter(database,args.commit_rows,args.commit_ms,WriterError,args.storage_profile,Schema,Shards,Sessions)
+Writer.start()
+WriterStatsTime = time.time()
+
+#With WAL the writer never checkpoints inline, this thread does it instead
+Checkpointer = None
+if (probedb.UsesWAL(args.storage_profile)):
+  Checkpointer = probewriter.CheckpointThread(database,args.checkpoint_seconds,OnError=WriterError,Shards=Shards)
+  Checkpointer.start()
+
+#Old sightings are rolled up a chunk at a time, whenever the writer is idle
+Rollup = None
+if (args.rollup_days > 0):
+  Rollup = probewriter.RollupThread(database,args.rollup_days,args.rollup_chunk,Schema=Schema,Profile=args.storage_profile,
+                                Yield=lambda: Writer.Pending() > 0,OnError=WriterError)
+  Rollup.start()
  
 
 #-------------------------------
@@ -2082,16 +2589,38 @@ conn = create_connection(database)
 try:
   #Sort the list before entering into database
   FriendlyNameList =  OrderedDict(sorted(FriendlyNameList.items())) 
-  FriendlyCount = PopulateFriendlyName(FriendlyNameList)
+  FriendlyCount = len(FriendlyNameList)
+  Changed = PopulateFriendlyName(FriendlyNameList)
+  if (Changed == None or len(Changed) > 0):
+    print ("Known devices changed:", "all" if Changed == None else len(Changed))
+    probedb.UpdateSummaryFriendlyNames(conn,Changed)
+    if (Schema >= 2):
+      probedb.UpdateDeviceFriendlyNames(conn,FriendlyNameList,Changed)
+      if (Shards != None):
+        for ShardFile in Shards.Overlapping():
+          ShardConn = sqlite3.connect(ShardFile)
+          probedb.UpdateDeviceFriendlyNames(ShardConn,FriendlyNameList,Changed)
+          ShardConn.close()
 
 except Exception as ErrorMessage:
+  #the writer and rollup threads are already running, so never leave a
+  #write transaction open on the main connection
+  conn.rollback()
   TraceMessage = traceback.format_exc()
   AdditionalInfo = "Populating FriendlyName"
   ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
 
 
-#Get count of records in GPSLog table
-GPSLogRecordCount = GetDatabaseRecordCount(conn)
+#DeviceSummary is new, fill it once from the sightings already logged
+try:
+  if (conn.execute('select count(*) from DeviceSummary').fetchone()[0] == 0):
+    print ("Building DeviceSummary...")
+    probedb.RebuildDeviceSummary(conn,Schema,Shards.Overlapping() if Shards != None else [])
+except Exception as ErrorMessage:
+  conn.rollback()
+  TraceMessage = traceback.format_exc()
+  AdditionalInfo = "Building DeviceSummary"
+  ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
 
 
 
@@ -2127,6 +2656,12 @@ if args.log:
   
   
 
+#Time spent per stage of the packet callback
+Stages = StageTimer()
+
+#MAC vendor lookups
+Vendors = probevendor.VendorCache(args.vendor_cache_size,probevendor.OpenLookup(args.oui_table))
+
 #Assemble captured packets   
 built_packet_cb = build_packet_callback(
   args.time,
@@ -2143,9 +2678,10 @@ IPAddress = ShowIPAddress()
 
 
 #launch thread to switch Channels
-thread = threading.Thread(target=ChangeChannel, args=(args.interface, ), name="ChangeChannel")
-thread.daemon = True
-thread.start()
+if not args.replay:
+  thread = threading.Thread(target=ChangeChannel, args=(args.interface, ), name="ChangeChannel")
+  thread.daemon = True
+  thread.start()
 
 
 #-------------------------------
@@ -2160,10 +2696,91 @@ if(HatDisplay):
   #timer2 = RepeatedTimer(1,ShowPacketCount)
 
 
-while True:
+#-------------------------------
+# Capture queue               --
+#-------------------------------
+#In queue mode the sniff callback only stores the packet, and the worker
+#thread does the parsing, database insert and display updates.  With
+#--fastparse the queue holds raw frame bytes; with scapy sniff() has already
+#dissected the packet before it is queued, so only the rest is moved off the
+#capture thread.
+PacketQueue = None
+if(args.queue):
+  PacketQueue   = CaptureQueue(args.queue_size)
+  conn.close()
+  Worker        = PacketWorker(PacketQueue,built_packet_cb,OpenWorkerConnection)
+  Worker.start()
+  SniffCallback = PacketQueue.Put
+else:
+  SniffCallback = built_packet_cb
+
+
+#-------------------------------
+# Capture filter              --
+#-------------------------------
+#Frames we don't keep are dropped by a BPF filter in the kernel, before they
+#are copied to us.  FilterStats compares what we get with what the
+#interface received and, with --fastparse, counts frames the socket dropped.
+if not args.replay:
+  CaptureFilter = probeparser.FilterStats(args.interface)
+
+
+#-------------------------------
+# Replay a recorded capture   --
+#-------------------------------
+if(args.replay):
+  try:
+    ReplayStart = time.time()
+    ReplayFrames, ReplayFiltered = ReplayPcap(args.replay,SniffCallback,args.replay_speed,CaptureSubtypes)
+
+    #let the worker finish what is still queued, including the packet it is
+    #processing right now, before the last rows are flushed
+    if(PacketQueue != None):
+      PacketQueue.Join()
+    Writer.Flush()
+
+    ReplayElapsed = time.time() - ReplayStart
+    if (ReplayElapsed <= 0):
+      ReplayElapsed = 0.000001
+    FinalCleanup(stdscr)
+
+    print ("")
+    print ("--Replay: " + args.replay + "------------------------")
+    print ("Frames:      ",ReplayFrames,"(" + str(ReplayFiltered) + " removed by capture filter)")
+    print ("Elapsed:     ","{:.2f}s".format(ReplayElapsed))
+    print ("Frames/sec:  ","{:.1f}".format(ReplayFrames / ReplayElapsed))
+    print ("Inserts:     ",RecordCount)
+    print ("Inserts/sec: ","{:.1f}".format(RecordCount / ReplayElapsed))
+    print ("Time per stage:")
+    print (Stages.Summary())
+    print (Vendors.Summary())
+    if(PacketQueue != None):
+      print (PacketQueue.Summary())
+    print (Writer.Summary())
+    if(Checkpointer != None):
+      print (Checkpointer.Summary())
+    if(Rollup != None):
+      print (Rollup.Summary())
+    if(Beacons != None):
+      print (Beacons.Report())
+    if(Sessions != None):
+      print (Sessions.Report())
+    if(Linker != None):
+      print (Linker.Report())
+
+  except Exception as ErrorMessage:
+    TraceMessage = traceback.format_exc()
+    AdditionalInfo = "Replaying " + str(args.replay)
+    ErrorHandler(ErrorMessage,TraceMessage,AdditionalInfo)
+
+
+while not args.replay:
   try:
     #capture packets
-    sniff(iface=args.interface, prn=built_packet_cb, store=0, monitor=True)
+    if(args.fastparse):
+      probeparser.RawSniff(args.interface,SniffCallback,CaptureSubtypes,CaptureFilter)
+    else:
+      sniff(iface=args.interface, prn=SniffCallback, store=0, monitor=True, filter=probeparser.FilterExpression(CaptureSubtypes))
     break #exit loop if sniff exits successfully (user quit)
   except Exception as ErrorMessage:
     TraceMessage = traceback.format_exc()
@@ -2180,11 +2797,35 @@ print ("\nKilling threads...")
 if(UseGPS == True):
   gpsp.running = False
 
-time.sleep(5)
+if(PacketQueue != None):
+  Worker.running = False
+  print (PacketQueue.Summary())
+
+StopDatabaseThreads()
+print (Writer.Summary())
+if(Checkpointer != None):
+  print (Checkpointer.Summary())
+if(Rollup != None):
+  print (Rollup.Summary())
+if(Beacons != None):
+  print (Beacons.Report())
+if(Sessions != None):
+  print (Sessions.Report())
+if(Linker != None):
+  print (Linker.Report())
+
+if(CaptureFilter != None):
+  print (CaptureFilter.Summary(PacketCount))
+  print ("Time per stage:")
+  print (Stages.Summary())
+  print (Vendors.Summary())
+
+if not args.replay:
+  time.sleep(5)
+  thread.stop_ChangeChannel = False
 
-
-thread.stop_ChangeChannel = False
-StatusAreaTimer.stop()
+if(HatDisplay):
+  StatusAreaTimer.stop()
 #timer2.stop()
 
 #gpsp.join() # wait for the thread to finish what it's doing
@@ -0,0 +1,1742 @@
+#------------------------------------------------------------------------------
+#                                                                            --
+#   ____            _          ____  ____                                    --
+#  |  _ \ _ __ ___ | |__   ___|  _ \| __ )                                   --
+#  | |_) | '__/ _ \| '_ \ / _ \ | | |  _ \                                   --
+#  |  __/| | | (_) | |_) |  __/ |_| | |_) |                                  --
+#  |_|   |_|  \___/|_.__/ \___|____/|____/                                   --
+#                                                                            --
+#                                                                            --
+#   SQLite storage for GPSProbe.                                             --
+#                                                                            --
+#   Tables, report queries and the in-memory aggregators of the capture      --
+#   path.  The background threads (writer, checkpoints, rollups) are in      --
+#   probewriter.py, the Parquet/Arrow and map exports in probeexport.py.     --
+#                                                                            --
+#   Version: 1.0                                                             --
+#   Date:    Oct 18, 2026                                                    --
+#------------------------------------------------------------------------------
+#   Version: 1.1                                                             --
+#   Reason:  Storage profiles (WAL etc.) and a background checkpoint thread  --
+#------------------------------------------------------------------------------
+#   Version: 1.2                                                             --
+#   Reason:  Per BSSID beacon suppression, writer accepts any statement      --
+#------------------------------------------------------------------------------
+#   Version: 1.3                                                             --
+#   Reason:  Probe request sighting sessions                                 --
+#------------------------------------------------------------------------------
+#   Version: 2.0                                                             --
+#   Reason:  Normalized schema (Devices, SSIDs, Observations)                --
+#                                                                            --
+#   Convert an existing database to schema 2:                                --
+#     python3 probedb.py migrate /home/pi/sqlite/GPSProbe                    --
+#------------------------------------------------------------------------------
+#   Version: 2.1                                                             --
+#   Reason:  (Time, DeviceID, SSIDID) Observations index next to the Time    --
+#            index, the distinct devices counts come off it without reading  --
+#            the table.  Rows are fetched for the page being shown only      --
+#------------------------------------------------------------------------------
+#   Version: 2.2                                                             --
+#   Reason:  Daily or weekly shard files for the sightings, reports attach   --
+#            the ones they need and retention just deletes old files         --
+#                                                                            --
+#   Delete shards older than 30 days by hand (or use --shard-keep-days):     --
+#     python3 probedb.py prune /home/pi/sqlite/GPSProbe --keep-days 30       --
+#------------------------------------------------------------------------------
+#   Version: 2.3                                                             --
+#   Reason:  Hourly per device rollups replace raw rows after N days         --
+#                                                                            --
+#   Roll up everything older than 7 days in one go:                          --
+#     python3 probedb.py rollup /home/pi/sqlite/GPSProbe --keep-days 7       --
+#------------------------------------------------------------------------------
+#   Version: 2.4                                                             --
+#   Reason:  DeviceSummary kept up to date by the writer                     --
+#                                                                            --
+#   Rebuild it from the sightings (done automatically when it is empty):     --
+#     python3 probedb.py summary /home/pi/sqlite/GPSProbe                    --
+#------------------------------------------------------------------------------
+#   Version: 2.5                                                             --
+#   Reason:  RecordCounts kept by the writer, startup no longer counts rows  --
+#                                                                            --
+#   Recount if the files were changed behind GPSProbe's back:                --
+#     python3 probedb.py reconcile /home/pi/sqlite/GPSProbe                  --
+#------------------------------------------------------------------------------
+#   Version: 2.6                                                             --
+#   Reason:  FriendlyName synced as a diff, skipped when its hash is as      --
+#            stored in SyncHashes (the list has not changed)                 --
+#------------------------------------------------------------------------------
+#   Version: 2.7                                                             --
+#   Reason:  R*Tree index over sighting position and time, kept by the       --
+#            writer, with bounding box and radius queries                    --
+#                                                                            --
+#   Rebuild it (done automatically when it is missing):                      --
+#     python3 probedb.py spatial /home/pi/sqlite/GPSProbe                    --
+#   Sightings within 200m of a spot over the last 24 hours:                  --
+#     python3 probedb.py near /home/pi/sqlite/GPSProbe --lat 43.65           --
+#             --lon -79.38 --meters 200 --hours 24                           --
+#------------------------------------------------------------------------------
+#   Version: 2.8                                                             --
+#   Reason:  Streaming export to Parquet or Arrow IPC (needs pyarrow)        --
+#                                                                            --
+#   The last 48 hours, 50000 rows at a time:                                 --
+#     python3 probedb.py export /home/pi/sqlite/GPSProbe --hours 48          --
+#             --output drive.parquet                                         --
+#------------------------------------------------------------------------------
+#   Version: 2.9                                                             --
+#   Reason:  GeoJSON and KML map export: a track per device (or session)     --
+#            and a point per router, streamed a device at a time             --
+#                                                                            --
+#     python3 probedb.py map /home/pi/sqlite/GPSProbe --output drive.kml     --
+#             --hours 24 --tracks session                                    --
+#------------------------------------------------------------------------------
+#   Version: 2.10                                                            --
+#   Reason:  RouterLocations (estimated by probelocate.py) used for the      --
+#            router points of the map export                                 --
+#------------------------------------------------------------------------------
+#   Version: 2.11                                                            --
+#   Reason:  Randomized MACs linked to logical devices by probe fingerprint  --
+#            (LogicalDevices, and the LogicalID of each sighting)            --
+#                                                                            --
+#   Logical devices seen over the last 24 hours and their MACs:              --
+#     python3 probedb.py logical /home/pi/sqlite/GPSProbe --hours 24         --
+#------------------------------------------------------------------------------
+#   Version: 2.12                                                            --
+#   Reason:  Writer, checkpoint and rollup threads moved to probewriter.py,  --
+#            the columnar and map exports to probeexport.py                  --
+#------------------------------------------------------------------------------
+
+
+import argparse
+import datetime
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+#--------------------------------------
+# Global Variables                   --
+#--------------------------------------
+
+GPSLOG_INSERT = ''' INSERT INTO GPSLog values (?,?,?,?,?,?,?,?,?,?,?,?) '''
+
+BEACON_SUPPRESSED_INSERT = ''' INSERT INTO BeaconSuppressed values (?,?,?,?,?,?,?,?) '''
+
+PROBE_SESSION_INSERT = ''' INSERT INTO ProbeSessions values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) '''
+
+#Hits and first/last seen per device and SSID, added to as rows are written
+DEVICE_SUMMARY_UPSERT = ''' INSERT INTO DeviceSummary values (?,?,?,?,?,?,?,?)
+                              ON CONFLICT (MACAddress, SSID) DO UPDATE
+                             SET Device       = excluded.Device,
+                                 FriendlyName = excluded.FriendlyName,
+                                 Vendor       = excluded.Vendor,
+                                 Hits         = Hits + excluded.Hits,
+                                 FirstSeen    = min(FirstSeen, excluded.FirstSeen),
+                                 LastSeen     = max(LastSeen, excluded.LastSeen) '''
+
+#Link of a randomized MAC to its logical device, written when the MAC is
+#first seen and whenever the link changes.  The latest link wins.
+LOGICAL_DEVICE_UPSERT = ''' INSERT INTO LogicalDevices values (?,?,?,?,?,?,?)
+                              ON CONFLICT (MACAddress) DO UPDATE
+                             SET LogicalID    = excluded.LogicalID,
+                                 Signature    = excluded.Signature,
+                                 SSIDs        = excluded.SSIDs,
+                                 SSIDCount    = excluded.SSIDCount,
+                                 Updated      = excluded.Updated
+                           WHERE excluded.Updated >= LogicalDevices.Updated '''
+
+#Sightings per table (GPSLog or Observations) and per shard file, added to
+#in the same transaction as the rows themselves
+RECORD_COUNT_ADD = ''' INSERT INTO RecordCounts values (?,?)
+                         ON CONFLICT (Source) DO UPDATE SET Rows = Rows + excluded.Rows '''
+
+#One R*Tree entry per sighting with a GPS fix: ID is the rowid in GPSLog
+#(schema 1) or Observations (schema 2) of the same database file, plus
+#latitude, longitude and time (epoch seconds).  R*Tree stores 32 bit
+#floats rounded outwards, so it narrows the search down and the
+#sightings it finds are checked against their own columns.
+SIGHTING_INDEX_TABLE = '''create virtual table if not exists %s.SightingIndex
+                          using rtree(ID, MinLat, MaxLat, MinLon, MaxLon, MinTime, MaxTime)'''
+
+
+#Storage profiles are lists of pragmas applied to every connection.
+#  default  - what sqlite gives us: rollback journal, synchronous=FULL
+#  wal      - readers (the reports) and the writer no longer block each other.
+#             synchronous=NORMAL only syncs at checkpoints, which the
+#             checkpoint thread runs in the background.
+#  fast     - wal without any fsync.  A power cut can lose recent commits
+#             (but not corrupt the database).
+StorageProfiles = {
+  'default' : [],
+  'wal'     : [('journal_mode','WAL'),
+               ('synchronous','NORMAL'),
+               ('cache_size','-8000'),         #8MB
+               ('mmap_size','67108864'),       #64MB
+               ('temp_store','MEMORY'),
+               ('wal_autocheckpoint','0')],    #checkpoints run on CheckpointThread
+  'fast'    : [('journal_mode','WAL'),
+               ('synchronous','OFF'),
+               ('cache_size','-8000'),
+               ('mmap_size','67108864'),
+               ('temp_store','MEMORY'),
+               ('wal_autocheckpoint','0')],
+}
+
+
+def ApplyProfile(conn,Profile,Database='main'):
+  for Pragma, Value in StorageProfiles[Profile]:
+    conn.execute('PRAGMA ' + Database + '.' + Pragma + ' = ' + Value)
+
+
+def UsesWAL(Profile):
+  return ('journal_mode','WAL') in StorageProfiles[Profile]
+
+
+def Connect(DatabaseFile,Profile='default'):
+  conn = sqlite3.connect(DatabaseFile)
+  ApplyProfile(conn,Profile)
+  return conn
+
+
+
+
+#--------------------------------------
+# Support tables                     --
+#--------------------------------------
+
+#Tables added after GPSLog.  They are also in sqlite/CreateTables.sql, but
+#existing databases get them here the first time the new version starts.
+SupportTables = [
+  '''create table if not exists BeaconSuppressed
+     (
+       MACAddress   string,
+       SSID         string,
+       Channel      integer,
+       FirstSeen    text,
+       LastSeen     text,
+       Suppressed   integer,
+       MinSignal    real,
+       MaxSignal    real
+     )''',
+  '''create index if not exists i_BeaconSuppressed_MACAddress on BeaconSuppressed(MACAddress)''',
+  '''create table if not exists ProbeSessions
+     (
+       MACAddress   string,
+       FriendlyName string,
+       Vendor       string,
+       FirstSeen    text,
+       LastSeen     text,
+       Hits         integer,
+       MinSignal    real,
+       MaxSignal    real,
+       AvgSignal    real,
+       Channels     text,
+       SSIDs        text,
+       FirstLat     real,
+       FirstLon     real,
+       LastLat      real,
+       LastLon      real
+     )''',
+  '''create index if not exists i_ProbeSessions_MACAddress on ProbeSessions(MACAddress)''',
+  '''create index if not exists i_ProbeSessions_FirstSeen  on ProbeSessions(FirstSeen)''',
+  '''create table if not exists HourlyRollup
+     (
+       Hour         text,                      --'2026-10-18 14:00:00'
+       MACAddress   string,
+       Device       string,
+       FriendlyName string,
+       Vendor       string,
+       Hits         integer,
+       MinSignal    real,
+       MaxSignal    real,
+       AvgSignal    real,
+       MinLat       real,
+       MaxLat       real,
+       MinLon       real,
+       MaxLon       real,
+       Channels     text,
+       SSIDs        text,
+       primary key (Hour, MACAddress)
+     )''',
+  '''create index if not exists i_HourlyRollup_MACAddress on HourlyRollup(MACAddress)''',
+  '''create table if not exists RollupProgress
+     (
+       Source       text primary key,          --GPSLog or Observations
+       LastRowID    integer,
+       Updated      text
+     )''',
+  '''create table if not exists DeviceSummary
+     (
+       MACAddress   string,
+       SSID         string,
+       Device       string,
+       FriendlyName string,
+       Vendor       string,
+       Hits         integer,
+       FirstSeen    text,
+       LastSeen     text,
+       primary key (MACAddress, SSID)
+     )''',
+  '''create index if not exists i_DeviceSummary_FriendlyName on DeviceSummary(FriendlyName, LastSeen)''',
+  '''create table if not exists RecordCounts
+     (
+       Source       text primary key,          --GPSLog, Observations or a shard file name
+       Rows         integer
+     )''',
+  '''create table if not exists SyncHashes
+     (
+       Name         text primary key,          --what was synced, e.g. FriendlyName
+       Hash         text,
+       Updated      text
+     )''',
+  SIGHTING_INDEX_TABLE % 'main',
+  '''create table if not exists RouterLocations
+     (
+       MACAddress   string primary key,        --as GPSLog / GPSLogView show it
+       Lat          real,
+       Lon          real,
+       Radius       real,                      --meters, 1 sigma (fit) or spread of the samples (centroid)
+       Samples      integer,
+       MaxSignal    real,
+       Method       text,                      --fit or centroid
+       Updated      text
+     )''',
+  '''create table if not exists LogicalDevices
+     (
+       MACAddress   string primary key,        --randomized MACs only, as GPSLog / GPSLogView show it
+       LogicalID    text,                      --'FP-' and 12 hex digits of the fingerprint (and -2, -3 ...)
+       Signature    text,                      --probeparser.ProbeSignature of its probe requests
+       SSIDs        text,                      --json list of the SSIDs it probed for
+       SSIDCount    integer,
+       FirstSeen    text,
+       Updated      text
+     )''',
+  '''create index if not exists i_LogicalDevices_LogicalID on LogicalDevices(LogicalID)''',
+]
+
+
+def CreateSupportTables(conn):
+  for SQL in SupportTables:
+    conn.execute(SQL)
+  AddLogicalIDColumn(conn)
+  conn.commit()
+
+
+def AddLogicalIDColumn(conn,Database='main'):
+  #Sightings carry the logical device of their MAC (DeviceLinker) in
+  #LogicalID, tables created before that get the column added at the end
+  for Table in ('GPSLog','Observations'):
+    if (HasColumn(conn,Database,Table,None) and not HasColumn(conn,Database,Table,'LogicalID')):
+      conn.execute('alter table ' + Database + '.' + Table + ' add column LogicalID text')
+
+
+def HasColumn(conn,Database,Table,Column):
+  #Column None: whether the table exists at all
+  Columns = [Row[1] for Row in conn.execute('PRAGMA ' + Database + '.table_info(' + Table + ')')]
+  return (len(Columns) > 0 if Column == None else Column in Columns)
+
+
+
+
+#--------------------------------------
+# Record counts                      --
+#--------------------------------------
+
+def CountSource(Schema,ShardFile=None):
+  #the RecordCounts key for the main table or a shard
+  if (ShardFile != None):
+    return os.path.basename(ShardFile)
+  return 'Observations' if Schema >= 2 else 'GPSLog'
+
+
+def GetRecordCount(conn):
+  #None until the counts have been reconciled once
+  return conn.execute('select sum(Rows) from RecordCounts').fetchone()[0]
+
+
+def ReconcileRecordCounts(conn,Schema=1,ShardFiles=()):
+  #Recounts the sightings in the main database and every shard (the slow
+  #count(*) the counters are there to avoid) and stores the result
+  Table  = CountSource(Schema)
+  Counts = [(Table, conn.execute('select count(*) from ' + Table).fetchone()[0])]
+  for FileName in ShardFiles:
+    ShardConn = sqlite3.connect(FileName)
+    Counts.append((CountSource(Schema,FileName), ShardConn.execute('select count(*) from ' + Table).fetchone()[0]))
+    ShardConn.close()
+  conn.execute('delete from RecordCounts')
+  conn.executemany('insert into RecordCounts values (?,?)',Counts)
+  conn.commit()
+  return sum(Rows for Source, Rows in Counts)
+
+
+
+
+#--------------------------------------
+# Friendly names                     --
+#--------------------------------------
+
+def FriendlyNameHash(FriendlyNameList):
+  #independent of the order the list was written in
+  Digest = hashlib.sha1()
+  for MAC, Name in sorted(FriendlyNameList.items()):
+    Digest.update((MAC + '\t' + Name + '\n').encode('utf-8'))
+  return Digest.hexdigest()
+
+
+def SyncFriendlyNames(conn,FriendlyNameList):
+  #Brings the FriendlyName table in line with the list from the config file.
+  #Returns the MACs whose name was added, changed or removed: none at all
+  #when the list hashes the same as last time, which is the usual restart.
+  #Returns None (refresh every device) when no hash was stored: on the
+  #first start, and after MigrateToSchemaV2, whose Devices rows carry the
+  #names GPSLog had even where the table itself has nothing to change.
+  Hash = FriendlyNameHash(FriendlyNameList)
+  Row  = conn.execute("select Hash from SyncHashes where Name = 'FriendlyName'").fetchone()
+  if (Row != None and Row[0] == Hash):
+    return []
+
+  Current = dict(conn.execute('select MACAddress, FriendlyName from FriendlyName'))
+  Removed = [MAC for MAC in Current if MAC not in FriendlyNameList]
+  Changed = [MAC for MAC, Name in FriendlyNameList.items() if Current.get(MAC) != Name]
+
+  try:
+    conn.executemany('delete from FriendlyName where MACAddress = ?',[(MAC,) for MAC in Removed + Changed])
+    conn.executemany('insert into FriendlyName values (NULL,?,?)',[(MAC,FriendlyNameList[MAC]) for MAC in Changed])
+    conn.execute("insert or replace into SyncHashes values ('FriendlyName',?,?)",(Hash,time.strftime('%Y-%m-%d %H:%M:%S')))
+    conn.commit()
+  except Exception:
+    conn.rollback()
+    raise
+  if (Row == None):
+    return None
+  return Removed + Changed
+
+
+
+
+#--------------------------------------
+# Device summary                     --
+#--------------------------------------
+
+def SummaryRows(Rows):
+  #Folds a batch of GPSLog rows into one DeviceSummary upsert per device/SSID
+  Summary = OrderedDict()
+  for DateTime, Lat, Lon, Signal, Channel, PktType, Device, MAC, FriendlyName, Vendor, SSID, LogicalID in Rows:
+    DateTime = str(DateTime)
+    Entry = Summary.get((MAC,SSID))
+    if (Entry == None):
+      Summary[(MAC,SSID)] = [MAC, SSID, Device, FriendlyName, Vendor, 1, DateTime, DateTime]
+    else:
+      Entry[2:5] = [Device, FriendlyName, Vendor]
+      Entry[5]   = Entry[5] + 1
+      Entry[6]   = min(Entry[6],DateTime)
+      Entry[7]   = max(Entry[7],DateTime)
+  return Summary.values()
+
+
+def RebuildDeviceSummary(conn,Schema=1,ShardFiles=()):
+  #Builds DeviceSummary from scratch out of the sightings in the main
+  #database and in any shard files.  The shards are attached one at a time
+  #and their totals staged in a temp table (ATTACH can't run inside a
+  #transaction), then the old rows are replaced in one transaction so a
+  #failed rebuild leaves DeviceSummary as it was.
+  conn.execute('drop table if exists temp.RebuildSummary')
+  conn.execute('create temp table RebuildSummary as select * from DeviceSummary where false')
+  Databases = [('main',None)] + [('rebuild',FileName) for FileName in ShardFiles]
+  for Database, FileName in Databases:
+    if (FileName != None):
+      conn.execute('attach database ? as rebuild',(FileName,))
+    conn.execute('''insert into temp.RebuildSummary
+                    select MACAddress, SSID, max(Device), max(FriendlyName), max(Vendor),
+                           count(*), min(DateTime), max(DateTime)
+                      from ''' + Database + '.' + LogSource(Schema) + '''
+                     group by MACAddress, SSID''')
+    conn.commit()
+    if (FileName != None):
+      conn.execute('detach database rebuild')
+  try:
+    conn.execute('delete from DeviceSummary')
+    conn.execute('''insert into DeviceSummary
+                    select MACAddress, SSID, max(Device), max(FriendlyName), max(Vendor),
+                           sum(Hits), min(FirstSeen), max(LastSeen)
+                      from temp.RebuildSummary
+                     group by MACAddress, SSID''')
+    UpdateSummaryFriendlyNames(conn)
+  except Exception:
+    conn.rollback()
+    raise
+  finally:
+    conn.execute('drop table if exists temp.RebuildSummary')
+  return conn.execute('select count(*) from DeviceSummary').fetchone()[0]
+
+
+def UpdateSummaryFriendlyNames(conn,MACs=None):
+  #FriendlyName has just been reloaded from the config file, so the names
+  #given to devices since they were last seen are picked up here.  MACs
+  #limits it to the devices SyncFriendlyNames reported as changed.
+  SQL = '''update DeviceSummary
+              set FriendlyName = coalesce((select f.FriendlyName
+                                             from FriendlyName f
+                                            where f.MACAddress = DeviceSummary.MACAddress), '--')'''
+  if (MACs == None):
+    conn.execute(SQL)
+  else:
+    conn.executemany(SQL + ' where MACAddress = ?',[(MAC,) for MAC in MACs])
+  conn.commit()
+
+
+
+
+#--------------------------------------
+# Schema 2 (normalized)              --
+#--------------------------------------
+
+#Schema 1 is GPSLog: one row of text per sighting.  Schema 2 stores each
+#device and each SSID once and keeps only integer keys, epoch milliseconds,
+#position and signal per observation.  GPSLogView puts the schema 1 columns
+#back together so the reports can read either.
+SCHEMA_VERSION = 2
+
+SchemaV2Tables = [
+  '''create table if not exists Devices
+     (
+       DeviceID     integer primary key,
+       MAC          integer not null unique,   --48 bit MAC address
+       DeviceType   text,
+       Vendor       text,
+       FriendlyName text
+     )''',
+  '''create table if not exists SSIDs
+     (
+       SSIDID       integer primary key,
+       SSID         blob not null unique
+     )''',
+  '''create table if not exists Observations
+     (
+       Time         integer not null,          --epoch milliseconds
+       DeviceID     integer not null,
+       SSIDID       integer,
+       Lat          real,
+       Lon          real,
+       Signal       integer,
+       Channel      integer,
+       PktType      integer,                   --type * 16 + subtype
+       LogicalID    text                       --see DeviceLinker, NULL if not linked
+     )''',
+  #Two time indexes.  The distinct devices report groups a time window by
+  #device and SSID straight off i_Observations_TimeDevice without reading
+  #the table (it still sorts for the GROUP BY).  The recent pages stay on
+  #i_Observations_Time: they read the table and Devices for every row
+  #anyway, and with DeviceID between Time and rowid they would have to sort
+  #sightings that share a Time.  The planner picks the right one for each.
+  #At 1M rows (benchmarks/bench_reports.py) the second index costs 14MB on
+  #top of 95MB and 3.9us against 3.2us per inserted row, and saves about
+  #7ms (97 against 90ms) on the distinct devices report; the recent pages
+  #are unchanged.  Only schema 2 has epoch times, schema 1 keeps the
+  #DateTime text and its index.
+  '''create index if not exists i_Observations_Time       on Observations(Time)''',
+  '''create index if not exists i_Observations_TimeDevice on Observations(Time, DeviceID, SSIDID)''',
+  '''create index if not exists i_Observations_DeviceID   on Observations(DeviceID, Time)''',
+  '''drop view if exists GPSLogView''',
+  '''create view GPSLogView as
+     select datetime(o.Time / 1000, 'unixepoch', 'localtime') as DateTime,
+            o.Lat,
+            o.Lon,
+            o.Signal,
+            o.Channel,
+            (o.PktType >> 4) || '-' || (o.PktType & 15)       as PktType,
+            d.DeviceType                                       as Device,
+            printf('%02X-%02X-%02X-%02X-%02X-%02X',
+                   (d.MAC >> 40) & 255, (d.MAC >> 32) & 255, (d.MAC >> 24) & 255,
+                   (d.MAC >> 16) & 255, (d.MAC >> 8)  & 255,  d.MAC & 255) as MACAddress,
+            d.FriendlyName,
+            d.Vendor,
+            s.SSID,
+            o.LogicalID,
+            o.Time,
+            o.DeviceID,
+            o.rowid                                            as ObservationID
+       from Observations o
+       join Devices d   on d.DeviceID = o.DeviceID
+       left join SSIDs s on s.SSIDID  = o.SSIDID''',
+]
+
+OBSERVATION_INSERT = ''' INSERT INTO Observations values (?,?,?,?,?,?,?,?,?) '''
+
+
+def CreateSchemaV2(conn):
+  for SQL in SchemaV2Tables:
+    conn.execute(SQL)
+  AddLogicalIDColumn(conn)
+  conn.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+  conn.commit()
+
+
+def GetSchemaVersion(conn):
+  #databases created from CreateTables.sql before schema 2 report 0
+  Version = conn.execute('PRAGMA user_version').fetchone()[0]
+  return max(1,Version)
+
+
+def LogSource(Schema):
+  #table (or view) the reports read sightings from
+  return 'GPSLogView' if Schema >= 2 else 'GPSLog'
+
+
+def TimeColumn(Schema):
+  return 'Time' if Schema >= 2 else 'DateTime'
+
+
+def SinceClause(Schema,Hours):
+  #"sighting is newer than N hours" for the given schema.  Schema 2 compares
+  #integers so the Time index can be used directly.
+  if (Schema >= 2):
+    return 'Time >= ' + str(int((time.time() - Hours * 3600) * 1000))
+  return "DateTime >= datetime('now','localtime','-" + str(Hours) + " Hour')"
+
+
+#Report filters as (schema 1 expression, schema 2 expression).  Schema 2
+#tests the device columns on Devices, one primary key lookup per observation.
+ReportFilters = {
+  'NoFriendly'       : ("and FriendlyName = '--'",
+                        "and d.FriendlyName = '--'"),
+  'NoFriendlyRouter' : ("and (Device = 'mobile' or (Device = 'router' and FriendlyName <> '--'))",
+                        "and (d.DeviceType = 'mobile' or (d.DeviceType = 'router' and d.FriendlyName <> '--'))"),
+}
+
+
+def DistinctDevicesPart(Schema,Hours,Database):
+  #Sightings per MAC and SSID
+  if (Schema >= 2):
+    #counts per (DeviceID, SSIDID) are read from i_Observations_TimeDevice
+    #(then sorted for the group by), only the groups are joined to Devices
+    #and SSIDs.  The unary + stops the planner walking
+    #i_Observations_DeviceID to save the group by sort.
+    return '''select g.Hits,
+                     d.MAC as DeviceKey,
+                     d.FriendlyName,
+                     d.Vendor,
+                     s.SSID
+                from (select DeviceID, SSIDID, count(*) as Hits
+                        from ''' + Database + '''.Observations
+                       where ''' + SinceClause(Schema,Hours) + '''
+                       group by +DeviceID, +SSIDID) g
+                join ''' + Database + '''.Devices d    on d.DeviceID = g.DeviceID
+                left join ''' + Database + '''.SSIDs s on s.SSIDID   = g.SSIDID'''
+
+  return '''select g.Hits,
+                   g.MACAddress as DeviceKey,
+                   g.FriendlyName,
+                   g.Vendor,
+                   g.SSID
+              from (select MACAddress, FriendlyName, Vendor, SSID, count(*) as Hits
+                      from ''' + Database + '''.GPSLog
+                     where ''' + SinceClause(Schema,Hours) + '''
+                     group by MACAddress, FriendlyName, Vendor, SSID) g'''
+
+
+def DistinctDevicesQuery(Schema,Hours,Databases=('main',)):
+  #sightings and devices (MACs) per friendly name, vendor and SSID over
+  #the last N hours.  With shards attached each one is grouped on its own
+  #and the devices are counted over all of them.
+  Parts = [DistinctDevicesPart(Schema,Hours,Database) for Database in Databases]
+  return ('''select sum(Hits) as Hits, count(distinct DeviceKey) as Devices, FriendlyName, Vendor, SSID
+               from (''' + '\n union all '.join(Parts) + ''')
+              group by FriendlyName, Vendor, SSID
+              order by FriendlyName''')
+
+
+RecentColumns = '''DateTime, Device, MACAddress, Lat, Lon, Signal, Channel,
+                   PktType, FriendlyName, Vendor, SSID'''
+
+
+def DatabaseFileName(Database):
+  #the file attached as Database, as a constant subquery.  Unlike the
+  #attach name (shard0, shard1...) it stays the same whichever other
+  #shards are attached.
+  return "(select file from pragma_database_list where name = '" + Database + "')"
+
+
+def RecentCapturesPart(Schema,Hours,Filter,Limit,Database,Seek):
+  #SortTime, SortDB, SortID is the key the page ends on: rowids are only
+  #unique within one database, so SortDB (the file the row is in) breaks
+  #ties between shards.  With Seek the part starts just after :AfterTime,
+  #:AfterDB, :AfterID, straight off the index (the plain Time bound is
+  #what gives the index range).
+  DatabaseFile = DatabaseFileName(Database)
+  if (Schema >= 2):
+    #pick the page from the index (DeviceID and rowid come with it), then
+    #read just those rows through the view.  Rows sharing a Time are sorted
+    #by rowid on the way.  The cross join keeps the planner
+    #walking the Time index rather than going device by device.
+    AndClause = ReportFilters[Filter][1] if Filter in ReportFilters else ''
+    if Seek:
+      AndClause = (AndClause + ' and o.Time <= :AfterTime' +
+                   ' and (o.Time, ' + DatabaseFile + ', o.rowid) < (:AfterTime, :AfterDB, :AfterID)')
+    return '''select ''' + RecentColumns + ''', Time as SortTime, ''' + DatabaseFile + ''' as SortDB, ObservationID as SortID
+                from ''' + Database + '''.GPSLogView
+               where ObservationID in
+                     (select o.rowid
+                        from ''' + Database + '''.Observations o
+                       cross join ''' + Database + '''.Devices d on d.DeviceID = o.DeviceID
+                       where o.''' + SinceClause(Schema,Hours) + '''
+                       ''' + AndClause + '''
+                       order by o.Time desc, o.rowid desc
+                       limit ''' + Limit + ''')
+               order by Time desc, ObservationID desc'''
+
+  AndClause = ReportFilters[Filter][0] if Filter in ReportFilters else ''
+  if Seek:
+    AndClause = (AndClause + ' and DateTime <= :AfterTime' +
+                 ' and (DateTime, ' + DatabaseFile + ', rowid) < (:AfterTime, :AfterDB, :AfterID)')
+  return '''select ''' + RecentColumns + ''', DateTime as SortTime, ''' + DatabaseFile + ''' as SortDB, rowid as SortID
+              from ''' + Database + '''.GPSLog
+             where ''' + SinceClause(Schema,Hours) + '''
+             ''' + AndClause + '''
+             order by DateTime desc, rowid desc
+             limit ''' + Limit
+
+
+def RecentCapturesQuery(Schema,Hours,Filter,Offset,Rows,Databases=('main',),Seek=False):
+  #Newest sightings first, one page of them.  Pass Seek (and AfterTime,
+  #AfterDB, AfterID as parameters, the SortTime, SortDB, SortID of the last
+  #row shown) to page by key: every page then costs the same as the first.  Offset is the
+  #fallback for when no key is known.  With shards attached every shard
+  #contributes its first Offset + Rows and the page is cut from those.
+  if Seek:
+    Offset = 0
+  if (len(Databases) == 1):
+    return RecentCapturesPart(Schema,Hours,Filter,str(Offset) + ',' + str(Rows),Databases[0],Seek)
+  Parts = ['select * from (' + RecentCapturesPart(Schema,Hours,Filter,str(Offset + Rows),Database,Seek) + ')'
+           for Database in Databases]
+  return ('''select * from (''' + '\n union all '.join(Parts) + ''')
+              order by SortTime desc, SortDB desc, SortID desc
+              limit ''' + str(Offset) + ',' + str(Rows))
+
+
+def MACText(Column):
+  #48 bit MAC integer -> 'AA-BB-CC-DD-EE-FF', as GPSLogView shows it
+  return ('''printf('%02X-%02X-%02X-%02X-%02X-%02X',
+                    (''' + Column + ''' >> 40) & 255, (''' + Column + ''' >> 32) & 255, (''' + Column + ''' >> 24) & 255,
+                    (''' + Column + ''' >> 16) & 255, (''' + Column + ''' >> 8)  & 255,  ''' + Column + ''' & 255)''')
+
+
+def MACToInt(MAC):
+  #'AA-BB-CC-DD-EE-FF' or 'aa:bb:cc:dd:ee:ff' -> 48 bit integer
+  return int(MAC.replace('-','').replace(':',''),16)
+
+
+def IntToMAC(Value):
+  return '-'.join('%02X' % ((Value >> Shift) & 255) for Shift in (40,32,24,16,8,0))
+
+
+def PacketTypeToInt(PktType):
+  #'0-4' -> 4, '0-8' -> 8
+  Type, Subtype = str(PktType).split('-')
+  return int(Type) * 16 + int(Subtype)
+
+
+class ObservationStore(object):
+  #Turns GPSLog rows into Observations rows, interning devices and SSIDs.
+  #Lives on the writer thread and keeps id caches for that connection.
+  #Database is the attached database holding the tables (a shard).
+  def __init__(self,conn,Database='main'):
+    self.conn         = conn
+    self.Database     = Database
+    self.DeviceIDs    = {}
+    self.SSIDIDs      = {}
+    self.LastTimeText = None
+    self.LastTimeMS   = 0
+
+
+  def DeviceID(self,MAC,DeviceType,Vendor,FriendlyName):
+    Key = MACToInt(MAC)
+    ID  = self.DeviceIDs.get(Key)
+    if (ID == None):
+      self.conn.execute('insert or ignore into ' + self.Database + '.Devices (MAC, DeviceType, Vendor, FriendlyName) values (?,?,?,?)',
+                        (Key, DeviceType, Vendor, FriendlyName))
+      ID = self.conn.execute('select DeviceID from ' + self.Database + '.Devices where MAC = ?',(Key,)).fetchone()[0]
+      self.DeviceIDs[Key] = ID
+    return ID
+
+
+  def SSIDID(self,SSID):
+    if (SSID == None):
+      return None
+    if isinstance(SSID,str):
+      SSID = SSID.encode('UTF-8')
+    ID = self.SSIDIDs.get(SSID)
+    if (ID == None):
+      self.conn.execute('insert or ignore into ' + self.Database + '.SSIDs (SSID) values (?)',(SSID,))
+      ID = self.conn.execute('select SSIDID from ' + self.Database + '.SSIDs where SSID = ?',(SSID,)).fetchone()[0]
+      self.SSIDIDs[SSID] = ID
+    return ID
+
+
+  def TimeMS(self,TimeText):
+    #rows arrive a few per second with the same timestamp text
+    if (TimeText != self.LastTimeText):
+      self.LastTimeText = TimeText
+      self.LastTimeMS   = int(time.mktime(time.strptime(str(TimeText)[0:19],'%Y-%m-%d %H:%M:%S')) * 1000)
+    return self.LastTimeMS
+
+
+  def Observation(self,Row):
+    DateTime, Lat, Lon, Signal, Channel, PktType, Device, MAC, FriendlyName, Vendor, SSID, LogicalID = Row
+    return (self.TimeMS(DateTime),
+            self.DeviceID(MAC,Device,Vendor,FriendlyName),
+            self.SSIDID(SSID),
+            ToFloat(Lat),
+            ToFloat(Lon),
+            int(float(Signal)),
+            int(Channel),
+            PacketTypeToInt(PktType),
+            LogicalID)
+
+
+def UpdateDeviceFriendlyNames(conn,FriendlyNameList,MACs=None):
+  #FriendlyName is stored once per device in schema 2, so refresh it when
+  #the list of known devices changes (only for MACs, when given)
+  if (MACs == None):
+    conn.execute("update Devices set FriendlyName = '--' where FriendlyName <> '--'")
+    MACs = FriendlyNameList.keys()
+  conn.executemany('update Devices set FriendlyName = ? where MAC = ?',
+                   [(FriendlyNameList.get(MAC,'--'),MACToInt(MAC)) for MAC in MACs])
+  conn.commit()
+
+
+def MigrateToSchemaV2(conn,ChunkRows=50000,Progress=None):
+  #Copies GPSLog into the normalized tables, a chunk at a time
+  CreateSchemaV2(conn)
+  Store  = ObservationStore(conn)
+  LastID = 0
+  Copied = 0
+  while True:
+    Rows = conn.execute('select rowid, * from GPSLog where rowid > ? order by rowid limit ?',(LastID,ChunkRows)).fetchall()
+    if (len(Rows) == 0):
+      break
+    conn.executemany(OBSERVATION_INSERT,[Store.Observation(Row[1:]) for Row in Rows])
+    conn.commit()
+    LastID = Rows[-1][0]
+    Copied = Copied + len(Rows)
+    if (Progress != None):
+      Progress(Copied)
+  #the sightings now live in Observations, recount on the next start, and
+  #sync every name into Devices
+  conn.execute('delete from RecordCounts')
+  conn.execute("delete from SyncHashes where Name = 'FriendlyName'")
+  conn.commit()
+  return Copied
+
+
+
+
+#--------------------------------------
+# Time partitioned shards            --
+#--------------------------------------
+
+#With shards the sightings go to one file per day or week next to the main
+#database (GPSProbe-d20261018, GPSProbe-w20261012, named by the first day
+#they cover).  The main file keeps FriendlyName, the support tables and
+#whatever was logged before sharding was turned on.  Dropping old data is
+#just deleting old shard files, no big deletes and no VACUUM.
+ShardPeriods = OrderedDict([('daily','d'), ('weekly','w')])
+ShardDays    = {'d':1, 'w':7}
+
+#GPSLog as created by sqlite/CreateTables.sql, for schema 1 shards
+GPSLogTables = [
+  '''create table if not exists GPSLog
+     (
+       DateTime     text,
+       Lat          real,
+       Lon          real,
+       Signal       real,
+       Channel      integer,
+       PktType      integer,
+       Device       string,
+       MACAddress   string,
+       FriendlyName string,
+       Vendor       string,
+       SSID         string,
+       LogicalID    text
+     )''',
+  '''create index if not exists i_GPSLog_DateTime     on GPSLog(Datetime)''',
+  '''create index if not exists i_GPSLog_FriendlyName on GPSLog(FriendlyName)''',
+  '''create index if not exists i_GPSLog_MACAddress   on GPSLog(MACAddress)''',
+]
+
+
+class ShardSet(object):
+  #The shard files belonging to one database
+  def __init__(self,DatabaseFile,Period='daily',Schema=1,Profile='default',KeepDays=0):
+    self.DatabaseFile = DatabaseFile
+    self.Code         = ShardPeriods[Period]
+    self.Schema       = Schema
+    self.Profile      = Profile
+    self.KeepDays     = KeepDays
+    self.LeftOut      = 0
+    self.Directory    = os.path.dirname(os.path.abspath(DatabaseFile))
+    self.Pattern      = re.compile(re.escape(os.path.basename(DatabaseFile)) + r'-([dw])(\d{8})$')
+
+
+  def PeriodStart(self,When):
+    Day = datetime.date.fromtimestamp(When)
+    if (self.Code == 'w'):
+      #weeks start on Monday
+      Day = Day - datetime.timedelta(days=Day.weekday())
+    return Day
+
+
+  def FileFor(self,When):
+    return self.DatabaseFile + '-' + self.Code + self.PeriodStart(When).strftime('%Y%m%d')
+
+
+  def Files(self):
+    #[(start, end, file name)] oldest first, epoch seconds.  Shards from
+    #a different --shards setting are picked up as well.
+    Shards = []
+    for Name in os.listdir(self.Directory):
+      Match = self.Pattern.match(Name)
+      if Match:
+        Start = datetime.datetime.strptime(Match.group(2),'%Y%m%d')
+        End   = Start + datetime.timedelta(days=ShardDays[Match.group(1)])
+        Shards.append((Start.timestamp(), End.timestamp(), os.path.join(self.Directory,Name)))
+    return sorted(Shards)
+
+
+  def Overlapping(self,Since=None):
+    #shards holding anything newer than Since (all of them for None)
+    return [FileName for Start, End, FileName in self.Files() if (Since == None or End > Since)]
+
+
+  def Create(self,FileName):
+    #a shard is a small database of its own with just the sighting tables
+    conn = Connect(FileName,self.Profile)
+    if (self.Schema >= 2):
+      for SQL in SchemaV2Tables:
+        conn.execute(SQL)
+      conn.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+    else:
+      for SQL in GPSLogTables:
+        conn.execute(SQL)
+    conn.execute(SIGHTING_INDEX_TABLE % 'main')
+    conn.commit()
+    conn.close()
+
+
+  def Prune(self,Now=None,conn=None):
+    #retention: unlink every shard that ended more than KeepDays ago.
+    #Given the main database, their RecordCounts go as well.
+    if (self.KeepDays <= 0):
+      return []
+    if (Now == None):
+      Now = time.time()
+    Removed = []
+    for Start, End, FileName in self.Files():
+      if (End < Now - self.KeepDays * 86400):
+        for Suffix in ('', '-wal', '-shm', '-journal'):
+          if os.path.exists(FileName + Suffix):
+            os.remove(FileName + Suffix)
+        Removed.append(FileName)
+    if (conn != None and len(Removed) > 0):
+      conn.executemany('delete from RecordCounts where Source = ?',[(CountSource(self.Schema,FileName),) for FileName in Removed])
+      conn.commit()
+    return Removed
+
+
+  def Attach(self,conn,Hours=None):
+    #Attaches the shards overlapping the last N hours (or all of them) as
+    #shard0, shard1...  and returns the database names for the report
+    #queries.  SQLite allows 10 attached databases, only the newest fit and
+    #the rest are skipped, LeftOut says how many (the caller has the
+    #console to say so).  Reports that can cover more than that (no hour
+    #limit) use Each() instead.
+    DetachShards(conn)
+    Since = None
+    if (Hours != None):
+      Since = time.time() - Hours * 3600
+    Limit = AttachLimit(conn)
+
+    Files = self.Overlapping(Since)
+    self.LeftOut = max(0,len(Files) - Limit)
+    Databases = ['main']
+    for Number, FileName in enumerate(Files[-Limit:]):
+      Database = 'shard' + str(Number)
+      conn.execute('attach database ? as ' + Database,(FileName,))
+      Databases.append(Database)
+    return Databases
+
+
+  def Each(self,conn,Hours=None):
+    #main and every shard overlapping the last N hours (or all of them),
+    #attached one at a time, so there is no limit on the number of shards
+    Since = None
+    if (Hours != None):
+      Since = time.time() - Hours * 3600
+    return ShardsInTurn(conn,self.Overlapping(Since))
+
+
+
+
+class ShardsInTurn(object):
+  #Database names for reports that read one database at a time (exports,
+  #maps) or that stage each one into a temp table (StageParts): 'main',
+  #then 'shard0' for each shard file in turn, attached while the caller
+  #reads it.  Can be iterated more than once.
+  def __init__(self,conn,ShardFiles):
+    self.conn       = conn
+    self.ShardFiles = ShardFiles
+
+  def __iter__(self):
+    DetachShards(self.conn)
+    yield 'main'
+    for FileName in self.ShardFiles:
+      self.conn.execute('attach database ? as shard0',(FileName,))
+      try:
+        yield 'shard0'
+      finally:
+        self.conn.execute('detach database shard0')
+
+  def __len__(self):
+    return 1 + len(self.ShardFiles)
+
+
+def AttachLimit(conn):
+  if hasattr(conn,'getlimit'):
+    return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+  return 10
+
+
+def StageParts(conn,Name,Part,Databases,Params={}):
+  #Source (for a from clause) holding Part(Database) for every database.
+  #For a list from ShardSet.Attach that is just the union all of the
+  #parts.  With ShardsInTurn the parts are copied into temp.Name one
+  #database at a time, and the report reads that table.
+  if not isinstance(Databases,ShardsInTurn):
+    return '(' + '\nunion all '.join(Part(Database) for Database in Databases) + ')'
+  conn.execute('drop table if exists temp.' + Name)
+  for Number, Database in enumerate(Databases):
+    if (Number == 0):
+      conn.execute('create temp table ' + Name + ' as ' + Part(Database),Params)
+    else:
+      conn.execute('insert into temp.' + Name + ' ' + Part(Database),Params)
+    conn.commit()
+  return 'temp.' + Name
+
+
+def DetachShards(conn):
+  for Row in conn.execute('PRAGMA database_list').fetchall():
+    if Row[1].startswith('shard'):
+      conn.execute('detach database ' + Row[1])
+
+
+
+
+#--------------------------------------
+# Spatial index                      --
+#--------------------------------------
+
+#no fix is '' (schema 1), NULL (schema 2) or 0,0
+HAS_POSITION = 'Lat between -90 and 90 and Lon between -180 and 180 and not (Lat = 0 and Lon = 0)'
+
+METERS_PER_DEGREE = 111320.0
+
+
+def EpochColumn(Schema):
+  #sighting time in epoch seconds (schema 1 DateTime is local time)
+  if (Schema >= 2):
+    return 'Time / 1000'
+  return "cast(strftime('%s', DateTime, 'utc') as integer)"
+
+
+def SightingIndexInsert(Schema,Database='main'):
+  #Indexes every sighting after rowid ? in one statement
+  return ('''insert into ''' + Database + '''.SightingIndex
+             select rowid, Lat, Lat, Lon, Lon, Epoch, Epoch
+               from (select rowid, Lat, Lon, ''' + EpochColumn(Schema) + ''' as Epoch
+                       from ''' + Database + '.' + CountSource(Schema) + '''
+                      where rowid > ?)
+              where ''' + HAS_POSITION)
+
+
+def SightingIndexReady(conn,Schema):
+  #SyncHashes records which table the index was last built from
+  Row = conn.execute("select Hash from SyncHashes where Name = 'SightingIndex'").fetchone()
+  return Row != None and Row[0] == CountSource(Schema)
+
+
+def RebuildSightingIndex(conn,Schema=1,ShardFiles=()):
+  #Indexes every sighting in the main database and in any shard files, one
+  #file at a time.  Returns the number of sightings indexed.
+  Indexed   = 0
+  Databases = [('main',None)] + [('rebuild',FileName) for FileName in ShardFiles]
+  for Database, FileName in Databases:
+    if (FileName != None):
+      conn.execute('attach database ? as rebuild',(FileName,))
+    #dropping is much quicker than deleting an R*Tree entry by entry
+    conn.execute('drop table if exists ' + Database + '.SightingIndex')
+    conn.execute(SIGHTING_INDEX_TABLE % Database)
+    Indexed = Indexed + conn.execute(SightingIndexInsert(Schema,Database),(0,)).rowcount
+    conn.commit()
+    if (FileName != None):
+      conn.execute('detach database rebuild')
+  conn.execute("insert or replace into SyncHashes values ('SightingIndex',?,?)",
+               (CountSource(Schema),time.strftime('%Y-%m-%d %H:%M:%S')))
+  conn.commit()
+  return Indexed
+
+
+def AreaParams(Lat,Lon,Meters):
+  #Query parameters for a circle: its bounding box for the index, and the
+  #centre and scale for the (equirectangular) distance check.  Good to a
+  #fraction of a percent for the few km a drive report would ask for.
+  LonScale = METERS_PER_DEGREE * max(0.01,math.cos(math.radians(Lat)))
+  return {'MinLat': Lat - Meters / METERS_PER_DEGREE, 'MaxLat': Lat + Meters / METERS_PER_DEGREE,
+          'MinLon': Lon - Meters / LonScale,          'MaxLon': Lon + Meters / LonScale,
+          'Lat': Lat, 'Lon': Lon, 'Meters': Meters, 'LonScale': LonScale}
+
+
+def BoxParams(MinLat,MaxLat,MinLon,MaxLon):
+  return {'MinLat': MinLat, 'MaxLat': MaxLat, 'MinLon': MinLon, 'MaxLon': MaxLon}
+
+
+def SightingsInAreaPart(Schema,Database,Since,Until,Radius,Limit):
+  #The index picks the candidate rowids, the sightings' own columns decide
+  IndexClause = '''r.MinLat <= :MaxLat and r.MaxLat >= :MinLat
+                   and r.MinLon <= :MaxLon and r.MaxLon >= :MinLon'''
+  AndClause   = 'and Lat between :MinLat and :MaxLat and Lon between :MinLon and :MaxLon'
+  if (Since != None):
+    IndexClause = IndexClause + ' and r.MaxTime >= :Since'
+    AndClause   = AndClause + ' and ' + EpochColumn(Schema) + ' >= :Since'
+  if (Until != None):
+    IndexClause = IndexClause + ' and r.MinTime <= :Until'
+    AndClause   = AndClause + ' and ' + EpochColumn(Schema) + ' < :Until'
+  if Radius:
+    AndClause = AndClause + ''' and ((Lat - :Lat) * ''' + str(METERS_PER_DEGREE) + ''') * ((Lat - :Lat) * ''' + str(METERS_PER_DEGREE) + ''')
+                                  + ((Lon - :Lon) * :LonScale) * ((Lon - :Lon) * :LonScale) <= :Meters * :Meters'''
+
+  if (Schema >= 2):
+    Source, SortTime, SortID = 'GPSLogView', 'Time', 'ObservationID'
+  else:
+    Source, SortTime, SortID = 'GPSLog', 'DateTime', 'rowid'
+  return ('''select ''' + RecentColumns + ''', ''' + SortTime + ''' as SortTime, ''' + SortID + ''' as SortID
+               from ''' + Database + '.' + Source + '''
+              where ''' + SortID + ''' in (select r.ID from ''' + Database + '''.SightingIndex r
+                                     where ''' + IndexClause + ''')
+              ''' + AndClause + '''
+              order by SortTime desc, SortID desc''' +
+          ('' if Limit == None else ' limit ' + str(Limit)))
+
+
+def SightingsInAreaQuery(Schema,Since=None,Until=None,Databases=('main',),Radius=False,Rows=None,conn=None,Params={}):
+  #Sightings inside a box (BoxParams) or circle (AreaParams, Radius=True)
+  #between Since and Until (epoch seconds, either can be None), newest
+  #first.  Pass the parameters, with Since/Until added, to execute().
+  #Shards from ShardSet.Each are staged first, that needs conn and Params.
+  if (len(Databases) == 1):
+    return SightingsInAreaPart(Schema,next(iter(Databases)),Since,Until,Radius,Rows)
+  Source = StageParts(conn,'AreaSightings',
+                      lambda Database: 'select * from (' + SightingsInAreaPart(Schema,Database,Since,Until,Radius,Rows) + ')',
+                      Databases,Params)
+  return ('''select * from ''' + Source + '''
+              order by SortTime desc, SortID desc''' +
+          ('' if Rows == None else ' limit ' + str(Rows)))
+
+
+
+
+#--------------------------------------
+# Beacon suppression                 --
+#--------------------------------------
+
+class BeaconSuppressor(object):
+  #Routers beacon about ten times a second.  For each (MAC, SSID, channel)
+  #we let the first beacon of a window through, plus any beacon whose signal
+  #has moved more than SignalDelta from the last one logged.  The beacons
+  #dropped in between are summarised into BeaconSuppressed rows, so the
+  #count and signal range are kept.
+  def __init__(self,WindowSeconds=60,SignalDelta=10):
+    self.WindowSeconds = WindowSeconds
+    self.SignalDelta   = SignalDelta
+    self.Windows       = {}
+    self.LastSweep     = time.time()
+    self.Calls         = 0
+    self.Passed        = 0
+    self.Suppressed    = 0
+
+
+  def SummaryRow(self,Key,Window):
+    MAC, SSID, Channel = Key
+    FirstSeen, LastSeen, Suppressed, MinSignal, MaxSignal = Window[1:6]
+    return (MAC, SSID, Channel, FirstSeen, LastSeen, Suppressed, MinSignal, MaxSignal)
+
+
+  def Check(self,MAC,SSID,Channel,Signal,TimeString,Now=None):
+    #Returns (Insert, SummaryRows).  Insert says whether this beacon goes
+    #into GPSLog; SummaryRows are closed windows for BeaconSuppressed.
+    if (Now == None):
+      Now = time.time()
+    Signal   = float(Signal)
+    Key      = (MAC, SSID, Channel)
+    Summary  = []
+    self.Calls = self.Calls + 1
+
+    #about once a second close windows for routers we no longer hear.  This
+    #runs before the suppressed return, since a busy router keeps every call
+    #on that path.
+    if (Now - self.LastSweep >= 1):
+      Summary.extend(self.Sweep(Now))
+
+    #Window: [StartTime, FirstSeen, LastSeen, Suppressed, MinSignal, MaxSignal, LoggedSignal, LastTime]
+    Window = self.Windows.get(Key)
+    if (Window != None and
+        Now - Window[0] < self.WindowSeconds and
+        abs(Signal - Window[6]) <= self.SignalDelta):
+      Window[2] = TimeString
+      Window[3] = Window[3] + 1
+      Window[4] = min(Window[4],Signal)
+      Window[5] = max(Window[5],Signal)
+      Window[7] = Now
+      self.Suppressed = self.Suppressed + 1
+      return False, Summary
+
+    if (Window != None and Window[3] > 0):
+      Summary.append(self.SummaryRow(Key,Window))
+    self.Windows[Key] = [Now, TimeString, TimeString, 0, Signal, Signal, Signal, Now]
+    self.Passed = self.Passed + 1
+    return True, Summary
+
+
+  def Sweep(self,Now):
+    self.LastSweep = Now
+    Summary = []
+    for Key in list(self.Windows):
+      Window = self.Windows[Key]
+      if (Now - Window[7] >= self.WindowSeconds):
+        if (Window[3] > 0):
+          Summary.append(self.SummaryRow(Key,Window))
+        del self.Windows[Key]
+    return Summary
+
+
+  def Drain(self):
+    #close every open window (at shutdown)
+    Summary = [self.SummaryRow(Key,Window) for Key, Window in self.Windows.items() if Window[3] > 0]
+    self.Windows = {}
+    return Summary
+
+
+  def Report(self):
+    return ("Beacons: " + str(self.Passed) + " logged  " + str(self.Suppressed) + " suppressed" +
+            "  open windows: " + str(len(self.Windows)))
+
+
+
+
+#--------------------------------------
+# Probe request sessions             --
+#--------------------------------------
+
+def ToFloat(Value):
+  #lat/lon arrive as strings, and are '' when GPS is off
+  try:
+    return float(Value)
+  except (TypeError, ValueError):
+    return None
+
+
+class ProbeSession(object):
+  __slots__ = ('MAC','FriendlyName','Vendor','FirstSeen','LastSeen','LastTime','Hits',
+               'MinSignal','MaxSignal','SignalTotal','Channels','SSIDs',
+               'FirstLat','FirstLon','LastLat','LastLon')
+
+
+class SessionAggregator(object):
+  #Folds the probe requests of each MAC into one open session.  A session
+  #is closed (and returned as a ProbeSessions row) once the MAC has been
+  #quiet for IdleSeconds.  Add runs on the capture thread and Sweep on the
+  #writer's, hence the lock.
+  def __init__(self,IdleSeconds=300):
+    self.IdleSeconds = IdleSeconds
+    self.Sessions    = {}
+    self.Lock        = threading.Lock()
+    self.LastSweep   = time.time()
+    self.Probes      = 0
+    self.Closed      = 0
+
+
+  def Add(self,MAC,FriendlyName,Vendor,Signal,Channel,SSID,Lat,Lon,TimeString,Now=None):
+    #Returns the rows of any sessions that timed out
+    if (Now == None):
+      Now = time.time()
+    Signal = float(Signal)
+    Lat    = ToFloat(Lat)
+    Lon    = ToFloat(Lon)
+    with self.Lock:
+      return self.AddProbe(MAC,FriendlyName,Vendor,Signal,Channel,SSID,Lat,Lon,TimeString,Now)
+
+
+  def AddProbe(self,MAC,FriendlyName,Vendor,Signal,Channel,SSID,Lat,Lon,TimeString,Now):
+    self.Probes = self.Probes + 1
+
+    Session = self.Sessions.get(MAC)
+    if (Session != None and Now - Session.LastTime >= self.IdleSeconds):
+      Closed = [self.SessionRow(Session)]
+      Session = None
+    else:
+      Closed = []
+
+    if (Session == None):
+      Session = ProbeSession()
+      Session.MAC          = MAC
+      Session.FriendlyName = FriendlyName
+      Session.Vendor       = Vendor
+      Session.FirstSeen    = TimeString
+      Session.Hits         = 0
+      Session.MinSignal    = Signal
+      Session.MaxSignal    = Signal
+      Session.SignalTotal  = 0.0
+      Session.Channels     = set()
+      Session.SSIDs        = []
+      Session.FirstLat     = Lat
+      Session.FirstLon     = Lon
+      Session.LastLat      = Lat
+      Session.LastLon      = Lon
+      self.Sessions[MAC]   = Session
+
+    Session.LastSeen    = TimeString
+    Session.LastTime    = Now
+    Session.Hits        = Session.Hits + 1
+    Session.SignalTotal = Session.SignalTotal + Signal
+    if (Signal < Session.MinSignal):
+      Session.MinSignal = Signal
+    if (Signal > Session.MaxSignal):
+      Session.MaxSignal = Signal
+    Session.Channels.add(int(Channel))
+    if (SSID not in Session.SSIDs):
+      Session.SSIDs.append(SSID)
+    if (Lat != None):
+      if (Session.FirstLat == None):
+        Session.FirstLat = Lat
+        Session.FirstLon = Lon
+      Session.LastLat = Lat
+      Session.LastLon = Lon
+
+    #look for idle sessions about once a second
+    if (Now - self.LastSweep >= 1):
+      Closed.extend(self.CloseIdle(Now))
+    return Closed
+
+
+  def SessionRow(self,Session):
+    self.Closed = self.Closed + 1
+    SSIDs = [SSID.decode('UTF-8','replace') if isinstance(SSID,bytes) else SSID for SSID in Session.SSIDs]
+    return (Session.MAC, Session.FriendlyName, Session.Vendor,
+            Session.FirstSeen, Session.LastSeen, Session.Hits,
+            Session.MinSignal, Session.MaxSignal, Session.SignalTotal / Session.Hits,
+            ','.join(str(Channel) for Channel in sorted(Session.Channels)),
+            json.dumps(SSIDs),
+            Session.FirstLat, Session.FirstLon,
+            Session.LastLat, Session.LastLon)
+
+
+  def Sweep(self,Now=None):
+    #Closes the idle sessions without waiting for the next probe, the
+    #writer calls this from its batch timer
+    if (Now == None):
+      Now = time.time()
+    with self.Lock:
+      return self.CloseIdle(Now)
+
+
+  def CloseIdle(self,Now):
+    self.LastSweep = Now
+    Closed = []
+    for MAC in [MAC for MAC, Session in self.Sessions.items() if Now - Session.LastTime >= self.IdleSeconds]:
+      Closed.append(self.SessionRow(self.Sessions.pop(MAC)))
+    return Closed
+
+
+  def Drain(self):
+    with self.Lock:
+      Closed = [self.SessionRow(Session) for Session in self.Sessions.values()]
+      self.Sessions = {}
+    return Closed
+
+
+  def Report(self):
+    return ("Sessions: " + str(self.Probes) + " probes in " + str(self.Closed) + " closed sessions" +
+            "  open: " + str(len(self.Sessions)))
+
+
+
+
+
+#--------------------------------------
+# Logical devices                    --
+#--------------------------------------
+
+#Phones probe from a new locally administered MAC every few minutes, so one
+#phone looks like dozens of devices.  DeviceLinker ties those MACs back
+#together by what does not change: the probe signature (element order,
+#rates, HT/VHT capabilities) and the set of SSIDs the phone probes for,
+#together the fingerprint.  A phone only uses one MAC at a time, so a new
+#MAC is only linked to a logical device of its fingerprint whose MACs have
+#all been quiet for QUIET_SECONDS, and MACs that turn out to be active at
+#the same time are split apart again.  Phones of the same model that only
+#send wildcard probes share a fingerprint and only when they probe tells
+#them apart, so which of them a MAC belongs to is often a guess
+#(benchmarks/bench_fingerprint.py measures it).  The links are kept with
+#the sightings (LogicalID) and in LogicalDevices, the device counts of the
+#reports still count MACs.
+#
+#The logical device of a randomized MAC is 'FP-' and 12 hex digits of the
+#hash of its fingerprint, with '-2', '-3' ... for the second and third
+#phone with the same fingerprint seen at the same time.  Any other MAC has
+#no logical device.
+
+LOGICAL_PREFIX = 'FP-'
+
+QUIET_SECONDS = 10
+
+
+def IsRandomizedMAC(MAC):
+  #locally administered bit of the first octet
+  return int(MAC[0:2],16) & 0x02 != 0
+
+
+def Fingerprint(Signature,SSIDs):
+  return (Signature,) + tuple(sorted(SSIDs))
+
+
+def LogicalDeviceID(Key,Slot=1):
+  Hash = hashlib.sha1(Key[0].encode('ascii'))
+  for SSID in Key[1:]:
+    Hash.update(b'\x00' + SSID)
+  LogicalID = LOGICAL_PREFIX + Hash.hexdigest()[0:12].upper()
+  if (Slot > 1):
+    LogicalID = LogicalID + '-' + str(Slot)
+  return LogicalID
+
+
+class LinkedMAC(object):
+  __slots__ = ('Signature','SSIDs','Device','FirstSeen','FirstTime','LastSeen')
+
+
+class LogicalDevice(object):
+  #MACs in the order they joined, Current being the one in use.  Slot is
+  #its place among the devices with the same fingerprint.
+  __slots__ = ('ID','Fingerprint','Slot','MACs','Current','LastSeen')
+
+
+class DeviceLinker(object):
+  #Logical devices of the last MaxMACs randomized MACs, and an index of
+  #fingerprint -> logical devices.  SignatureOf turns a probe request into
+  #its signature (probeparser.FrameSignature); it is only called for the
+  #first probe of each MAC.  SSID is the one the probe request asks for,
+  #b'' if none.
+  def __init__(self,SignatureOf,MaxMACs=20000,QuietSeconds=QUIET_SECONDS):
+    self.SignatureOf  = SignatureOf
+    self.MaxMACs      = MaxMACs
+    self.QuietSeconds = QuietSeconds
+    self.MACs         = OrderedDict()
+    self.Devices      = {}
+    self.Index        = {}
+    self.Probes       = 0
+    self.Links        = 0
+    self.Splits       = 0
+
+
+  def Link(self,MAC,Frame,SSID,TimeString,Now=None):
+    #Returns (logical device, rows).  The logical device is None for MACs
+    #that are not randomized.  Rows are for LOGICAL_DEVICE_UPSERT, one for
+    #every MAC that was linked for the first time or moved to another
+    #logical device: this one when it is new or probes for an SSID it had
+    #not probed for before, the ones that joined its logical device while
+    #it was quiet when it turns out to be still in use.
+    if not IsRandomizedMAC(MAC):
+      return None, []
+    if (Now == None):
+      Now = time.time()
+    self.Probes = self.Probes + 1
+
+    Rows  = []
+    Entry = self.MACs.get(MAC)
+    if (Entry == None):
+      Entry = LinkedMAC()
+      Entry.Signature = self.SignatureOf(Frame)
+      Entry.SSIDs     = set()
+      Entry.Device    = None
+      Entry.FirstSeen = TimeString
+      Entry.FirstTime = Now
+      Entry.LastSeen  = Now
+      self.MACs[MAC]  = Entry
+      if (len(self.MACs) > self.MaxMACs):
+        #forgotten, the device was still seen
+        Old, OldEntry = self.MACs.popitem(last=False)
+        self.Unlink(Old,OldEntry.Device)
+    else:
+      self.MACs.move_to_end(MAC)
+      Entry.LastSeen = Now
+      Device = Entry.Device
+      if (Device.Current != MAC):
+        #MACs joined while this one was quiet, and now both are active:
+        #they belong to other phones and go where they would have gone
+        #had this one not been quiet
+        self.Splits = self.Splits + 1
+        Later = Device.MACs[Device.MACs.index(MAC) + 1:]
+        for Other in Later:
+          self.Unlink(Other,Device)
+        for Other in Later:
+          OtherEntry = self.MACs[Other]
+          Key        = Fingerprint(OtherEntry.Signature,OtherEntry.SSIDs)
+          Rows.append(self.Attach(Other,OtherEntry,self.QuietDevice(Key,OtherEntry.FirstTime),TimeString))
+      Device.LastSeen = Now
+      if (SSID == b'' or SSID in Entry.SSIDs):
+        return Device.ID, Rows
+
+    if (SSID != b''):
+      Entry.SSIDs.add(SSID)
+    if (Entry.Device != None):
+      self.Unlink(MAC,Entry.Device)
+    Key = Fingerprint(Entry.Signature,Entry.SSIDs)
+    Rows.append(self.Attach(MAC,Entry,self.QuietDevice(Key,Now),TimeString))
+    return Entry.Device.ID, Rows
+
+
+  def QuietDevice(self,Key,Since):
+    #The logical device with this fingerprint that has been quiet the
+    #longest, as long as it was quiet for QuietSeconds before Since.  One
+    #that was seen a minute ago most likely belongs to a phone that is
+    #still around.
+    Best = None
+    for Device in self.Index.get(Key,()):
+      if (Device.LastSeen <= Since - self.QuietSeconds and (Best == None or Device.LastSeen < Best.LastSeen)):
+        Best = Device
+    return Best
+
+
+  def Attach(self,MAC,Entry,Device,TimeString):
+    #Links MAC to Device, or to a new logical device in the first free slot
+    #of its fingerprint if that is None
+    Key = Fingerprint(Entry.Signature,Entry.SSIDs)
+    if (Device == None):
+      Devices = self.Index.setdefault(Key,[])
+      Used    = set(Other.Slot for Other in Devices)
+      Device  = LogicalDevice()
+      Device.Fingerprint = Key
+      Device.Slot        = 1
+      while (Device.Slot in Used):
+        Device.Slot = Device.Slot + 1
+      Device.ID   = LogicalDeviceID(Key,Device.Slot)
+      Device.MACs = []
+      self.Devices[Device.ID] = Device
+      Devices.append(Device)
+    Device.MACs.append(MAC)
+    Device.Current  = MAC
+    Device.LastSeen = Entry.LastSeen
+    Entry.Device    = Device
+    self.Links      = self.Links + 1
+
+    SSIDs = sorted(SSID.decode('UTF-8','replace') for SSID in Entry.SSIDs)
+    return (MAC, Device.ID, Entry.Signature, json.dumps(SSIDs), len(SSIDs), Entry.FirstSeen, TimeString)
+
+
+  def Unlink(self,MAC,Device):
+    Device.MACs.remove(MAC)
+    if (len(Device.MACs) == 0):
+      #its slot is free for the next phone with this fingerprint
+      del self.Devices[Device.ID]
+      Devices = self.Index[Device.Fingerprint]
+      Devices.remove(Device)
+      if (len(Devices) == 0):
+        del self.Index[Device.Fingerprint]
+      return
+    if (Device.Current == MAC):
+      #back to the MAC that was in use before this one joined
+      Device.Current = Device.MACs[-1]
+    Device.LastSeen = max(self.MACs[Other].LastSeen for Other in Device.MACs)
+
+
+  def Report(self):
+    return ("Linker: " + str(len(self.MACs)) + " randomized MACs in " + str(len(self.Devices)) +
+            " logical devices  probes: " + str(self.Probes) + "  links: " + str(self.Links) +
+            "  splits: " + str(self.Splits))
+
+
+def LogicalDevicesPart(Schema,Hours,Database,Linked=True):
+  #Sightings, first and last seen per mobile MAC and the logical device
+  #they were linked to (Hours None = all of them).  Linked False for
+  #tables written before sightings had a LogicalID.
+  Since     = SinceClause(Schema,Hours) if Hours != None else '1'
+  LogicalID = 'LogicalID' if Linked else 'NULL'
+  if (Schema >= 2):
+    return '''select ''' + MACText('d.MAC') + ''' as MACAddress,
+                     g.LogicalID,
+                     g.Hits,
+                     datetime(g.FirstTime / 1000, 'unixepoch', 'localtime') as FirstSeen,
+                     datetime(g.LastTime / 1000, 'unixepoch', 'localtime')  as LastSeen
+                from (select DeviceID, ''' + LogicalID + ''' as LogicalID, count(*) as Hits,
+                             min(Time) as FirstTime, max(Time) as LastTime
+                        from ''' + Database + '''.Observations
+                       where ''' + Since + '''
+                       group by +DeviceID, 2) g
+                join ''' + Database + '''.Devices d on d.DeviceID = g.DeviceID
+               where d.DeviceType = 'mobile' '''
+
+  return '''select MACAddress,
+                   ''' + LogicalID + ''' as LogicalID,
+                   count(*)      as Hits,
+                   min(DateTime) as FirstSeen,
+                   max(DateTime) as LastSeen
+              from ''' + Database + '''.GPSLog
+             where ''' + Since + '''
+               and Device = 'mobile'
+             group by MACAddress, 2'''
+
+
+def LogicalDevicesQuery(conn,Schema,Hours,Databases=('main',)):
+  #Mobile logical devices seen over the last N hours with the number of
+  #MACs each one used, most MACs first.  Each sighting counts for the
+  #logical device it was linked to when it was logged, MACs that were
+  #never linked are a device of their own.
+  Table  = 'Observations' if Schema >= 2 else 'GPSLog'
+  Source = StageParts(conn,'LogicalSightings',
+                      lambda Database: LogicalDevicesPart(Schema,Hours,Database,HasColumn(conn,Database,Table,'LogicalID')),
+                      Databases)
+  return ('''select coalesce(g.LogicalID, g.MACAddress) as LogicalDevice,
+                    count(distinct g.MACAddress)       as MACs,
+                    sum(g.Hits)                        as Hits,
+                    min(g.FirstSeen)                   as FirstSeen,
+                    max(g.LastSeen)                    as LastSeen,
+                    max(l.SSIDs)                       as SSIDs
+               from ''' + Source + ''' g
+               left join main.LogicalDevices l on l.MACAddress = g.MACAddress
+              group by 1
+              order by MACs desc, Hits desc''')
+
+
+def LogicalDeviceCounts(conn,Schema,Hours,Databases=('main',)):
+  #(mobile MACs, logical devices) seen over the last N hours
+  return conn.execute('select sum(MACs), count(*) from (' + LogicalDevicesQuery(conn,Schema,Hours,Databases) + ')').fetchone()
+
+
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe database maintenance")
+  parser.add_argument('command', choices=['migrate','prune','rollup','summary','reconcile','spatial','near','export','map','logical'],
+                      help="migrate: copy GPSLog into the schema 2 tables, prune: delete old shard files, rollup: replace old rows with hourly rollups, "
+                           "summary: rebuild DeviceSummary, reconcile: recount the rows behind RecordCounts, "
+                           "spatial: rebuild SightingIndex, near: list the sightings around --lat/--lon, "
+                           "export: stream the sightings into a .parquet or .arrow file (needs pyarrow), "
+                           "map: device tracks and router points as a .geojson or .kml file, "
+                           "logical: mobile logical devices and the MACs they used")
+  parser.add_argument('database', help="SQLite database file")
+  parser.add_argument('--chunk', type=int, default=50000, help="rows per transaction (export: rows per batch)")
+  parser.add_argument('--keep-days', type=int, default=30, help="prune: keep shards that ended less than N days ago, rollup: keep raw rows for N days")
+  parser.add_argument('--lat', type=float, help="near: latitude of the spot")
+  parser.add_argument('--lon', type=float, help="near: longitude of the spot")
+  parser.add_argument('--meters', type=float, default=100, help="near: radius around the spot")
+  parser.add_argument('--hours', type=int, default=0, help="near, export, map, logical: only the last N hours (0 = all)")
+  parser.add_argument('--since', help="near, export, map: sightings from this local time on ('2026-10-18 14:00')")
+  parser.add_argument('--until', help="near, export, map: sightings before this local time")
+  parser.add_argument('--output', help="export: .parquet, .arrow or .feather file to write, map: .geojson or .kml")
+  parser.add_argument('--device', action='append', default=[], help="map: only this MAC address or friendly name (repeat for more)")
+  parser.add_argument('--tracks', default='device', choices=['device','session'], help="map: one track per device, or per session")
+  parser.add_argument('--session-idle', type=int, default=300, help="map: start a new session after N seconds without a sighting")
+  args = parser.parse_args()
+
+  #these import probedb themselves
+  import probeexport
+  import probewriter
+
+  #time window of near, export and map in epoch seconds (None = open ended)
+  Since = None
+  Until = None
+  if (args.hours > 0):
+    Since = int(time.time()) - args.hours * 3600
+  if (args.since != None):
+    Since = time.mktime(datetime.datetime.fromisoformat(args.since).timetuple())
+  if (args.until != None):
+    Until = time.mktime(datetime.datetime.fromisoformat(args.until).timetuple())
+  Hours = (time.time() - Since) / 3600 if Since != None else None
+
+  conn = sqlite3.connect(args.database)
+  CreateSupportTables(conn)
+  if (args.command == 'prune'):
+    for FileName in ShardSet(args.database, KeepDays=args.keep_days).Prune(conn=conn):
+      print("removed", FileName)
+  elif (args.command == 'migrate'):
+    if (GetSchemaVersion(conn) >= SCHEMA_VERSION):
+      print(args.database, "is already at schema", SCHEMA_VERSION)
+      sys.exit(0)
+    Copied = MigrateToSchemaV2(conn, args.chunk, lambda Count: print("  copied", Count, "rows", end="\r"))
+    print("")
+    print("Copied", Copied, "GPSLog rows into Observations.")
+    print("Once you have checked the result, reclaim the space with:")
+    print("  sqlite3", args.database, "'drop table GPSLog; drop table LogImport; vacuum;'")
+  elif (args.command == 'rollup'):
+    Rollup = probewriter.RollupThread(args.database, args.keep_days, args.chunk, Schema=GetSchemaVersion(conn))
+    Rollup.RollupAll(conn, lambda Count: print("  rolled up", Count, "rows", end="\r"))
+    print("")
+    print(Rollup.Summary())
+  elif (args.command == 'summary'):
+    Count = RebuildDeviceSummary(conn, GetSchemaVersion(conn), ShardSet(args.database).Overlapping())
+    print("DeviceSummary rebuilt,", Count, "devices/SSIDs")
+  elif (args.command == 'reconcile'):
+    Schema = GetSchemaVersion(conn)
+    Before = GetRecordCount(conn)
+    Count  = ReconcileRecordCounts(conn, Schema, ShardSet(args.database, Schema=Schema).Overlapping())
+    print("RecordCounts:", Count, "rows (was", str(Before) + ")")
+  elif (args.command == 'spatial'):
+    Schema = GetSchemaVersion(conn)
+    Count  = RebuildSightingIndex(conn, Schema, ShardSet(args.database, Schema=Schema).Overlapping())
+    print("SightingIndex rebuilt,", Count, "sightings with a position")
+  elif (args.command == 'near'):
+    if (args.lat == None or args.lon == None):
+      parser.error("near needs --lat and --lon")
+    Schema = GetSchemaVersion(conn)
+    Params = AreaParams(args.lat, args.lon, args.meters)
+    Params['Since'] = Since
+    Params['Until'] = Until
+    Databases = ShardSet(args.database, Schema=Schema).Each(conn, Hours)
+    Count = 0
+    for Row in conn.execute(SightingsInAreaQuery(Schema, Since, Until, Databases, Radius=True, conn=conn, Params=Params), Params):
+      print('\t'.join(Value.decode('UTF-8','replace') if isinstance(Value,bytes) else str(Value) for Value in Row[:-2]))
+      Count = Count + 1
+    print(Count, "sightings within", args.meters, "m")
+  elif (args.command == 'export'):
+    if (args.output == None or probeexport.ExportFormat(args.output) == None):
+      parser.error("export needs --output ending in .parquet, .arrow or .feather")
+    Schema    = GetSchemaVersion(conn)
+    Databases = ShardSet(args.database, Schema=Schema).Each(conn, Hours)
+    Count = probeexport.ExportColumnar(conn, args.output, Schema, Databases, Since, Until, args.chunk,
+                                       lambda Count: print("  exported", Count, "rows", end="\r"))
+    print("")
+    print("Exported", Count, "sightings to", args.output, "(" + str(os.path.getsize(args.output)) + " bytes)")
+  elif (args.command == 'map'):
+    if (args.output == None or probeexport.MapFormat(args.output) == None):
+      parser.error("map needs --output ending in .geojson or .kml")
+    Schema    = GetSchemaVersion(conn)
+    Databases = ShardSet(args.database, Schema=Schema).Each(conn, Hours)
+    Tracks, Routers = probeexport.ExportMap(conn, args.output, Schema, Databases, Since, Until, args.device, args.tracks, args.session_idle)
+    print("Wrote", Tracks, "tracks and", Routers, "routers to", args.output)
+  elif (args.command == 'logical'):
+    Schema    = GetSchemaVersion(conn)
+    Databases = ShardSet(args.database, Schema=Schema).Each(conn, Hours)
+    MACs      = 0
+    Devices   = 0
+    for LogicalDevice, Count, Hits, FirstSeen, LastSeen, SSIDs in conn.execute(LogicalDevicesQuery(conn, Schema, Hours, Databases)):
+      print('\t'.join([LogicalDevice, str(Count), str(Hits), FirstSeen, LastSeen, SSIDs or '']))
+      MACs    = MACs + Count
+      Devices = Devices + 1
+    print(MACs, "mobile MACs,", Devices, "logical devices")
+  conn.close()
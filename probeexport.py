@@ -0,0 +1,400 @@
+#------------------------------------------------------------------------------
+#                                                                            --
+#   ____            _             _____                       _              --
+#  |  _ \ _ __ ___ | |__   ___   | ____|_  ___ __   ___  _ __| |_            --
+#  | |_) | '__/ _ \| '_ \ / _ \  |  _| \ \/ / '_ \ / _ \| '__| __|           --
+#  |  __/| | | (_) | |_) |  __/  | |___ >  <| |_) | (_) | |  | |_            --
+#  |_|   |_|  \___/|_.__/ \___|  |_____/_/\_\ .__/ \___/|_|   \__|           --
+#                                           |_|                              --
+#                                                                            --
+#   Sightings out of the GPSProbe database, as files for other tools.        --
+#                                                                            --
+#   ExportColumnar streams them into a Parquet or Arrow IPC file (needs      --
+#   pyarrow), ExportMap writes a GeoJSON or KML map with a track per         --
+#   device (or session) and a point per router.  Both read one database      --
+#   at a time, so shards work the same as a single file:                     --
+#     python3 probedb.py export /home/pi/sqlite/GPSProbe --hours 48          --
+#             --output drive.parquet                                         --
+#     python3 probedb.py map /home/pi/sqlite/GPSProbe --output drive.kml     --
+#                                                                            --
+#   Version: 1.0                                                             --
+#   Date:    Oct 18, 2026                                                    --
+#------------------------------------------------------------------------------
+
+
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+import probedb
+
+
+
+
+#--------------------------------------
+# Columnar export                    --
+#--------------------------------------
+
+#Rows fetched, converted and written per batch (and Parquet row group).
+#Memory stays at about one batch however big the table is.
+EXPORT_CHUNK_ROWS = 50000
+
+#Column name and arrow type name.  'dictionary' columns repeat a few values
+#over and over and are written as int32 codes into a string dictionary.
+ExportColumns = [('Time',         'timestamp'),
+                 ('Lat',          'float64'),
+                 ('Lon',          'float64'),
+                 ('Signal',       'int16'),
+                 ('Channel',      'int16'),
+                 ('PktType',      'uint8'),
+                 ('Device',       'dictionary'),
+                 ('MACAddress',   'string'),
+                 ('FriendlyName', 'dictionary'),
+                 ('Vendor',       'dictionary'),
+                 ('SSID',         'dictionary')]
+
+
+def ExportQuery(Schema,Database,Since=None,Until=None):
+  #Sightings in ExportColumns order, already typed by SQLite: Time in epoch
+  #milliseconds, NULL for a missing fix, PktType as type * 16 + subtype
+  if (Schema >= 2):
+    Where = 'true'
+    if (Since != None):
+      Where = Where + ' and o.Time >= ' + str(int(Since * 1000))
+    if (Until != None):
+      Where = Where + ' and o.Time < ' + str(int(Until * 1000))
+    #MACAddress formatted as GPSLogView does it
+    return '''select o.Time, o.Lat, o.Lon, o.Signal, o.Channel, o.PktType, d.DeviceType,
+                     printf('%02X-%02X-%02X-%02X-%02X-%02X',
+                            (d.MAC >> 40) & 255, (d.MAC >> 32) & 255, (d.MAC >> 24) & 255,
+                            (d.MAC >> 16) & 255, (d.MAC >> 8)  & 255,  d.MAC & 255),
+                     d.FriendlyName, d.Vendor, s.SSID
+                from ''' + Database + '''.Observations o
+                join ''' + Database + '''.Devices d   on d.DeviceID = o.DeviceID
+                left join ''' + Database + '''.SSIDs s on s.SSIDID = o.SSIDID
+               where ''' + Where
+
+  Where = 'true'
+  if (Since != None):
+    Where = Where + " and DateTime >= datetime(" + str(int(Since)) + ", 'unixepoch', 'localtime')"
+  if (Until != None):
+    Where = Where + " and DateTime < datetime(" + str(int(Until)) + ", 'unixepoch', 'localtime')"
+  return '''select ''' + probedb.EpochColumn(1) + ''' * 1000,
+                   case when typeof(Lat) in ('real','integer') then Lat end,
+                   case when typeof(Lon) in ('real','integer') then Lon end,
+                   cast(Signal as integer), cast(Channel as integer),
+                   cast(substr(PktType, 1, instr(PktType, '-') - 1) as integer) * 16
+                     + cast(substr(PktType, instr(PktType, '-') + 1) as integer),
+                   Device, MACAddress, FriendlyName, Vendor, SSID
+              from ''' + Database + '''.GPSLog
+             where ''' + Where
+
+
+def ExportFormat(FileName):
+  #'parquet' or 'arrow' (IPC file, also read as .feather), by extension
+  Extension = os.path.splitext(FileName)[1].lower()
+  if (Extension == '.parquet'):
+    return 'parquet'
+  if (Extension in ('.arrow','.feather','.ipc')):
+    return 'arrow'
+  return None
+
+
+def ExportColumnar(conn,FileName,Schema=1,Databases=('main',),Since=None,Until=None,ChunkRows=EXPORT_CHUNK_ROWS,Progress=None):
+  #Streams the sightings of each database in turn into a Parquet or Arrow
+  #file, ChunkRows at a time.  Since/Until are epoch seconds (None = no
+  #limit).  pyarrow is only needed here, so it is imported here.
+  import pyarrow
+
+  Types = {'timestamp':  pyarrow.timestamp('ms', tz='UTC'),
+           'float64':    pyarrow.float64(),
+           'int16':      pyarrow.int16(),
+           'uint8':      pyarrow.uint8(),
+           'string':     pyarrow.string(),
+           'dictionary': pyarrow.dictionary(pyarrow.int32(), pyarrow.string())}
+  ArrowSchema = pyarrow.schema([(Name, Types[Type]) for Name, Type in ExportColumns])
+
+  #One dictionary per column for the whole file, so every batch after the
+  #first only adds the values it is the first to use (a delta)
+  Codes  = dict((Index, {}) for Index, (Name, Type) in enumerate(ExportColumns) if Type == 'dictionary')
+  Values = dict((Index, []) for Index in Codes)
+
+  def Text(Value):
+    if isinstance(Value,bytes):
+      return Value.decode('UTF-8','replace')
+    return Value
+
+  def Encode(Index,Column):
+    Lookup = Codes[Index]
+    Known  = Values[Index]
+    Result = []
+    for Value in Column:
+      if (Value == None):
+        Result.append(None)
+        continue
+      Code = Lookup.get(Value)
+      if (Code == None):
+        Code = len(Known)
+        Lookup[Value] = Code
+        Known.append(Text(Value))
+      Result.append(Code)
+    return pyarrow.DictionaryArray.from_arrays(pyarrow.array(Result, pyarrow.int32()),
+                                               pyarrow.array(Known, pyarrow.string()))
+
+  def Batch(Rows):
+    Arrays = []
+    for Index, Column in enumerate(zip(*Rows)):
+      if (Index in Codes):
+        Arrays.append(Encode(Index,Column))
+      elif (ExportColumns[Index][1] == 'string'):
+        Arrays.append(pyarrow.array([Text(Value) for Value in Column], pyarrow.string()))
+      else:
+        Arrays.append(pyarrow.array(Column, Types[ExportColumns[Index][1]]))
+    return pyarrow.record_batch(Arrays, schema=ArrowSchema)
+
+  Format = ExportFormat(FileName)
+  if (Format == 'parquet'):
+    import pyarrow.parquet
+    Writer = pyarrow.parquet.ParquetWriter(FileName, ArrowSchema)
+  elif (Format == 'arrow'):
+    import pyarrow.ipc
+    Writer = pyarrow.ipc.new_file(FileName, ArrowSchema, options=pyarrow.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+  else:
+    raise ValueError(FileName + " is not a .parquet, .arrow or .feather file")
+
+  Exported = 0
+  try:
+    for Database in Databases:
+      cursor = conn.execute(ExportQuery(Schema,Database,Since,Until))
+      while True:
+        Rows = cursor.fetchmany(ChunkRows)
+        if (len(Rows) == 0):
+          break
+        Writer.write_batch(Batch(Rows))
+        Exported = Exported + len(Rows)
+        if (Progress != None):
+          Progress(Exported)
+  finally:
+    Writer.close()
+  return Exported
+
+
+
+
+#--------------------------------------
+# Map export                         --
+#--------------------------------------
+
+#A track is written out every MAX_TRACK_POINTS points (the rest of it
+#carries on in the next feature), so one device seen all day never has to
+#be held in memory in one piece
+MAX_TRACK_POINTS = 5000
+
+
+def MapFormat(FileName):
+  #'geojson' or 'kml', by extension
+  Extension = os.path.splitext(FileName)[1].lower()
+  if (Extension in ('.geojson','.json')):
+    return 'geojson'
+  if (Extension == '.kml'):
+    return 'kml'
+  return None
+
+
+MACPattern = re.compile(r'^[0-9A-Fa-f]{2}([-:][0-9A-Fa-f]{2}){5}$')
+
+
+def MapWhere(Schema,Since,Until,Devices):
+  #HAS_POSITION plus the time window and device filters.  Devices are MAC
+  #addresses (in either spelling, GPSLog has aa:bb:.. and GPSLogView AA-BB-..)
+  #or friendly names, returned as parameters for the query.
+  Where  = probedb.HAS_POSITION + ' and ' + probedb.EpochColumn(Schema) + ' is not null'
+  Params = []
+  Names  = []
+  for Device in Devices:
+    Names.append(Device)
+    if MACPattern.match(Device):
+      Names.append(probedb.IntToMAC(probedb.MACToInt(Device)))
+      Names.append(probedb.IntToMAC(probedb.MACToInt(Device)).replace('-',':').lower())
+  Devices = list(OrderedDict.fromkeys(Names))
+  if (Since != None):
+    Where = Where + ' and ' + probedb.EpochColumn(Schema) + ' >= ' + str(int(Since))
+  if (Until != None):
+    Where = Where + ' and ' + probedb.EpochColumn(Schema) + ' < ' + str(int(Until))
+  if (len(Devices) > 0):
+    Marks = ','.join('?' * len(Devices))
+    Where = Where + ' and (MACAddress in (' + Marks + ') or FriendlyName in (' + Marks + '))'
+    Params = list(Devices) + list(Devices)
+  return Where, Params
+
+
+def TrackQuery(Schema,Database,Where):
+  #every non router sighting with a position, a device at a time, in time
+  #order (straight off i_Observations_DeviceID in schema 2)
+  if (Schema >= 2):
+    Order = 'DeviceID, Time'
+  else:
+    Order = 'MACAddress, DateTime'
+  return '''select MACAddress, Device, FriendlyName, Vendor, ''' + probedb.EpochColumn(Schema) + ''' as Epoch, Lat, Lon
+              from ''' + Database + '.' + probedb.LogSource(Schema) + '''
+             where Device <> 'router' and ''' + Where + '''
+             order by ''' + Order
+
+
+def RouterQuery(Schema,Database,Where):
+  #One point per router: its RouterLocations estimate when probelocate.py
+  #has made one, otherwise where its signal was strongest (sqlite takes the
+  #bare columns from the row max() picked)
+  return '''select r.MACAddress, r.FriendlyName, r.Vendor, r.SSID, r.Signal,
+                   coalesce(l.Lat, r.Lat), coalesce(l.Lon, r.Lon), l.Radius, coalesce(l.Method, 'strongest'),
+                   r.Hits, r.FirstSeen, r.LastSeen
+              from (select MACAddress, FriendlyName, Vendor, SSID, max(Signal) as Signal, Lat, Lon,
+                           count(*) as Hits, min(''' + probedb.EpochColumn(Schema) + ''') as FirstSeen,
+                           max(''' + probedb.EpochColumn(Schema) + ''') as LastSeen
+                      from ''' + Database + '.' + probedb.LogSource(Schema) + '''
+                     where Device = 'router' and ''' + Where + '''
+                     group by MACAddress) r
+              left join main.RouterLocations l on l.MACAddress = r.MACAddress'''
+
+
+def ISOTime(Epoch):
+  return time.strftime('%Y-%m-%dT%H:%M:%SZ',time.gmtime(Epoch))
+
+
+def PropertyText(Value):
+  if isinstance(Value,bytes):
+    return Value.decode('UTF-8','replace')
+  return '' if Value == None else str(Value)
+
+
+class GeoJSONMap(object):
+  #One FeatureCollection, written a feature at a time.  Track times go in
+  #the coordTimes property the way togeojson and most viewers expect.
+  def __init__(self,File):
+    self.File  = File
+    self.First = True
+    self.File.write('{"type": "FeatureCollection", "features": [\n')
+
+
+  def Feature(self,Geometry,Properties):
+    if not self.First:
+      self.File.write(',\n')
+    self.First = False
+    json.dump({'type': 'Feature', 'geometry': Geometry, 'properties': Properties}, self.File)
+
+
+  def Track(self,Properties,Points):
+    Properties = dict(Properties, coordTimes=[ISOTime(Epoch) for Epoch, Lat, Lon in Points])
+    if (len(Points) == 1):
+      self.Feature({'type': 'Point', 'coordinates': [Points[0][2], Points[0][1]]}, Properties)
+    else:
+      self.Feature({'type': 'LineString', 'coordinates': [[Lon, Lat] for Epoch, Lat, Lon in Points]}, Properties)
+
+
+  def Router(self,Properties,Lat,Lon):
+    self.Feature({'type': 'Point', 'coordinates': [Lon, Lat]}, Properties)
+
+
+  def Folder(self,Name):
+    pass
+
+
+  def Close(self):
+    self.File.write('\n]}\n')
+
+
+class KMLMap(object):
+  #A KML document with a folder per layer: gx:Track placemarks (a <when>
+  #per point) for devices, plain points with a TimeSpan for routers
+  def __init__(self,File):
+    self.File   = File
+    self.Open   = False
+    self.File.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<kml xmlns="http://www.opengis.net/kml/2.2" xmlns:gx="http://www.google.com/kml/ext/2.2">\n'
+                    '<Document>\n')
+
+
+  def Folder(self,Name):
+    if self.Open:
+      self.File.write('</Folder>\n')
+    self.File.write('<Folder><name>' + escape(Name) + '</name>\n')
+    self.Open = True
+
+
+  def Placemark(self,Properties,Body):
+    Name = Properties['FriendlyName'] if Properties['FriendlyName'] not in ('','--') else Properties['MACAddress']
+    Data = ''.join('<Data name="' + escape(Key) + '"><value>' + escape(PropertyText(Value)) + '</value></Data>'
+                   for Key, Value in Properties.items())
+    self.File.write('<Placemark><name>' + escape(Name) + '</name><ExtendedData>' + Data + '</ExtendedData>' +
+                    Body + '</Placemark>\n')
+
+
+  def Track(self,Properties,Points):
+    self.Placemark(Properties,
+                   '<gx:Track>' +
+                   ''.join('<when>' + ISOTime(Epoch) + '</when>' for Epoch, Lat, Lon in Points) +
+                   ''.join('<gx:coord>' + repr(Lon) + ' ' + repr(Lat) + ' 0</gx:coord>' for Epoch, Lat, Lon in Points) +
+                   '</gx:Track>')
+
+
+  def Router(self,Properties,Lat,Lon):
+    self.Placemark(Properties,
+                   '<TimeSpan><begin>' + Properties['FirstSeen'] + '</begin><end>' + Properties['LastSeen'] + '</end></TimeSpan>'
+                   '<Point><coordinates>' + repr(Lon) + ',' + repr(Lat) + ',0</coordinates></Point>')
+
+
+  def Close(self):
+    if self.Open:
+      self.File.write('</Folder>\n')
+    self.File.write('</Document>\n</kml>\n')
+
+
+def ExportMap(conn,FileName,Schema=1,Databases=('main',),Since=None,Until=None,Devices=(),Tracks='device',SessionIdle=300):
+  #Writes a GeoJSON or KML map of the sightings: a track per device (or per
+  #session, a new one after SessionIdle seconds without a sighting) and a
+  #point per router.  Rows are read in device order straight off the
+  #cursor, at most MAX_TRACK_POINTS are held at a time.  Each database
+  #(main, shards) is read in turn, so with shards a device gets a track
+  #per shard file.  Returns (tracks, routers).
+  Format = MapFormat(FileName)
+  if (Format == None):
+    raise ValueError(FileName + " is not a .geojson or .kml file")
+  Where, Params = MapWhere(Schema,Since,Until,Devices)
+  TrackCount  = 0
+  RouterCount = 0
+
+  with open(FileName,'w',encoding='utf-8') as File:
+    Map = GeoJSONMap(File) if Format == 'geojson' else KMLMap(File)
+
+    Map.Folder('Devices')
+    for Database in Databases:
+      Properties = None
+      Points     = []
+      for MAC, Device, FriendlyName, Vendor, Epoch, Lat, Lon in conn.execute(TrackQuery(Schema,Database,Where),Params):
+        NewTrack = (Properties == None or MAC != Properties['MACAddress'] or
+                    (Tracks == 'session' and Epoch - Points[-1][0] > SessionIdle))
+        if (len(Points) > 0 and (NewTrack or len(Points) >= MAX_TRACK_POINTS)):
+          Map.Track(Properties,Points)
+          TrackCount = TrackCount + 1
+          Points = []
+        if NewTrack:
+          Properties = OrderedDict([('MACAddress', MAC), ('Device', PropertyText(Device)),
+                                    ('FriendlyName', PropertyText(FriendlyName)), ('Vendor', PropertyText(Vendor))])
+        Points.append((Epoch,Lat,Lon))
+      if (len(Points) > 0):
+        Map.Track(Properties,Points)
+        TrackCount = TrackCount + 1
+
+    Map.Folder('Routers')
+    for Database in Databases:
+      for MAC, FriendlyName, Vendor, SSID, Signal, Lat, Lon, Radius, Located, Hits, First, Last in conn.execute(RouterQuery(Schema,Database,Where),Params):
+        Map.Router(OrderedDict([('MACAddress', MAC), ('FriendlyName', PropertyText(FriendlyName)),
+                                ('Vendor', PropertyText(Vendor)), ('SSID', PropertyText(SSID)), ('Signal', Signal), ('Hits', Hits),
+                                ('Located', Located), ('Radius', Radius),
+                                ('FirstSeen', ISOTime(First)), ('LastSeen', ISOTime(Last))]), Lat, Lon)
+        RouterCount = RouterCount + 1
+    Map.Close()
+  return TrackCount, RouterCount
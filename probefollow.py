@@ -0,0 +1,320 @@
+#------------------------------------------------------------------------------
+#                                                                            --
+#   ____            _            _____     _ _                               --
+#  |  _ \ _ __ ___ | |__   ___  |  ___|__ | | | _____      __                --
+#  | |_) | '__/ _ \| '_ \ / _ \ | |_ / _ \| | |/ _ \ \ /\ / /                --
+#  |  __/| | | (_) | |_) |  __/ |  _| (_) | | | (_) \ V  V /                 --
+#  |_|   |_|  \___/|_.__/ \___| |_|  \___/|_|_|\___/ \_/\_/                  --
+#                                                                            --
+#                                                                            --
+#   Which unknown devices keep turning up wherever we go?                    --
+#                                                                            --
+#   Sightings are bucketed into (time window, geohash cell) and an           --
+#   inverted index maps every cell to the MACs seen in it.  Streaming the    --
+#   buckets once in window order gives each MAC its cells and visits, so     --
+#   weeks of data never need a pairwise join.  A MAC is reported when it     --
+#   was seen in at least N cells on at least 2 separate visits, ranked by    --
+#   the sum over its cells of log(1 + MACs / MACs seen in the cell):         --
+#   showing up with us somewhere quiet counts for more than downtown.        --
+#                                                                            --
+#     python3 probefollow.py /home/pi/sqlite/GPSProbe --hours 336            --
+#                                                                            --
+#   Version: 1.0                                                             --
+#   Date:    Oct 18, 2026                                                    --
+#------------------------------------------------------------------------------
+
+import argparse
+import datetime
+import math
+import sqlite3
+import time
+
+import probedb
+
+
+#--------------------------------------
+# Global Variables                   --
+#--------------------------------------
+
+#Geohash characters of a cell.  6 is about 1.2km x 0.6km, a neighbourhood;
+#7 (150m) splits a single stop over several cells.
+GEOHASH_PRECISION = 6
+
+#Minutes per time window.  Sightings of a MAC in the same window and cell
+#are one entry of the index, however many packets it sent.
+WINDOW_MINUTES = 15
+
+#A MAC has to be seen in this many distinct cells ...
+MIN_CELLS = 3
+
+#... on this many visits, a visit ending when the MAC is not seen for
+#VISIT_GAP_MINUTES.  One shared stretch of road is a single visit.
+MIN_VISITS = 2
+VISIT_GAP_MINUTES = 60
+
+#and the cells it was seen in have to be this far apart (km, between cell
+#centres), so a MAC heard on both sides of a cell boundary doesn't count
+MIN_SPREAD_KM = 1.0
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+
+
+#--------------------------------------
+# Geohash cells                      --
+#--------------------------------------
+
+#A geohash of P characters is 5P bits, longitude and latitude interleaved
+#(longitude first).  Splitting them back out, a cell is simply the pair
+#(latitude row, longitude column) on a 2^LatBits x 2^LonBits grid, which
+#SQLite can work out for every sighting with two multiplications.  Only
+#the cells of reported MACs are turned into geohash text.
+
+def GeohashBits(Precision=GEOHASH_PRECISION):
+  #(latitude bits, longitude bits)
+  return (5 * Precision) // 2, (5 * Precision + 1) // 2
+
+
+def Geohash(Row,Column,Precision=GEOHASH_PRECISION):
+  #Geohash text of the cell at latitude Row, longitude Column
+  LatBits, LonBits = GeohashBits(Precision)
+  Bits = 0
+  for i in range(5 * Precision):
+    if (i % 2 == 0):
+      LonBits = LonBits - 1
+      Bits = (Bits << 1) | ((Column >> LonBits) & 1)
+    else:
+      LatBits = LatBits - 1
+      Bits = (Bits << 1) | ((Row >> LatBits) & 1)
+  Text = ''
+  for i in range(Precision):
+    Text = GEOHASH_BASE32[Bits & 31] + Text
+    Bits = Bits >> 5
+  return Text
+
+
+def CellCentre(Row,Column,Precision=GEOHASH_PRECISION):
+  #(Lat, Lon) of the middle of a cell
+  LatBits, LonBits = GeohashBits(Precision)
+  return ((Row + 0.5) * 180.0 / (1 << LatBits) - 90.0,
+          (Column + 0.5) * 360.0 / (1 << LonBits) - 180.0)
+
+
+def SpreadKm(Cells,Columns,Precision=GEOHASH_PRECISION):
+  #Diagonal of the box around the centres of a MAC's cells (Row * Columns
+  #+ Column each), in km.  Linear in the cells, unlike the largest pairwise
+  #distance, and never less than half of it.
+  Centres = [CellCentre(Cell // Columns,Cell % Columns,Precision) for Cell in Cells]
+  Lats    = [Centre[0] for Centre in Centres]
+  Lons    = [Centre[1] for Centre in Centres]
+  Scale   = math.cos(math.radians((max(Lats) + min(Lats)) / 2))
+  return math.hypot(max(Lats) - min(Lats),(max(Lons) - min(Lons)) * Scale) * probedb.METERS_PER_DEGREE / 1000.0
+
+
+
+
+#--------------------------------------
+# Buckets                            --
+#--------------------------------------
+
+def BucketPart(Schema,Database,Since=None,Until=None,Unknown=True):
+  #One row per distinct (window, cell, MAC) with a position and the number
+  #of sightings in it, for one database.  SQLite does the grouping, so
+  #Python only sees the buckets.  MAC is the MAC as stored (text in schema
+  #1, the 48 bit integer in schema 2).  Parameters :WindowSeconds, :Rows
+  #and :Columns.
+  if (Schema >= 2):
+    Where = probedb.HAS_POSITION
+    if Unknown:
+      Where = Where + " and d.FriendlyName = '--'"
+    if (Since != None):
+      Where = Where + ' and o.Time >= ' + str(int(Since * 1000))
+    if (Until != None):
+      Where = Where + ' and o.Time < ' + str(int(Until * 1000))
+    return '''select o.Time / 1000 / :WindowSeconds as Window,
+                     cast((o.Lat + 90.0) * :Rows / 180.0 as integer) as Row,
+                     cast((o.Lon + 180.0) * :Columns / 360.0 as integer) as Col,
+                     d.MAC as MAC,
+                     count(*) as Hits
+                from ''' + Database + '''.Devices d
+                join ''' + Database + '''.Observations o on o.DeviceID = d.DeviceID
+               where ''' + Where + '''
+               group by 1, 2, 3, 4'''
+
+  Where = probedb.HAS_POSITION
+  if Unknown:
+    Where = Where + " and FriendlyName = '--'"
+  if (Since != None):
+    Where = Where + " and DateTime >= datetime(" + str(int(Since)) + ", 'unixepoch', 'localtime')"
+  if (Until != None):
+    Where = Where + " and DateTime < datetime(" + str(int(Until)) + ", 'unixepoch', 'localtime')"
+  return '''select ''' + probedb.EpochColumn(Schema) + ''' / :WindowSeconds as Window,
+                   cast((Lat + 90.0) * :Rows / 180.0 as integer) as Row,
+                   cast((Lon + 180.0) * :Columns / 360.0 as integer) as Col,
+                   MACAddress as MAC,
+                   count(*) as Hits
+              from ''' + Database + '''.GPSLog
+             where ''' + Where + '''
+             group by 1, 2, 3, 4'''
+
+
+def BucketQuery(conn,Schema,Databases=('main',),Since=None,Until=None,Unknown=True,Params={}):
+  #The buckets of every database, in window order.  Shards from
+  #ShardSet.Each are staged through conn (with the same Params).
+  Source = probedb.StageParts(conn,'Buckets',lambda Database: BucketPart(Schema,Database,Since,Until,Unknown),Databases,Params)
+  return 'select * from ' + Source + ' order by Window'
+
+
+def BuildIndex(Buckets,Rows,Columns,Gap):
+  #Walks the buckets once, in window order.  Builds the inverted index
+  #cell -> set of MACs seen in it (a cell is Row * Columns + Column) and
+  #per MAC [first window, last window, visits, windows, sightings], a new
+  #visit starting when the MAC was not seen for more than Gap windows.
+  #Memory is the distinct (cell, MAC) pairs, not the buckets.
+  Index = {}
+  Stats = {}
+  for Window, Row, Column, MAC, Hits in Buckets:
+    Cell = min(Row,Rows - 1) * Columns + min(Column,Columns - 1)
+    MACs = Index.get(Cell)
+    if (MACs == None):
+      MACs = Index[Cell] = set()
+    MACs.add(MAC)
+    Entry = Stats.get(MAC)
+    if (Entry == None):
+      Stats[MAC] = [Window, Window, 1, 1, Hits]
+      continue
+    if (Window != Entry[1]):
+      if (Window - Entry[1] > Gap):
+        Entry[2] = Entry[2] + 1
+      Entry[3] = Entry[3] + 1
+      Entry[1] = Window
+    Entry[4] = Entry[4] + Hits
+  return Index, Stats
+
+
+
+
+#--------------------------------------
+# Followers                          --
+#--------------------------------------
+
+def RankFollowers(Index,Stats,Columns,Precision=GEOHASH_PRECISION,WindowMinutes=WINDOW_MINUTES,
+                  MinCells=MIN_CELLS,MinVisits=MIN_VISITS,MinSpread=MIN_SPREAD_KM):
+  #Two passes over the index: the first counts each MAC's cells, the
+  #second collects the cells of the MACs with enough cells and visits.
+  #The work is the number of (cell, MAC) pairs; MACs are never compared
+  #with each other.  A cell is worth log(1 + MACs / MACs seen in the
+  #cell): a MAC that turns up with us at a quiet spot says more than one
+  #in a car park.  Returns [(Score, MAC, Cells, Visits, Windows,
+  #Sightings, SpreadKm, First, Last, [geohash, ...])] best first, First
+  #and Last in epoch seconds.
+  Counts = {}
+  for MACs in Index.values():
+    for MAC in MACs:
+      Counts[MAC] = Counts.get(MAC,0) + 1
+  Candidates = {}
+  for MAC, Count in Counts.items():
+    if (Count >= MinCells and Stats[MAC][2] >= MinVisits):
+      Candidates[MAC] = []
+
+  Total = len(Stats)
+  Score = {}
+  for Cell, MACs in Index.items():
+    Weight = math.log(1.0 + Total / len(MACs))
+    for MAC in MACs:
+      Cells = Candidates.get(MAC)
+      if (Cells != None):
+        Cells.append(Cell)
+        Score[MAC] = Score.get(MAC,0.0) + Weight
+
+  Results = []
+  for MAC, Cells in Candidates.items():
+    Spread = SpreadKm(Cells,Columns,Precision)
+    if (Spread < MinSpread):
+      continue
+    First, Last, Visits, Windows, Sightings = Stats[MAC]
+    Results.append((round(Score[MAC],2),MAC,len(Cells),Visits,Windows,Sightings,round(Spread,1),
+                    First * WindowMinutes * 60,(Last + 1) * WindowMinutes * 60,
+                    sorted(Geohash(Cell // Columns,Cell % Columns,Precision) for Cell in Cells)))
+  Results.sort(key=lambda Result: (-Result[0],-Result[2]))
+  return Results
+
+
+def FindFollowers(conn,Schema=1,Databases=('main',),Since=None,Until=None,Unknown=True,
+                  Precision=GEOHASH_PRECISION,WindowMinutes=WINDOW_MINUTES,MinCells=MIN_CELLS,
+                  MinVisits=MIN_VISITS,VisitGap=VISIT_GAP_MINUTES,MinSpread=MIN_SPREAD_KM):
+  #MACs seen in at least MinCells cells on at least MinVisits visits
+  #between Since and Until (epoch seconds, None = open ended), best score
+  #first.  Unknown = only MACs without a friendly name.  In schema 2 the
+  #MACs are returned the way GPSLogView shows them.
+  LatBits, LonBits = GeohashBits(Precision)
+  Rows    = 1 << LatBits
+  Columns = 1 << LonBits
+  Params  = {'WindowSeconds' : WindowMinutes * 60, 'Rows' : Rows, 'Columns' : Columns}
+  cursor  = conn.execute(BucketQuery(conn,Schema,Databases,Since,Until,Unknown,Params),Params)
+  Index, Stats = BuildIndex(cursor,Rows,Columns,max(VisitGap // WindowMinutes,1))
+  Results = RankFollowers(Index,Stats,Columns,Precision,WindowMinutes,MinCells,MinVisits,MinSpread)
+  if (Schema >= 2):
+    Results = [Result[:1] + (probedb.IntToMAC(Result[1]),) + Result[2:] for Result in Results]
+  return Results
+
+
+def DeviceInfo(conn,Schema,Databases,MAC):
+  #(device type, vendor) of a MAC, from the first database that has it
+  for Database in Databases:
+    if (Schema >= 2):
+      Row = conn.execute('select DeviceType, Vendor from ' + Database + '.Devices where MAC = ?',
+                         (probedb.MACToInt(MAC),)).fetchone()
+    else:
+      Row = conn.execute('select Device, Vendor from ' + Database + '.GPSLog where MACAddress = ? limit 1',
+                         (MAC,)).fetchone()
+    if (Row != None):
+      return Row
+  return ('', '')
+
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe devices that keep turning up where we go")
+  parser.add_argument('database', help="SQLite database file")
+  parser.add_argument('--hours', type=int, default=0, help="only sightings from the last N hours (0 = all)")
+  parser.add_argument('--since', help="only sightings from this local time on ('2026-10-18 14:00')")
+  parser.add_argument('--until', help="only sightings before this local time")
+  parser.add_argument('--precision', type=int, default=GEOHASH_PRECISION, choices=range(4,9), help="geohash characters per cell")
+  parser.add_argument('--window', type=int, default=WINDOW_MINUTES, help="minutes per time window")
+  parser.add_argument('--min-cells', type=int, default=MIN_CELLS, help="distinct cells a MAC has to be seen in")
+  parser.add_argument('--min-visits', type=int, default=MIN_VISITS, help="separate visits a MAC has to be seen on")
+  parser.add_argument('--visit-gap', type=int, default=VISIT_GAP_MINUTES, help="minutes unseen that end a visit")
+  parser.add_argument('--min-spread', type=float, default=MIN_SPREAD_KM, help="km between the furthest cells")
+  parser.add_argument('--all', action='store_true', help="include MACs with a friendly name")
+  parser.add_argument('--top', type=int, default=25, help="MACs to list")
+  args = parser.parse_args()
+
+  Since = None
+  Until = None
+  if (args.hours > 0):
+    Since = int(time.time()) - args.hours * 3600
+  if (args.since != None):
+    Since = time.mktime(datetime.datetime.fromisoformat(args.since).timetuple())
+  if (args.until != None):
+    Until = time.mktime(datetime.datetime.fromisoformat(args.until).timetuple())
+
+  conn   = sqlite3.connect(args.database)
+  Schema = probedb.GetSchemaVersion(conn)
+  Databases = probedb.ShardSet(args.database, Schema=Schema).Each(conn, (time.time() - Since) / 3600 if Since != None else None)
+  Start  = time.perf_counter()
+  Results = FindFollowers(conn, Schema, Databases, Since, Until, not args.all, args.precision, args.window,
+                          args.min_cells, args.min_visits, args.visit_gap, args.min_spread)
+  print(len(Results), "MACs seen in", args.min_cells, "or more places in {:.1f}s".format(time.perf_counter() - Start))
+  print("")
+  print("{:>7} {:17} {:7} {:20} {:>5} {:>6} {:>9} {:>8}  {:16} {:16}  {}".format(
+        'Score', 'MACAddress', 'Device', 'Vendor', 'Cells', 'Visits', 'Sightings', 'Spread', 'First', 'Last', 'Geohashes'))
+  for Score, MAC, Cells, Visits, Windows, Sightings, Spread, First, Last, Geohashes in Results[:args.top]:
+    Device, Vendor = DeviceInfo(conn, Schema, Databases, MAC)
+    print("{:7.2f} {:17} {:7} {:20} {:5} {:6} {:9} {:6.1f}km  {:16} {:16}  {}".format(
+          Score, MAC, str(Device)[:7], str(Vendor)[:20], Cells, Visits, Sightings, Spread,
+          time.strftime('%Y-%m-%d %H:%M', time.localtime(First)), time.strftime('%Y-%m-%d %H:%M', time.localtime(Last)),
+          ' '.join(Geohashes[:6]) + (' ...' if len(Geohashes) > 6 else '')))
+  conn.close()
@@ -0,0 +1,321 @@
+#------------------------------------------------------------------------------
+#                                                                            --
+#   ____            _            _                    _                      --
+#  |  _ \ _ __ ___ | |__   ___  | |    ___   ___ __ _| |_ ___                --
+#  | |_) | '__/ _ \| '_ \ / _ \ | |   / _ \ / __/ _` | __/ _ \               --
+#  |  __/| | | (_) | |_) |  __/ | |__| (_) | (_| (_| | ||  __/               --
+#  |_|   |_|  \___/|_.__/ \___| |_____\___/ \___\__,_|\__\___|               --
+#                                                                            --
+#                                                                            --
+#   Router positions estimated from drive-by beacon samples.                 --
+#                                                                            --
+#   Every beacon a router sends while we drive past is logged with the       --
+#   GPS position and signal it was heard at.  This groups the samples by     --
+#   router and estimates where the router is with NumPy, all routers of a    --
+#   chunk at once:                                                           --
+#     centroid - signal weighted centroid of the samples                     --
+#     fit      - least squares fit of a log distance path loss model,        --
+#                started from the centroid (falls back to the centroid       --
+#                when there are too few samples or the fit wanders off)      --
+#   Results go into the RouterLocations table, which the map export uses.    --
+#                                                                            --
+#   Version: 1.0                                                             --
+#   Date:    Oct 18, 2026                                                    --
+#------------------------------------------------------------------------------
+
+
+import argparse
+import datetime
+import sqlite3
+import sys
+import time
+
+import numpy
+
+import probedb
+
+
+#--------------------------------------
+# Global Variables                   --
+#--------------------------------------
+
+#Path loss exponent n in  RSSI = P0 - 10 n log10(distance).  2 is free
+#space, streets lined with houses are nearer 3.
+PATH_LOSS_EXPONENT = 2.7
+
+#The fit has 3 unknowns (x, y and P0, the signal at 1m), it needs a few
+#more samples than that to mean anything
+MIN_FIT_SAMPLES = 5
+
+#Levenberg-Marquardt iterations, every router of a chunk steps at once
+FIT_ITERATIONS = 10
+
+#A fit that ends up further than this (meters) from the centroid has
+#latched on to noise, the centroid is kept instead
+MAX_FIT_SHIFT = 500.0
+
+#Closer than this (meters) the path loss model means nothing
+MIN_DISTANCE = 1.0
+
+#Samples read per chunk.  A router's samples are never split between
+#chunks, so memory is about one chunk of arrays however big the log is.
+LOCATE_CHUNK_ROWS = 200000
+
+ROUTER_LOCATION_INSERT = ''' INSERT OR REPLACE INTO RouterLocations values (?,?,?,?,?,?,?,?) '''
+
+
+
+
+def RouterSamplesPart(Schema,Database,Since=None,Until=None):
+  #Router beacons with a position in one database.  Router is the MAC as
+  #stored: text in schema 1, the 48 bit integer in schema 2.
+  if (Schema >= 2):
+    Where = "d.DeviceType = 'router' and " + probedb.HAS_POSITION
+    if (Since != None):
+      Where = Where + ' and o.Time >= ' + str(int(Since * 1000))
+    if (Until != None):
+      Where = Where + ' and o.Time < ' + str(int(Until * 1000))
+    return '''select d.MAC as Router, o.Lat, o.Lon, o.Signal
+                from ''' + Database + '''.Devices d
+                join ''' + Database + '''.Observations o on o.DeviceID = d.DeviceID
+               where ''' + Where
+
+  Where = "Device = 'router' and " + probedb.HAS_POSITION
+  if (Since != None):
+    Where = Where + " and DateTime >= datetime(" + str(int(Since)) + ", 'unixepoch', 'localtime')"
+  if (Until != None):
+    Where = Where + " and DateTime < datetime(" + str(int(Until)) + ", 'unixepoch', 'localtime')"
+  return '''select MACAddress as Router, Lat, Lon, Signal
+              from ''' + Database + '''.GPSLog
+             where ''' + Where
+
+
+def RouterSamplesQuery(conn,Schema,Databases=('main',),Since=None,Until=None):
+  #Router beacons with a position, a router's samples next to each other
+  #(in schema 2 Devices is walked in MAC order, so with one database no
+  #sort is needed).  Shards from ShardSet.Each are staged through conn.
+  if (len(Databases) == 1):
+    return RouterSamplesPart(Schema,next(iter(Databases)),Since,Until) + ' order by Router'
+  Source = probedb.StageParts(conn,'RouterSamples',lambda Database: RouterSamplesPart(Schema,Database,Since,Until),Databases)
+  return 'select * from ' + Source + ' order by Router'
+
+
+
+
+#--------------------------------------
+# Estimators                         --
+#--------------------------------------
+
+#Each works on flat arrays of samples: X, Y (meters from the router's mean
+#sample position), Signal, and Group (which router, 0..R-1, samples of a
+#router next to each other starting at Starts).  Results are arrays of R.
+
+def WeightedCentroid(X,Y,Signal,Group,Count,Starts,Exponent=PATH_LOSS_EXPONENT):
+  #Weights go as 1/distance^2 under the path loss model (linear in power
+  #for n = 2).  They are taken relative to each router's strongest sample
+  #so they stay in range.  The radius is the weighted RMS distance of the
+  #samples from the centroid.
+  Top    = numpy.maximum.reduceat(Signal,Starts)
+  Weight = 10.0 ** ((Signal - Top[Group]) / (5.0 * Exponent))
+  Total  = numpy.bincount(Group,Weight)
+  CX     = numpy.bincount(Group,Weight * X) / Total
+  CY     = numpy.bincount(Group,Weight * Y) / Total
+  D2     = (X - CX[Group]) ** 2 + (Y - CY[Group]) ** 2
+  Radius = numpy.sqrt(numpy.bincount(Group,Weight * D2) / Total)
+  return CX, CY, Radius
+
+
+def PathLossFit(X,Y,Signal,Group,Count,CX,CY,Exponent=PATH_LOSS_EXPONENT,Iterations=FIT_ITERATIONS):
+  #Least squares fit of  Signal = P0 - 10 n log10(distance)  for the
+  #position and P0 of every router at once, Levenberg-Marquardt started
+  #from the centroid.  Each step solves one 3x3 system per router, all of
+  #them in a single numpy.linalg.solve.  Returns X, Y, the radius (1 sigma
+  #from the covariance of the fit) and which routers were fitted.
+  K       = 10.0 * Exponent / numpy.log(10.0)
+  Routers = len(Count)
+  Fit     = Count >= MIN_FIT_SAMPLES
+  Rows    = Fit[Group]
+
+  def Residuals(QX,QY,P0):
+    D2 = numpy.maximum((X - QX[Group]) ** 2 + (Y - QY[Group]) ** 2, MIN_DISTANCE ** 2)
+    return Signal - (P0[Group] - 5.0 * Exponent * numpy.log10(D2)), D2
+
+  def Normal(QX,QY,D2,R):
+    #J^T J and J^T r per router, J = d model / d (x, y, P0)
+    JX = K * (X - QX[Group]) / D2
+    JY = K * (Y - QY[Group]) / D2
+    A  = numpy.empty((Routers,3,3))
+    A[:,0,0] = numpy.bincount(Group,JX * JX,Routers)
+    A[:,0,1] = A[:,1,0] = numpy.bincount(Group,JX * JY,Routers)
+    A[:,0,2] = A[:,2,0] = numpy.bincount(Group,JX,Routers)
+    A[:,1,1] = numpy.bincount(Group,JY * JY,Routers)
+    A[:,1,2] = A[:,2,1] = numpy.bincount(Group,JY,Routers)
+    A[:,2,2] = Count
+    B = numpy.stack([numpy.bincount(Group,JX * R,Routers),
+                     numpy.bincount(Group,JY * R,Routers),
+                     numpy.bincount(Group,R,Routers)],axis=1)
+    return A, B
+
+  QX, QY = CX.copy(), CY.copy()
+  #the best P0 for a given position is the mean of Signal + 10 n log10(d)
+  D2     = numpy.maximum((X - QX[Group]) ** 2 + (Y - QY[Group]) ** 2, MIN_DISTANCE ** 2)
+  P0     = numpy.bincount(Group,Signal + 5.0 * Exponent * numpy.log10(D2),Routers) / Count
+  R, D2  = Residuals(QX,QY,P0)
+  SSR    = numpy.bincount(Group,R * R,Routers)
+  Lambda = numpy.full(Routers,1e-3)
+  Identity = numpy.eye(3)
+
+  for Iteration in range(Iterations):
+    A, B = Normal(QX,QY,D2,R)
+    Diagonal = A[:,[0,1,2],[0,1,2]]
+    A[:,[0,1,2],[0,1,2]] = Diagonal * (1.0 + Lambda[:,None]) + 1e-9
+    #routers with too few samples get a harmless identity system
+    A[~Fit] = Identity
+    B[~Fit] = 0.0
+    Step = numpy.linalg.solve(A,B[:,:,None])[:,:,0]
+
+    NX, NY, NP = QX + Step[:,0], QY + Step[:,1], P0 + Step[:,2]
+    NR, ND2    = Residuals(NX,NY,NP)
+    NSSR       = numpy.bincount(Group,NR * NR,Routers)
+    Better     = Fit & (NSSR < SSR)
+    QX  = numpy.where(Better,NX,QX)
+    QY  = numpy.where(Better,NY,QY)
+    P0  = numpy.where(Better,NP,P0)
+    SSR = numpy.where(Better,NSSR,SSR)
+    R   = numpy.where(Better[Group],NR,R)
+    D2  = numpy.where(Better[Group],ND2,D2)
+    Lambda = numpy.where(Better,Lambda / 3.0,Lambda * 4.0)
+
+  #covariance of the position: sigma^2 (J^T J)^-1, sigma^2 from the residuals
+  A, B  = Normal(QX,QY,D2,R)
+  A[~Fit] = Identity
+  Sigma2  = SSR / numpy.maximum(Count - 3,1)
+  Inverse = numpy.linalg.pinv(A)
+  Radius  = numpy.sqrt(numpy.abs(Sigma2 * (Inverse[:,0,0] + Inverse[:,1,1])))
+
+  Fitted = (Fit & numpy.isfinite(QX) & numpy.isfinite(QY) & numpy.isfinite(Radius) &
+            ((QX - CX) ** 2 + (QY - CY) ** 2 <= MAX_FIT_SHIFT ** 2))
+  return QX, QY, Radius, Fitted
+
+
+def EstimateChunk(Keys,Samples,Method='fit',Exponent=PATH_LOSS_EXPONENT):
+  #Keys: the router of each sample (samples of a router together),
+  #Samples: N x 3 array of Lat, Lon, Signal.  Returns a list of
+  #(Router, Lat, Lon, Radius, Samples, MaxSignal, Method), one per router.
+  Keys   = numpy.asarray(Keys,dtype=object)
+  Lat, Lon, Signal = Samples[:,0], Samples[:,1], Samples[:,2]
+
+  Change = numpy.empty(len(Keys),dtype=bool)
+  Change[0]  = True
+  Change[1:] = Keys[1:] != Keys[:-1]
+  Starts = numpy.flatnonzero(Change)
+  Group  = numpy.cumsum(Change) - 1
+  Count  = numpy.bincount(Group).astype(float)
+
+  #flat meters around each router's mean sample position
+  Lat0  = numpy.bincount(Group,Lat) / Count
+  Lon0  = numpy.bincount(Group,Lon) / Count
+  Scale = probedb.METERS_PER_DEGREE * numpy.maximum(numpy.cos(numpy.radians(Lat0)),0.01)
+  X     = (Lon - Lon0[Group]) * Scale[Group]
+  Y     = (Lat - Lat0[Group]) * probedb.METERS_PER_DEGREE
+
+  EX, EY, Radius = WeightedCentroid(X,Y,Signal,Group,Count,Starts,Exponent)
+  Methods = numpy.full(len(Count),'centroid',dtype=object)
+  if (Method == 'fit'):
+    FX, FY, FRadius, Fitted = PathLossFit(X,Y,Signal,Group,Count,EX,EY,Exponent)
+    EX      = numpy.where(Fitted,FX,EX)
+    EY      = numpy.where(Fitted,FY,EY)
+    Radius  = numpy.where(Fitted,FRadius,Radius)
+    Methods[Fitted] = 'fit'
+
+  MaxSignal = numpy.maximum.reduceat(Signal,Starts)
+  return list(zip(Keys[Starts],
+                  (Lat0 + EY / probedb.METERS_PER_DEGREE).tolist(),
+                  (Lon0 + EX / Scale).tolist(),
+                  Radius.tolist(),
+                  Count.astype(int).tolist(),
+                  MaxSignal.tolist(),
+                  Methods))
+
+
+
+
+#--------------------------------------
+# Database                           --
+#--------------------------------------
+
+def LocateRouters(conn,Schema=1,Databases=('main',),Since=None,Until=None,Method='fit',
+                  Exponent=PATH_LOSS_EXPONENT,ChunkRows=LOCATE_CHUNK_ROWS,Progress=None):
+  #Estimates every router with samples between Since and Until (epoch
+  #seconds, None = open ended) and stores them in RouterLocations, a chunk
+  #of routers per transaction.  Returns the number of routers located.
+  cursor  = conn.cursor()
+  cursor.execute(RouterSamplesQuery(conn,Schema,Databases,Since,Until))
+  Updated = time.strftime('%Y-%m-%d %H:%M:%S')
+  Pending = []
+  Located = 0
+  while True:
+    Rows = cursor.fetchmany(ChunkRows)
+    Done = len(Rows) == 0
+    Rows = Pending + Rows
+    Pending = []
+    if (len(Rows) == 0):
+      break
+    if not Done:
+      #the last router may have more samples in the next fetch
+      Last = len(Rows) - 1
+      while (Last > 0 and Rows[Last - 1][0] == Rows[-1][0]):
+        Last = Last - 1
+      if (Last == 0):
+        Pending = Rows
+        continue
+      Pending = Rows[Last:]
+      Rows    = Rows[:Last]
+
+    Samples = numpy.array([Row[1:] for Row in Rows],dtype=float)
+    Results = EstimateChunk([Row[0] for Row in Rows],Samples,Method,Exponent)
+    if (Schema >= 2):
+      #stored the way GPSLogView shows it, so the map export can join it
+      Results = [(probedb.IntToMAC(Result[0]),) + Result[1:] for Result in Results]
+    conn.executemany(ROUTER_LOCATION_INSERT,[Result + (Updated,) for Result in Results])
+    conn.commit()
+    Located = Located + len(Results)
+    if (Progress != None):
+      Progress(Located)
+    if Done:
+      break
+  return Located
+
+
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description="GPSProbe router location estimates")
+  parser.add_argument('database', help="SQLite database file")
+  parser.add_argument('--method', default='fit', choices=['fit','centroid'], help="path loss fit (falls back to the centroid) or signal weighted centroid only")
+  parser.add_argument('--exponent', type=float, default=PATH_LOSS_EXPONENT, help="path loss exponent (2 = free space)")
+  parser.add_argument('--hours', type=int, default=0, help="only samples from the last N hours (0 = all)")
+  parser.add_argument('--since', help="only samples from this local time on ('2026-10-18 14:00')")
+  parser.add_argument('--until', help="only samples before this local time")
+  parser.add_argument('--chunk', type=int, default=LOCATE_CHUNK_ROWS, help="samples read per chunk")
+  args = parser.parse_args()
+
+  Since = None
+  Until = None
+  if (args.hours > 0):
+    Since = int(time.time()) - args.hours * 3600
+  if (args.since != None):
+    Since = time.mktime(datetime.datetime.fromisoformat(args.since).timetuple())
+  if (args.until != None):
+    Until = time.mktime(datetime.datetime.fromisoformat(args.until).timetuple())
+
+  conn   = sqlite3.connect(args.database)
+  probedb.CreateSupportTables(conn)
+  Schema = probedb.GetSchemaVersion(conn)
+  Databases = probedb.ShardSet(args.database, Schema=Schema).Each(conn, (time.time() - Since) / 3600 if Since != None else None)
+  Start  = time.perf_counter()
+  Count  = LocateRouters(conn, Schema, Databases, Since, Until, args.method, args.exponent, args.chunk,
+                         lambda Count: print("  located", Count, "routers", end="\r"))
+  print("")
+  print("Located", Count, "routers in {:.1f}s".format(time.perf_counter() - Start))
+  conn.close()
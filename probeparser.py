@@ -0,0 +1,590 @@
+#------------------------------------------------------------------------------
+#                                                                            --
+#   ____            _          ____                                          --
+#  |  _ \ _ __ ___ | |__   ___|  _ \ __ _ _ __ ___  ___ _ __                 --
+#  | |_) | '__/ _ \| '_ \ / _ \ |_) / _` | '__/ __|/ _ \ '__|                --
+#  |  __/| | | (_) | |_) |  __/  __/ (_| | |  \__ \  __/ |                   --
+#  |_|   |_|  \___/|_.__/ \___|_|   \__,_|_|  |___/\___|_|                   --
+#                                                                            --
+#                                                                            --
+#   Lightweight radiotap + 802.11 header parser for GPSProbe.                --
+#                                                                            --
+#   The packet callback only needs a handful of fields from each frame       --
+#   (type/subtype, addr1/addr2, the first information element and the        --
+#   antenna signal).  Building the full scapy layer stack for every frame    --
+#   is expensive on a Pi, so we pull those fields straight out of the raw    --
+#   bytes with struct.  Frames we cannot make sense of are handed to scapy.  --
+#                                                                            --
+#   Version: 1.0                                                             --
+#   Date:    Oct 18, 2026                                                    --
+#------------------------------------------------------------------------------
+#   Version: 1.1                                                             --
+#   Reason:  Kernel side BPF filter for the management subtypes we keep      --
+#------------------------------------------------------------------------------
+#   Version: 1.2                                                             --
+#   Reason:  Every information element of probe requests, hashed into a      --
+#            signature of the sending device (probedb.DeviceLinker)          --
+#------------------------------------------------------------------------------
+#   Version: 1.3                                                             --
+#   Reason:  Socket drop counts from PACKET_STATISTICS in FilterStats        --
+#------------------------------------------------------------------------------
+
+
+import ctypes
+import hashlib
+import socket
+import struct
+import time
+from collections import OrderedDict
+
+
+#--------------------------------------
+# Constants                          --
+#--------------------------------------
+
+ETH_P_ALL = 0x0003
+
+#Radiotap "present" bits, in field order
+RT_TSFT          = 0x00000001
+RT_FLAGS         = 0x00000002
+RT_RATE          = 0x00000004
+RT_CHANNEL       = 0x00000008
+RT_FHSS          = 0x00000010
+RT_DBM_ANTSIGNAL = 0x00000020
+RT_EXT           = 0x80000000
+
+#Radiotap flags
+RT_FLAG_FCS      = 0x10
+
+#802.11 management subtypes
+SUBTYPE_PROBE_REQUEST  = 0x04
+SUBTYPE_PROBE_RESPONSE = 0x05
+SUBTYPE_BEACON         = 0x08
+
+#Length of the fixed 802.11 management header (fc, duration, 3 addresses, seq)
+DOT11_HEADER_LEN = 24
+
+#Beacons and probe responses carry timestamp, interval and capability fields
+#before the information elements
+FIXED_PARAMS_LEN = 12
+
+#Information elements
+ELEMENT_SSID             = 0
+ELEMENT_RATES            = 1
+ELEMENT_HT_CAPABILITIES  = 45
+ELEMENT_EXTENDED_RATES   = 50
+ELEMENT_VHT_CAPABILITIES = 191
+ELEMENT_VENDOR           = 221
+ELEMENT_EXTENSION        = 255
+
+#Elements whose contents are part of a probe signature.  The others only
+#count by their position in the frame.
+SIGNATURE_ELEMENTS = (ELEMENT_RATES, ELEMENT_EXTENDED_RATES,
+                      ELEMENT_HT_CAPABILITIES, ELEMENT_VHT_CAPABILITIES)
+
+
+RadiotapHeader = struct.Struct('<BBHI')
+
+
+
+
+class FrameInfo(object):
+  #The fields of a captured frame that GPSProbe actually uses.
+  #Names follow what the packet callback used to read from scapy.
+  #ProbeElements() parses every element of a probe request when asked.
+  __slots__ = ('Type','Subtype','Addr1','Addr2','Info','ElementID','Signal','Raw',
+               'Elements','ElementsStart','ElementsEnd')
+
+  def __init__(self):
+    self.Type      = None
+    self.Subtype   = None
+    self.Addr1     = None
+    self.Addr2     = None
+    self.Info      = b''
+    self.ElementID = None
+    self.Signal    = None
+    self.Raw       = None
+    self.Elements  = None
+    self.ElementsStart = None
+    self.ElementsEnd   = None
+
+  def IsBeacon(self):
+    return (self.Type == 0 and self.Subtype == SUBTYPE_BEACON)
+
+  def IsProbeRequest(self):
+    return (self.Type == 0 and self.Subtype == SUBTYPE_PROBE_REQUEST)
+
+  def ProbeElements(self):
+    #[(ID, contents)] of every information element of a probe request, or
+    #None.  Most frames never need them, so they are parsed on first use.
+    if (self.Elements is None and self.ElementsStart is not None):
+      self.Elements = ParseElements(self.Raw,self.ElementsStart,self.ElementsEnd)
+    return self.Elements
+
+
+
+
+def FormatMAC(Raw,Offset):
+  #same format scapy uses for addr fields: 00:11:22:aa:bb:cc
+  return Raw[Offset:Offset+6].hex(':')
+
+
+
+
+def ParseFrame(Raw):
+  #Parse a radiotap + 802.11 frame.
+  #Returns a FrameInfo, or None if the frame should go through scapy instead.
+
+  RawLen = len(Raw)
+  if (RawLen < 8):
+    return None
+
+  Version, Pad, RTLen, Present = RadiotapHeader.unpack_from(Raw,0)
+  if (Version != 0 or RTLen < 8 or RTLen > RawLen):
+    return None
+
+  #We only keep frames with a signal reading (the callback always needs one)
+  if not (Present & RT_DBM_ANTSIGNAL):
+    return None
+
+  #Skip any extended present bitmaps, the fields start after the last one
+  Offset = 8
+  Word   = Present
+  while (Word & RT_EXT):
+    if (Offset + 4 > RTLen):
+      return None
+    Word   = struct.unpack_from('<I',Raw,Offset)[0]
+    Offset = Offset + 4
+
+  #Walk the fields that come before the antenna signal, honouring alignment
+  Flags = 0
+  if (Present & RT_TSFT):
+    Offset = ((Offset + 7) & ~7) + 8
+  if (Present & RT_FLAGS):
+    if (Offset >= RTLen):
+      return None
+    Flags  = Raw[Offset]
+    Offset = Offset + 1
+  if (Present & RT_RATE):
+    Offset = Offset + 1
+  if (Present & RT_CHANNEL):
+    Offset = ((Offset + 1) & ~1) + 4
+  if (Present & RT_FHSS):
+    Offset = Offset + 2
+  if (Offset >= RTLen):
+    return None
+
+  Frame = FrameInfo()
+  Frame.Signal = Raw[Offset]
+  if (Frame.Signal > 127):
+    Frame.Signal = Frame.Signal - 256
+
+
+  #802.11 header
+  End = RawLen
+  if (Flags & RT_FLAG_FCS):
+    End = End - 4
+
+  Dot = RTLen
+  if (Dot + 2 > End):
+    return None
+
+  FC0 = Raw[Dot]
+  Frame.Type    = (FC0 >> 2) & 0x03
+  Frame.Subtype = FC0 >> 4
+
+  #Control frames can be as short as 10 bytes and have no addr2
+  if (Dot + 10 <= End):
+    Frame.Addr1 = FormatMAC(Raw,Dot + 4)
+  if (Dot + 16 <= End):
+    Frame.Addr2 = FormatMAC(Raw,Dot + 10)
+
+
+  #First information element of beacons and probes
+  if (Frame.Type == 0):
+    if (Frame.Subtype == SUBTYPE_PROBE_REQUEST):
+      Element = Dot + DOT11_HEADER_LEN
+    elif (Frame.Subtype == SUBTYPE_BEACON or Frame.Subtype == SUBTYPE_PROBE_RESPONSE):
+      Element = Dot + DOT11_HEADER_LEN + FIXED_PARAMS_LEN
+    else:
+      return Frame
+
+    if (Element + 2 <= End):
+      Frame.ElementID = Raw[Element]
+      Length          = Raw[Element + 1]
+      if (Element + 2 + Length > End):
+        #truncated element, let scapy deal with it
+        return None
+      Frame.Info = bytes(Raw[Element + 2:Element + 2 + Length])
+      if (Frame.Subtype == SUBTYPE_PROBE_REQUEST):
+        Frame.ElementsStart = Element
+        Frame.ElementsEnd   = End
+    elif (Frame.Addr2 is None):
+      return None
+
+  return Frame
+
+
+
+
+def ParseElements(Raw,Offset,End):
+  #[(ID, contents)] of the information elements from Offset to End.  A
+  #truncated last element is left out.
+  Elements = []
+  while (Offset + 2 <= End):
+    Length = Raw[Offset + 1]
+    if (Offset + 2 + Length > End):
+      break
+    Elements.append((Raw[Offset],bytes(Raw[Offset + 2:Offset + 2 + Length])))
+    Offset = Offset + 2 + Length
+  return Elements
+
+
+
+
+def FrameFromScapy(packet):
+  #Fallback path: read the same fields from a dissected scapy packet
+  from scapy.layers.dot11 import Dot11Elt
+
+  Frame = FrameInfo()
+  Frame.Type    = packet.type
+  Frame.Subtype = packet.subtype
+  Frame.Addr1   = packet.addr1
+  Frame.Addr2   = packet.addr2
+  Frame.Signal  = packet.dBm_AntSignal
+
+  Element = packet.getlayer(Dot11Elt)
+  if (Element is not None):
+    Frame.Info      = Element.info
+    Frame.ElementID = Element.ID
+    if Frame.IsProbeRequest():
+      Raw = bytes(Element)
+      Frame.Elements = ParseElements(Raw,0,len(Raw))
+
+  return Frame
+
+
+
+
+def ExtractFrame(packet):
+  #Accepts raw bytes (fast path) or an already dissected scapy packet
+  if isinstance(packet,(bytes,bytearray,memoryview)):
+    Frame = ParseFrame(packet)
+    if (Frame is not None):
+      Frame.Raw = packet
+      return Frame
+
+    from scapy.layers.dot11 import RadioTap
+    Raw    = bytes(packet)
+    packet = RadioTap(Raw)
+    Frame  = FrameFromScapy(packet)
+    Frame.Raw = Raw
+    return Frame
+
+  return FrameFromScapy(packet)
+
+
+
+
+#--------------------------------------
+# Probe signatures                   --
+#--------------------------------------
+
+def ProbeSignature(Elements):
+  #Hash of what a device puts in its probe requests whatever MAC it uses:
+  #the element IDs in order (vendor elements by OUI and type, extension
+  #elements by extension ID) and the rates and HT/VHT capabilities.  The
+  #SSID and channel are left out, they change from frame to frame.
+  Hash = hashlib.sha1()
+  for ID, Contents in Elements:
+    if (ID == ELEMENT_VENDOR):
+      Hash.update(bytes((ID,len(Contents[0:4]))) + Contents[0:4])
+    elif (ID == ELEMENT_EXTENSION):
+      Hash.update(bytes((ID,len(Contents[0:1]))) + Contents[0:1])
+    else:
+      Hash.update(bytes((ID,)))
+  Hash.update(b'|')
+  for ID, Contents in Elements:
+    if (ID in SIGNATURE_ELEMENTS):
+      Hash.update(bytes((ID,len(Contents))) + Contents)
+  return Hash.hexdigest()[0:16]
+
+
+def FrameSignature(Frame):
+  #ProbeSignature of a FrameInfo
+  return ProbeSignature(Frame.ProbeElements() or [])
+
+
+
+
+#--------------------------------------
+# Capture filter                     --
+#--------------------------------------
+
+#Management subtypes that can be named in the capture filter option
+FilterSubtypes = OrderedDict([
+  ('assoc-req',   0x00),
+  ('assoc-resp',  0x01),
+  ('reassoc-req', 0x02),
+  ('reassoc-resp',0x03),
+  ('probe-req',   0x04),
+  ('probe-resp',  0x05),
+  ('beacon',      0x08),
+  ('atim',        0x09),
+  ('disassoc',    0x0a),
+  ('auth',        0x0b),
+  ('deauth',      0x0c),
+  ('action',      0x0d),
+])
+
+DEFAULT_FILTER = 'beacon,probe-req'
+
+SO_ATTACH_FILTER = 26
+SOL_PACKET       = 263
+PACKET_STATISTICS = 6
+
+#classic BPF opcodes
+BPF_LDB_ABS = 0x30
+BPF_LDB_IND = 0x50
+BPF_LSH_K   = 0x64
+BPF_OR_X    = 0x4c
+BPF_AND_K   = 0x54
+BPF_JEQ_K   = 0x15
+BPF_TAX     = 0x07
+BPF_RET_K   = 0x06
+
+BPF_ACCEPT  = 0x40000
+
+
+def ParseFilterOption(Option):
+  #Turns the command line value into a list of subtypes.
+  #  'none' -> None (no filtering)
+  #  'mgt'  -> [] (every management frame)
+  #  'beacon,probe-req' -> [0x08,0x04]
+  Option = Option.strip().lower()
+  if (Option in ('', 'none', 'all')):
+    return None
+  if (Option == 'mgt'):
+    return []
+
+  Subtypes = []
+  for Name in Option.split(','):
+    Name = Name.strip()
+    if (Name not in FilterSubtypes):
+      raise ValueError("unknown capture filter subtype '" + Name + "', choose from: mgt, none, " + ', '.join(FilterSubtypes))
+    Subtypes.append(FilterSubtypes[Name])
+  return Subtypes
+
+
+def FilterExpression(Subtypes):
+  #libpcap expression for scapy's sniff(filter=...)
+  if (Subtypes is None):
+    return None
+  if (len(Subtypes) == 0):
+    return 'type mgt'
+  Names = dict((Value,Name) for Name,Value in FilterSubtypes.items())
+  return ' or '.join('type mgt subtype ' + Names[Subtype] for Subtype in Subtypes)
+
+
+def BuildFilterProgram(Subtypes):
+  #Classic BPF program for radiotap frames.  The 802.11 header starts at
+  #it_len, a little endian value at offset 2, so we assemble it byte by
+  #byte, then compare the first frame control byte.
+  Program = [
+    (BPF_LDB_ABS, 0, 0, 3),       #A = it_len high byte
+    (BPF_LSH_K,   0, 0, 8),
+    (BPF_TAX,     0, 0, 0),
+    (BPF_LDB_ABS, 0, 0, 2),       #A = it_len low byte
+    (BPF_OR_X,    0, 0, 0),
+    (BPF_TAX,     0, 0, 0),       #X = it_len
+    (BPF_LDB_IND, 0, 0, 0),       #A = frame control byte 0
+  ]
+
+  if (len(Subtypes) == 0):
+    Program.append((BPF_AND_K, 0, 0, 0x0c))
+    Program.append((BPF_JEQ_K, 1, 0, 0x00))
+  else:
+    #type bits 2-3 must be 0 (management), subtype in bits 4-7
+    Program.append((BPF_AND_K, 0, 0, 0xfc))
+    for Count, Subtype in enumerate(Subtypes):
+      Remaining = len(Subtypes) - Count
+      Program.append((BPF_JEQ_K, Remaining, 0, Subtype << 4))
+
+  Program.append((BPF_RET_K, 0, 0, 0))
+  Program.append((BPF_RET_K, 0, 0, BPF_ACCEPT))
+  return Program
+
+
+def FilterFrame(Raw, Subtypes):
+  #Userspace version of the BPF program, used when replaying a pcap so the
+  #pipeline sees the same frames it would have seen live
+  if (Subtypes is None):
+    return True
+  if (len(Raw) < 4):
+    return False
+  RTLen = Raw[2] | (Raw[3] << 8)
+  if (RTLen >= len(Raw)):
+    return False
+  FC0 = Raw[RTLen]
+  if (len(Subtypes) == 0):
+    return (FC0 & 0x0c) == 0
+  return (FC0 & 0x0c) == 0 and (FC0 >> 4) in Subtypes
+
+
+def AttachFilter(Sock, Program):
+  Code   = b''.join(struct.pack('HBBI', *Instruction) for Instruction in Program)
+  Buffer = ctypes.create_string_buffer(Code)
+  FProg  = struct.pack('HL', len(Program), ctypes.addressof(Buffer))
+  Sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, FProg)
+  #the kernel copies the program, but keep the buffer alive with the socket anyway
+  return Buffer
+
+
+
+
+class FilterStats(object):
+  #Compares frames that made it through the capture filter with the number
+  #of frames the kernel received on the interface (sysfs rx_packets).
+  #Once a raw socket is attached, PACKET_STATISTICS also tells us how many
+  #frames passed the filter and how many were then dropped because the
+  #socket buffer was full.
+  def __init__(self,Interface):
+    self.Interface  = Interface
+    self.StatsFile  = '/sys/class/net/' + str(Interface) + '/statistics/rx_packets'
+    self.StartCount = self.ReadKernelCount()
+    self.Seen       = 0
+    self.LastRead   = 0
+    self.Sock       = None
+    self.Packets    = 0    #tp_packets: frames that passed the filter
+    self.Drops      = 0    #tp_drops: of those, dropped by the socket
+
+  def Attach(self,Sock):
+    self.Sock = Sock
+    self.ReadSocketStats()    #counters start from zero at attach
+
+  def ReadSocketStats(self):
+    #struct tpacket_stats { unsigned int tp_packets, tp_drops; }
+    #The kernel resets both counters on every read, so we add them up.
+    if (self.Sock is None):
+      return
+    try:
+      Packets, Drops = struct.unpack('II', self.Sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 8))
+    except (OSError, struct.error):
+      return
+    self.Packets = self.Packets + Packets
+    self.Drops   = self.Drops + Drops
+
+  def ReadKernelCount(self):
+    try:
+      with open(self.StatsFile) as f:
+        return int(f.read())
+    except (IOError, OSError, ValueError):
+      return None
+
+  def Update(self):
+    #reading sysfs on every frame would cost more than it tells us
+    if (time.time() - self.LastRead < 1):
+      return self.Seen
+    self.ReadSocketStats()
+    if (self.StartCount is not None):
+      Count = self.ReadKernelCount()
+      if (Count is not None):
+        self.Seen = Count - self.StartCount
+    self.LastRead = time.time()
+    return self.Seen
+
+  def Summary(self,Passed):
+    self.LastRead = 0
+    Seen = self.Update()
+    if (self.StartCount is None or Seen == 0):
+      Line = "Filter passed: " + str(Passed)
+    else:
+      Line = ("Filter passed: " + str(Passed) + " of " + str(Seen) +
+              " frames seen by the kernel ({:.1f}%)".format(100.0 * Passed / Seen))
+    if (self.Sock is not None):
+      Line = (Line + "\nSocket: " + str(self.Packets) + " frames passed the filter, " +
+              str(self.Drops) + " dropped before we read them")
+    return Line
+
+
+
+
+#--------------------------------------
+# Raw capture                        --
+#--------------------------------------
+
+def OpenRawSocket(Interface, Subtypes=None):
+  #AF_PACKET socket on a monitor mode interface delivers radiotap frames.
+  #The filter is attached before bind so no unfiltered frame gets queued.
+  Sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+  if (Subtypes is not None):
+    AttachFilter(Sock, BuildFilterProgram(Subtypes))
+  Sock.bind((Interface, ETH_P_ALL))
+  return Sock
+
+
+def RawSniff(Interface, Callback, Subtypes=None, Stats=None):
+  #Replacement for scapy sniff() that hands the callback raw bytes.
+  #Stats (a FilterStats) gets the socket for its drop counts.
+  Sock = OpenRawSocket(Interface, Subtypes)
+  if (Stats is not None):
+    Stats.Attach(Sock)
+  try:
+    while True:
+      Callback(Sock.recv(65535))
+  finally:
+    Sock.close()
+
+
+
+
+#--------------------------------------
+# Pcap files                         --
+#--------------------------------------
+
+PCAP_MAGIC       = 0xa1b2c3d4
+PCAP_MAGIC_NANO  = 0xa1b23c4d
+LINKTYPE_RADIOTAP = 127
+
+
+def ReadPcap(FileName):
+  #Generator returning (timestamp, raw bytes) for every record in a classic
+  #libpcap file.  Only radiotap captures are accepted.
+  with open(FileName,'rb') as f:
+    Header = f.read(24)
+    if (len(Header) < 24):
+      raise ValueError(FileName + " is not a pcap file")
+
+    for Endian in ('<','>'):
+      Magic = struct.unpack(Endian + 'I',Header[0:4])[0]
+      if (Magic == PCAP_MAGIC or Magic == PCAP_MAGIC_NANO):
+        break
+    else:
+      raise ValueError(FileName + " is not a pcap file (pcapng is not supported)")
+
+    Divisor  = 1000000000.0 if Magic == PCAP_MAGIC_NANO else 1000000.0
+    LinkType = struct.unpack(Endian + 'I',Header[20:24])[0]
+    if (LinkType != LINKTYPE_RADIOTAP):
+      raise ValueError(FileName + " has link type " + str(LinkType) + ", expected radiotap (127)")
+
+    Record = struct.Struct(Endian + 'IIII')
+    while True:
+      RecordHeader = f.read(16)
+      if (len(RecordHeader) < 16):
+        return
+      Seconds, Fraction, CapturedLen, OriginalLen = Record.unpack(RecordHeader)
+      Raw = f.read(CapturedLen)
+      if (len(Raw) < CapturedLen):
+        return
+      yield (Seconds + Fraction / Divisor, Raw)
+
+
+def WritePcap(FileName, Frames):
+  #Write (timestamp, raw bytes) pairs as a radiotap pcap file
+  with open(FileName,'wb') as f:
+    f.write(struct.pack('<IHHiIII',PCAP_MAGIC,2,4,0,0,65535,LINKTYPE_RADIOTAP))
+    for Timestamp, Raw in Frames:
+      Seconds  = int(Timestamp)
+      Micro    = int((Timestamp - Seconds) * 1000000)
+      f.write(struct.pack('<IIII',Seconds,Micro,len(Raw),len(Raw)))
+      f.write(Raw)
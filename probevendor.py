@@ -0,0 +1,249 @@
+#------------------------------------------------------------------------------
+#                                                                            --
+#   ____            _           __     __             _                      --
+#  |  _ \ _ __ ___ | |__   ___  \ \   / /__ _ __   __| | ___  _ __           --
+#  | |_) | '__/ _ \| '_ \ / _ \  \ \ / / _ \ '_ \ / _` |/ _ \| '__|          --
+#  |  __/| | | (_) | |_) |  __/   \ V /  __/ | | | (_| | (_) | |             --
+#  |_|   |_|  \___/|_.__/ \___|    \_/ \___|_| |_|\__,_|\___/|_|             --
+#                                                                            --
+#                                                                            --
+#   MAC vendor (OUI) lookups for GPSProbe.                                   --
+#                                                                            --
+#   Every captured frame needs the vendor of its source MAC.  netaddr does   --
+#   a registry lookup and raises NotRegisteredError for every miss, which    --
+#   is most randomized phone MACs.  VendorCache remembers hits and misses    --
+#   per 24 bit OUI and skips locally administered addresses entirely.        --
+#                                                                            --
+#   Version: 1.0                                                             --
+#   Date:    Oct 18, 2026                                                    --
+#------------------------------------------------------------------------------
+#   Version: 1.1                                                             --
+#   Reason:  Compiled OUI table searched through mmap                        --
+#                                                                            --
+#   Build the table once (and again whenever the registry is updated):       --
+#     python3 probevendor.py build [oui.txt|oui.csv] [oui.bin]               --
+#   With no source given, the registry bundled with netaddr is used.         --
+#------------------------------------------------------------------------------
+
+
+import csv
+import mmap
+import os
+import re
+import struct
+import sys
+from collections import OrderedDict
+
+import netaddr
+
+
+#--------------------------------------
+# Global Variables                   --
+#--------------------------------------
+
+#Vendor string used when the OUI is unknown (same as before the cache)
+UNKNOWN_VENDOR = '--'
+
+#Second lowest bit of the first octet marks a locally administered
+#(randomized) MAC.  These never have a registered vendor.
+LOCAL_BIT = 0x02
+
+#Compiled table layout (all big endian):
+#  header   8 byte magic, uint32 entry count
+#  entries  count x (3 byte OUI, 3 byte offset into the string area),
+#           sorted by OUI
+#  strings  length byte + utf-8 vendor name, each name stored once
+TABLE_MAGIC   = b'GPSOUI01'
+TABLE_HEADER  = 12
+ENTRY_SIZE    = 6
+
+DEFAULT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'oui.bin')
+
+OUILine = re.compile(r'^\s*([0-9A-Fa-f]{2})-([0-9A-Fa-f]{2})-([0-9A-Fa-f]{2})\s+\(hex\)\s+(.*?)\s*$')
+
+
+
+
+def ParseOUI(MAC):
+  #'aa:bb:cc:dd:ee:ff' or 'AA-BB-CC-DD-EE-FF' -> 0xaabbcc
+  return int(MAC[0:2] + MAC[3:5] + MAC[6:8],16)
+
+
+def IsLocallyAdministered(OUI):
+  return (OUI >> 16) & LOCAL_BIT != 0
+
+
+
+
+def RegistryLookup(OUI):
+  #The uncached lookup through netaddr's IEEE registry
+  try:
+    return netaddr.OUI(OUI).registration().org
+  except netaddr.core.NotRegisteredError:
+    return UNKNOWN_VENDOR
+
+
+
+
+class VendorCache(object):
+  #Bounded LRU cache of OUI -> vendor, storing misses as well as hits
+  def __init__(self,MaxSize=4096,Lookup=RegistryLookup):
+    self.MaxSize  = MaxSize
+    self.Lookup   = Lookup
+    self.Entries  = OrderedDict()
+    self.Hits     = 0
+    self.Misses   = 0
+    self.Local    = 0
+
+
+  def GetVendor(self,MAC):
+    OUI = ParseOUI(MAC)
+
+    if IsLocallyAdministered(OUI):
+      self.Local = self.Local + 1
+      return UNKNOWN_VENDOR
+
+    Vendor = self.Entries.get(OUI)
+    if (Vendor != None):
+      self.Hits = self.Hits + 1
+      self.Entries.move_to_end(OUI)
+      return Vendor
+
+    self.Misses = self.Misses + 1
+    Vendor = self.Lookup(OUI)
+    self.Entries[OUI] = Vendor
+    if (len(self.Entries) > self.MaxSize):
+      self.Entries.popitem(last=False)
+    return Vendor
+
+
+  def HitRate(self):
+    #locally administered MACs count as hits, they cost no lookup
+    Total = self.Hits + self.Misses + self.Local
+    if (Total == 0):
+      return 0.0
+    return 100.0 * (self.Hits + self.Local) / Total
+
+
+  def Summary(self):
+    return ("Vendor cache: " + "{:.1f}%".format(self.HitRate()) +
+            "  hits: " + str(self.Hits) +
+            "  lookups: " + str(self.Misses) +
+            "  random MACs: " + str(self.Local) +
+            "  entries: " + str(len(self.Entries)) + "/" + str(self.MaxSize))
+
+
+
+
+#--------------------------------------
+# Compiled OUI table                 --
+#--------------------------------------
+
+def ReadRegistry(FileName):
+  #Returns {OUI: vendor} from an IEEE oui.txt or oui.csv file
+  Registry = {}
+  if FileName.lower().endswith('.csv'):
+    with open(FileName, newline='', encoding='utf-8', errors='replace') as f:
+      for Row in csv.reader(f):
+        if (len(Row) < 3 or Row[0] != 'MA-L'):
+          continue
+        Registry[int(Row[1],16)] = Row[2].strip()
+  else:
+    with open(FileName, encoding='utf-8', errors='replace') as f:
+      for Line in f:
+        Match = OUILine.match(Line)
+        if Match:
+          Registry[int(Match.group(1) + Match.group(2) + Match.group(3),16)] = Match.group(4)
+  return Registry
+
+
+def DefaultRegistryFile():
+  #netaddr ships the IEEE registry next to its eui module
+  return os.path.join(os.path.dirname(netaddr.eui.__file__), 'oui.txt')
+
+
+def BuildTable(SourceFile, TableFile):
+  Registry = ReadRegistry(SourceFile)
+
+  Strings = bytearray()
+  Offsets = {}
+  Entries = bytearray()
+  for OUI in sorted(Registry):
+    Name = Registry[OUI].encode('utf-8')[0:255]
+    if (Name not in Offsets):
+      Offsets[Name] = len(Strings)
+      Strings.append(len(Name))
+      Strings.extend(Name)
+    Entries.extend(OUI.to_bytes(3,'big'))
+    Entries.extend(Offsets[Name].to_bytes(3,'big'))
+
+  #write to a temp file first so a running probe never sees half a table
+  with open(TableFile + '.tmp','wb') as f:
+    f.write(TABLE_MAGIC)
+    f.write(struct.pack('>I',len(Registry)))
+    f.write(Entries)
+    f.write(Strings)
+  os.replace(TableFile + '.tmp', TableFile)
+  return len(Registry), len(Offsets)
+
+
+
+
+class OUITable(object):
+  #Binary search over the compiled table through mmap.  Nothing is parsed at
+  #startup and only the pages we actually touch are ever read in.
+  def __init__(self,TableFile=DEFAULT_TABLE):
+    self.TableFile = TableFile
+    self.File      = open(TableFile,'rb')
+    self.Map       = mmap.mmap(self.File.fileno(), 0, access=mmap.ACCESS_READ)
+    if (self.Map[0:8] != TABLE_MAGIC):
+      raise ValueError(TableFile + " is not a compiled OUI table")
+    self.Count     = struct.unpack_from('>I',self.Map,8)[0]
+    self.Strings   = TABLE_HEADER + self.Count * ENTRY_SIZE
+
+
+  def Lookup(self,OUI):
+    Map  = self.Map
+    Low  = 0
+    High = self.Count - 1
+    while (Low <= High):
+      Middle = (Low + High) >> 1
+      Entry  = TABLE_HEADER + Middle * ENTRY_SIZE
+      Value  = int.from_bytes(Map[Entry:Entry + 3],'big')
+      if (Value < OUI):
+        Low = Middle + 1
+      elif (Value > OUI):
+        High = Middle - 1
+      else:
+        Offset = self.Strings + int.from_bytes(Map[Entry + 3:Entry + 6],'big')
+        Length = Map[Offset]
+        return Map[Offset + 1:Offset + 1 + Length].decode('utf-8','replace')
+    return UNKNOWN_VENDOR
+
+
+  def Close(self):
+    self.Map.close()
+    self.File.close()
+
+
+
+
+def OpenLookup(TableFile=DEFAULT_TABLE):
+  #Returns the fastest lookup function available: the compiled table if it
+  #has been built, otherwise netaddr's registry
+  if (TableFile and os.path.exists(TableFile)):
+    return OUITable(TableFile).Lookup
+  return RegistryLookup
+
+
+
+
+if __name__ == '__main__':
+  if (len(sys.argv) < 2 or sys.argv[1] != 'build'):
+    print("usage: probevendor.py build [oui.txt|oui.csv] [oui.bin]")
+    sys.exit(1)
+
+  Source = sys.argv[2] if len(sys.argv) > 2 else DefaultRegistryFile()
+  Table  = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_TABLE
+  Entries, Names = BuildTable(Source, Table)
+  print("Compiled", Entries, "OUIs (" + str(Names) + " vendor names) from", Source, "into", Table, "(" + str(os.path.getsize(Table)) + " bytes)")
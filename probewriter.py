@@ -0,0 +1,553 @@
+#------------------------------------------------------------------------------
+#                                                                            --
+#   ____            _           __        __    _ _                          --
+#  |  _ \ _ __ ___ | |__   ___  \ \      / / __(_) |_ ___ _ __               --
+#  | |_) | '__/ _ \| '_ \ / _ \  \ \ /\ / / '__| | __/ _ \ '__|              --
+#  |  __/| | | (_) | |_) |  __/   \ V  V /| |  | | ||  __/ |                 --
+#  |_|   |_|  \___/|_.__/ \___|    \_/\_/ |_|  |_|\__\___|_|                 --
+#                                                                            --
+#                                                                            --
+#   Background database threads for GPSProbe.                                --
+#                                                                            --
+#   GPSLogWriter owns its own connection on its own thread.  The packet      --
+#   callback hands it rows and carries on; the writer commits them in        --
+#   batches with executemany, so an SD card sees one fsync per batch         --
+#   instead of one per probe request.  CheckpointThread runs the WAL         --
+#   checkpoints the writer no longer does inline, and RollupThread folds     --
+#   old sightings into hourly per device rollups.                            --
+#                                                                            --
+#   Version: 1.0                                                             --
+#   Date:    Oct 18, 2026                                                    --
+#------------------------------------------------------------------------------
+
+
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+import probedb
+
+
+
+
+#--------------------------------------
+# Group commit writer                --
+#--------------------------------------
+
+class GPSLogWriter(threading.Thread):
+  #Buffers GPSLog rows and commits them every BatchRows rows or every
+  #BatchMilliseconds, whichever comes first.  BatchMilliseconds is the
+  #durability window: after a power cut at most that much is lost.  Given a
+  #SessionAggregator, the probe sessions that went idle are closed and
+  #written about once a second even when no more probes come in.
+  def __init__(self,DatabaseFile,BatchRows=500,BatchMilliseconds=1000,OnError=None,Profile='default',Schema=1,Shards=None,Sessions=None):
+    threading.Thread.__init__(self, name="GPSLogWriter")
+    self.daemon            = True
+    self.DatabaseFile      = DatabaseFile
+    self.Profile           = Profile
+    self.Schema            = Schema
+    self.Store             = None
+    self.Shards            = Shards
+    self.ShardFile         = None
+    self.CountSource       = probedb.CountSource(Schema)
+    self.Database          = 'main'
+    self.LogInsert         = probedb.GPSLOG_INSERT
+    self.ObservationInsert = probedb.OBSERVATION_INSERT
+    if (Shards != None):
+      #sightings go to the shard attached as "shard", the rest to main
+      self.Database          = 'shard'
+      self.LogInsert         = probedb.GPSLOG_INSERT.replace('INTO ','INTO shard.')
+      self.ObservationInsert = probedb.OBSERVATION_INSERT.replace('INTO ','INTO shard.')
+    self.BatchRows         = max(1,int(BatchRows))
+    self.BatchSeconds      = max(0,BatchMilliseconds) / 1000.0
+    self.OnError           = OnError
+    self.Sessions          = Sessions
+    self.Rows              = queue.Queue()
+    self.FlushRequested    = threading.Event()
+    self.Flushed           = threading.Event()
+    self.running           = True
+
+    #Counters
+    self.RowsWritten       = 0
+    self.Batches           = 0
+    self.MaxBatchRows      = 0
+    self.CommitSeconds     = 0.0
+    self.MaxCommitSeconds  = 0.0
+    self.LastBatchRows     = 0
+    self.LastCommitSeconds = 0.0
+
+
+  def Add(self,Row):
+    self.Rows.put((probedb.GPSLOG_INSERT,Row))
+
+
+  def AddRow(self,SQL,Row):
+    #any other insert that should ride along in the same batch
+    self.Rows.put((SQL,Row))
+
+
+  def Pending(self):
+    return self.Rows.qsize()
+
+
+  def Flush(self,Timeout=10):
+    #Commit everything queued so far and wait for it
+    self.Flushed.clear()
+    self.FlushRequested.set()
+    self.Flushed.wait(Timeout)
+
+
+  def Stop(self):
+    self.running = False
+    self.FlushRequested.set()
+    self.join(10)
+
+
+  def Connect(self):
+    return probedb.Connect(self.DatabaseFile,self.Profile)
+
+
+  def UseShard(self,conn):
+    #attach the shard for the current period, rolling over when it changes
+    FileName = self.Shards.FileFor(time.time())
+    if (FileName == self.ShardFile):
+      return
+    if (self.ShardFile != None):
+      conn.execute('detach database shard')
+    if not os.path.exists(FileName):
+      self.Shards.Create(FileName)
+    conn.execute('attach database ? as shard',(FileName,))
+    probedb.ApplyProfile(conn,self.Profile,'shard')
+    probedb.AddLogicalIDColumn(conn,'shard')
+    self.ShardFile   = FileName
+    self.CountSource = probedb.CountSource(self.Schema,FileName)
+    if (self.Schema >= 2):
+      self.Store = probedb.ObservationStore(conn,'shard')
+    self.Shards.Prune(conn=conn)
+
+
+  def WriteBatch(self,conn,Batch):
+    if (self.Shards != None):
+      self.UseShard(conn)
+
+    #one executemany per statement, all in the same transaction
+    Statements = OrderedDict()
+    LogRows    = []
+    for SQL, Row in Batch:
+      if (SQL == probedb.GPSLOG_INSERT):
+        LogRows.append(Row)
+        SQL = self.LogInsert
+        #schema 2 keeps sightings in Observations instead of GPSLog
+        if (self.Store != None):
+          SQL = self.ObservationInsert
+          Row = self.Store.Observation(Row)
+      Statements.setdefault(SQL,[]).append(Row)
+    if (len(LogRows) > 0):
+      Statements[probedb.DEVICE_SUMMARY_UPSERT] = probedb.SummaryRows(LogRows)
+      Statements[probedb.RECORD_COUNT_ADD]      = [(self.CountSource, len(LogRows))]
+
+    Start = time.perf_counter()
+    #the sightings of this batch get rowids after the current last one, the
+    #spatial index picks them up from there
+    if (len(LogRows) > 0):
+      AfterID = conn.execute('select coalesce(max(rowid),0) from ' + self.Database + '.' + probedb.CountSource(self.Schema)).fetchone()[0]
+    for SQL, Rows in Statements.items():
+      conn.executemany(SQL,Rows)
+    if (len(LogRows) > 0):
+      conn.execute(probedb.SightingIndexInsert(self.Schema,self.Database),(AfterID,))
+    conn.commit()
+    Elapsed = time.perf_counter() - Start
+
+    self.RowsWritten       = self.RowsWritten + len(Batch)
+    self.Batches           = self.Batches + 1
+    self.LastBatchRows     = len(Batch)
+    self.LastCommitSeconds = Elapsed
+    self.CommitSeconds     = self.CommitSeconds + Elapsed
+    if (len(Batch) > self.MaxBatchRows):
+      self.MaxBatchRows = len(Batch)
+    if (Elapsed > self.MaxCommitSeconds):
+      self.MaxCommitSeconds = Elapsed
+
+
+  def run(self):
+    conn  = self.Connect()
+    Batch = []
+    Deadline = None
+    if (self.Schema >= 2 and self.Shards == None):
+      self.Store = probedb.ObservationStore(conn)
+
+    while True:
+      #Wait for the next row, but never past the batch deadline
+      Timeout = 0.25
+      if (Deadline != None):
+        Timeout = max(0,Deadline - time.time())
+      try:
+        Batch.append(self.Rows.get(timeout=Timeout))
+        if (Deadline == None):
+          Deadline = time.time() + self.BatchSeconds
+      except queue.Empty:
+        pass
+
+      #sessions of devices that went quiet
+      if (self.Sessions != None and time.time() - self.Sessions.LastSweep >= 1):
+        for Row in self.Sessions.Sweep():
+          Batch.append((probedb.PROBE_SESSION_INSERT,Row))
+          if (Deadline == None):
+            Deadline = time.time() + self.BatchSeconds
+
+      Flushing = self.FlushRequested.is_set()
+      if (Flushing):
+        #drain whatever is already queued
+        while True:
+          try:
+            Batch.append(self.Rows.get_nowait())
+          except queue.Empty:
+            break
+
+      if (len(Batch) > 0 and (Flushing or len(Batch) >= self.BatchRows or time.time() >= Deadline)):
+        try:
+          self.WriteBatch(conn,Batch)
+        except Exception as ErrorMessage:
+          if (self.OnError != None):
+            self.OnError(ErrorMessage,traceback.format_exc(),"Writing " + str(len(Batch)) + " GPSLog rows")
+        Batch    = []
+        Deadline = None
+
+      if (Flushing):
+        self.FlushRequested.clear()
+        self.Flushed.set()
+        if not self.running:
+          break
+
+    conn.close()
+
+
+  def Summary(self):
+    if (self.Batches == 0):
+      return "Writer: no batches committed"
+    return ("Writer: " + str(self.RowsWritten) + " rows in " + str(self.Batches) + " commits" +
+            "  avg batch: " + "{:.1f}".format(self.RowsWritten / self.Batches) +
+            "  max batch: " + str(self.MaxBatchRows) +
+            "  avg commit: " + "{:.1f}ms".format(1000 * self.CommitSeconds / self.Batches) +
+            "  max commit: " + "{:.1f}ms".format(1000 * self.MaxCommitSeconds))
+
+
+
+
+#--------------------------------------
+# WAL checkpoints                    --
+#--------------------------------------
+
+class CheckpointThread(threading.Thread):
+  #Runs WAL checkpoints every Interval seconds on its own connection, so the
+  #writer never stalls on one.  A PASSIVE checkpoint copies what it can
+  #without waiting on readers.  Once the WAL grows past TruncateBytes a
+  #TRUNCATE checkpoint resets it so it doesn't keep growing on the SD card.
+  def __init__(self,DatabaseFile,Interval=30,TruncateBytes=64*1024*1024,OnError=None,Shards=None):
+    threading.Thread.__init__(self, name="CheckpointThread")
+    self.daemon          = True
+    self.DatabaseFile    = DatabaseFile
+    self.Shards          = Shards
+    self.Interval        = Interval
+    self.TruncateBytes   = TruncateBytes
+    self.OnError         = OnError
+    self.StopEvent       = threading.Event()
+    self.Checkpoints     = 0
+    self.PagesCopied     = 0
+    self.CheckpointSeconds    = 0.0
+    self.MaxCheckpointSeconds = 0.0
+
+
+  def Checkpoint(self,conn,DatabaseFile=None):
+    Mode = 'PASSIVE'
+    WALFile = (DatabaseFile or self.DatabaseFile) + '-wal'
+    if (os.path.exists(WALFile) and os.path.getsize(WALFile) > self.TruncateBytes):
+      Mode = 'TRUNCATE'
+
+    Start = time.perf_counter()
+    Busy, LogPages, Copied = conn.execute('PRAGMA wal_checkpoint(' + Mode + ')').fetchone()
+    Elapsed = time.perf_counter() - Start
+
+    self.Checkpoints       = self.Checkpoints + 1
+    self.PagesCopied       = self.PagesCopied + max(0,Copied)
+    self.CheckpointSeconds = self.CheckpointSeconds + Elapsed
+    if (Elapsed > self.MaxCheckpointSeconds):
+      self.MaxCheckpointSeconds = Elapsed
+
+
+  def CheckpointShard(self):
+    #the shard being written has a WAL of its own.  Earlier shards were
+    #checkpointed by sqlite when the writer detached them.
+    FileName = self.Shards.FileFor(time.time())
+    if os.path.exists(FileName):
+      conn = sqlite3.connect(FileName)
+      try:
+        self.Checkpoint(conn,FileName)
+      finally:
+        conn.close()
+
+
+  def run(self):
+    conn = sqlite3.connect(self.DatabaseFile)
+    while not self.StopEvent.wait(self.Interval):
+      try:
+        self.Checkpoint(conn)
+        if (self.Shards != None):
+          self.CheckpointShard()
+      except Exception as ErrorMessage:
+        if (self.OnError != None):
+          self.OnError(ErrorMessage,traceback.format_exc(),"WAL checkpoint")
+
+    #one last checkpoint so the WAL is folded back in at shutdown
+    try:
+      self.Checkpoint(conn)
+      if (self.Shards != None):
+        self.CheckpointShard()
+    except sqlite3.Error:
+      pass
+    conn.close()
+
+
+  def Stop(self):
+    self.StopEvent.set()
+    self.join(30)
+
+
+  def Summary(self):
+    if (self.Checkpoints == 0):
+      return "Checkpoints: none"
+    return ("Checkpoints: " + str(self.Checkpoints) +
+            "  pages copied: " + str(self.PagesCopied) +
+            "  avg: " + "{:.1f}ms".format(1000 * self.CheckpointSeconds / self.Checkpoints) +
+            "  max: " + "{:.1f}ms".format(1000 * self.MaxCheckpointSeconds))
+
+
+
+
+#--------------------------------------
+# Hourly rollups                     --
+#--------------------------------------
+
+HOURLY_ROLLUP_INSERT = ''' INSERT OR REPLACE INTO HourlyRollup values (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?) '''
+
+HourlyRollupColumns = '''Hour, MACAddress, Device, FriendlyName, Vendor, Hits, MinSignal, MaxSignal,
+                         AvgSignal, MinLat, MaxLat, MinLon, MaxLon, Channels, SSIDs'''
+
+
+class HourRollup(object):
+  __slots__ = ('Device','FriendlyName','Vendor','Hits','MinSignal','MaxSignal','SignalTotal',
+               'MinLat','MaxLat','MinLon','MaxLon','Channels','SSIDs')
+
+
+class RollupThread(threading.Thread):
+  #Keeps raw sightings for KeepDays and folds anything older into one
+  #HourlyRollup row per device per hour.  GPSLog (or Observations) is walked
+  #in rowid order ChunkRows at a time.  Each chunk is one transaction that
+  #updates the rollups, deletes the raw rows and records the last rowid in
+  #RollupProgress, so a restart picks up where it left off and never counts
+  #a row twice.  Between chunks it waits while the capture writer has rows
+  #queued, so inserts never sit behind a rollup.
+  def __init__(self,DatabaseFile,KeepDays=7,ChunkRows=2000,Interval=600,Schema=1,Profile='default',Yield=None,OnError=None):
+    threading.Thread.__init__(self, name="RollupThread")
+    self.daemon       = True
+    self.DatabaseFile = DatabaseFile
+    self.KeepDays     = KeepDays
+    self.ChunkRows    = max(1,int(ChunkRows))
+    self.Interval     = Interval
+    self.Schema       = Schema
+    self.Profile      = Profile
+    self.Yield        = Yield
+    self.OnError      = OnError
+    self.Source       = 'Observations' if Schema >= 2 else 'GPSLog'
+    self.StopEvent    = threading.Event()
+    self.RowsRolledUp = 0
+    self.Chunks       = 0
+    self.WaitSeconds  = 0.0
+
+
+  def Cutoff(self,Now=None):
+    #start of the hour KeepDays ago, so only whole hours are rolled up
+    if (Now == None):
+      Now = time.time()
+    return time.strftime('%Y-%m-%d %H:00:00',time.localtime(Now - self.KeepDays * 86400))
+
+
+  def LastRowID(self,conn):
+    #Summarized rows are deleted, so anything still in the table below the
+    #saved rowid was never rolled up (sqlite reuses rowids once the table
+    #has been emptied).  Start below it in that case.
+    Row = conn.execute('select LastRowID from RollupProgress where Source = ?',(self.Source,)).fetchone()
+    if (Row == None):
+      return 0
+    First = conn.execute('select min(rowid) from ' + self.Source).fetchone()[0]
+    if (First != None and First <= Row[0]):
+      return First - 1
+    return Row[0]
+
+
+  def ReadChunk(self,conn,LastID):
+    if (self.Schema >= 2):
+      return conn.execute('''select ObservationID, DateTime, Lat, Lon, Signal, Channel, Device,
+                                    MACAddress, FriendlyName, Vendor, SSID
+                               from GPSLogView
+                              where ObservationID > ?
+                              order by ObservationID
+                              limit ?''',(LastID,self.ChunkRows)).fetchall()
+    return conn.execute('''select rowid, DateTime, Lat, Lon, Signal, Channel, Device,
+                                  MACAddress, FriendlyName, Vendor, SSID
+                             from GPSLog
+                            where rowid > ?
+                            order by rowid
+                            limit ?''',(LastID,self.ChunkRows)).fetchall()
+
+
+  def Fold(self,Rollup,Signal,Channel,SSID,Lat,Lon):
+    Rollup.Hits        = Rollup.Hits + 1
+    Rollup.SignalTotal = Rollup.SignalTotal + Signal
+    if (Rollup.MinSignal == None or Signal < Rollup.MinSignal):
+      Rollup.MinSignal = Signal
+    if (Rollup.MaxSignal == None or Signal > Rollup.MaxSignal):
+      Rollup.MaxSignal = Signal
+    if (Channel != None):
+      Rollup.Channels.add(int(Channel))
+    if (SSID != None and SSID not in Rollup.SSIDs):
+      Rollup.SSIDs.append(SSID)
+    if (Lat != None and Lon != None):
+      Rollup.MinLat = Lat if Rollup.MinLat == None else min(Rollup.MinLat,Lat)
+      Rollup.MaxLat = Lat if Rollup.MaxLat == None else max(Rollup.MaxLat,Lat)
+      Rollup.MinLon = Lon if Rollup.MinLon == None else min(Rollup.MinLon,Lon)
+      Rollup.MaxLon = Lon if Rollup.MaxLon == None else max(Rollup.MaxLon,Lon)
+
+
+  def NewRollup(self,Device,FriendlyName,Vendor):
+    Rollup = HourRollup()
+    Rollup.Device       = Device
+    Rollup.FriendlyName = FriendlyName
+    Rollup.Vendor       = Vendor
+    Rollup.Hits         = 0
+    Rollup.MinSignal    = None
+    Rollup.MaxSignal    = None
+    Rollup.SignalTotal  = 0.0
+    Rollup.MinLat       = None
+    Rollup.MaxLat       = None
+    Rollup.MinLon       = None
+    Rollup.MaxLon       = None
+    Rollup.Channels     = set()
+    Rollup.SSIDs        = []
+    return Rollup
+
+
+  def Merge(self,conn,Hour,MAC,Rollup):
+    #an hour can be split across chunks (or runs), add what is already stored
+    Row = conn.execute('select ' + HourlyRollupColumns + ' from HourlyRollup where Hour = ? and MACAddress = ?',(Hour,MAC)).fetchone()
+    if (Row == None):
+      return
+    Hits, MinSignal, MaxSignal, AvgSignal, MinLat, MaxLat, MinLon, MaxLon, Channels, SSIDs = Row[5:]
+    Rollup.Hits        = Rollup.Hits + Hits
+    Rollup.SignalTotal = Rollup.SignalTotal + AvgSignal * Hits
+    Rollup.MinSignal   = min(Rollup.MinSignal,MinSignal)
+    Rollup.MaxSignal   = max(Rollup.MaxSignal,MaxSignal)
+    for Lat, Lon in ((MinLat,MinLon),(MaxLat,MaxLon)):
+      if (Lat != None and Lon != None):
+        Rollup.MinLat = Lat if Rollup.MinLat == None else min(Rollup.MinLat,Lat)
+        Rollup.MaxLat = Lat if Rollup.MaxLat == None else max(Rollup.MaxLat,Lat)
+        Rollup.MinLon = Lon if Rollup.MinLon == None else min(Rollup.MinLon,Lon)
+        Rollup.MaxLon = Lon if Rollup.MaxLon == None else max(Rollup.MaxLon,Lon)
+    Rollup.Channels.update(int(Channel) for Channel in Channels.split(',') if Channel != '')
+    for SSID in json.loads(SSIDs):
+      if (SSID not in Rollup.SSIDs):
+        Rollup.SSIDs.append(SSID)
+
+
+  def RollupChunk(self,conn,Cutoff):
+    #Rolls up one chunk, returns the number of raw rows it replaced
+    FirstID  = self.LastRowID(conn)
+    LastID   = FirstID
+    Folded   = 0
+    Rollups  = OrderedDict()
+    for ID, DateTime, Lat, Lon, Signal, Channel, Device, MAC, FriendlyName, Vendor, SSID in self.ReadChunk(conn,FirstID):
+      DateTime = str(DateTime)
+      if (DateTime >= Cutoff):
+        break
+      LastID = ID
+      Key    = (DateTime[0:13] + ':00:00', MAC)
+      Rollup = Rollups.get(Key)
+      if (Rollup == None):
+        Rollup = self.NewRollup(Device,FriendlyName,Vendor)
+        Rollups[Key] = Rollup
+      if isinstance(SSID,bytes):
+        SSID = SSID.decode('UTF-8','replace')
+      self.Fold(Rollup,float(Signal),Channel,SSID,probedb.ToFloat(Lat),probedb.ToFloat(Lon))
+      Folded = Folded + 1
+
+    if (Folded == 0):
+      return 0
+
+    Values = []
+    for (Hour, MAC), Rollup in Rollups.items():
+      self.Merge(conn,Hour,MAC,Rollup)
+      Values.append((Hour, MAC, Rollup.Device, Rollup.FriendlyName, Rollup.Vendor, Rollup.Hits,
+                     Rollup.MinSignal, Rollup.MaxSignal, Rollup.SignalTotal / Rollup.Hits,
+                     Rollup.MinLat, Rollup.MaxLat, Rollup.MinLon, Rollup.MaxLon,
+                     ','.join(str(Channel) for Channel in sorted(Rollup.Channels)),
+                     json.dumps(Rollup.SSIDs)))
+    conn.executemany(HOURLY_ROLLUP_INSERT,Values)
+    conn.execute('delete from SightingIndex where ID in (select rowid from ' + self.Source + ' where rowid > ? and rowid <= ?)',(FirstID,LastID))
+    conn.execute('delete from ' + self.Source + ' where rowid > ? and rowid <= ?',(FirstID,LastID))
+    conn.execute('update RecordCounts set Rows = Rows - ? where Source = ?',(Folded,self.Source))
+    conn.execute('insert or replace into RollupProgress values (?,?,?)',
+                 (self.Source, LastID, time.strftime('%Y-%m-%d %H:%M:%S')))
+    conn.commit()
+
+    self.RowsRolledUp = self.RowsRolledUp + Folded
+    self.Chunks       = self.Chunks + 1
+    return Folded
+
+
+  def WaitForWriter(self):
+    #let queued capture rows go first, but never wait more than a few
+    #seconds so a busy probe still gets its old rows rolled up
+    Start = time.time()
+    while (self.Yield != None and self.Yield() and time.time() - Start < 5 and not self.StopEvent.is_set()):
+      self.StopEvent.wait(0.05)
+    self.WaitSeconds = self.WaitSeconds + time.time() - Start
+
+
+  def RollupAll(self,conn,Progress=None):
+    #runs chunks until only rows newer than the cutoff are left
+    Cutoff = self.Cutoff()
+    while not self.StopEvent.is_set():
+      self.WaitForWriter()
+      if (self.RollupChunk(conn,Cutoff) == 0):
+        break
+      if (Progress != None):
+        Progress(self.RowsRolledUp)
+
+
+  def run(self):
+    conn = probedb.Connect(self.DatabaseFile,self.Profile)
+    while True:
+      try:
+        self.RollupAll(conn)
+      except Exception as ErrorMessage:
+        conn.rollback()
+        if (self.OnError != None):
+          self.OnError(ErrorMessage,traceback.format_exc(),"Rolling up " + self.Source)
+      if self.StopEvent.wait(self.Interval):
+        break
+    conn.close()
+
+
+  def Stop(self):
+    self.StopEvent.set()
+    self.join(30)
+
+
+  def Summary(self):
+    return ("Rollup: " + str(self.RowsRolledUp) + " rows rolled up in " + str(self.Chunks) + " chunks" +
+            "  waited for writer: " + "{:.1f}s".format(self.WaitSeconds))
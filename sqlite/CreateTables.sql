@@ -36,7 +36,8 @@ create table GPSLog
   MACAddress   string,
   FriendlyName string,
   Vendor       string,
-  SSID         string
+  SSID         string,
+  LogicalID    text                       -- logical device of a randomized MAC, see probedb.py
   );
   
   
@@ -61,3 +62,270 @@ create table FriendlyName
   );
   
 create index i_FriendlyName_MACAddress on FriendlyName(MACAddress);
+
+
+
+
+.print "--Create BeaconSuppressed--"
+drop table if exists BeaconSuppressed;
+
+-- Beacons that were not logged to GPSLog because the same router, SSID and
+-- channel had already been logged within the suppression window
+create table BeaconSuppressed
+(
+  MACAddress   string,
+  SSID         string,
+  Channel      integer,
+  FirstSeen    text,
+  LastSeen     text,
+  Suppressed   integer,
+  MinSignal    real,
+  MaxSignal    real
+  );
+
+create index i_BeaconSuppressed_MACAddress on BeaconSuppressed(MACAddress);
+
+
+
+
+.print "--Create ProbeSessions--"
+drop table if exists ProbeSessions;
+
+-- One row per device per visit: probe requests from the same MAC are folded
+-- together until it has been quiet for the idle timeout.
+-- Channels is a comma list, SSIDs a JSON array of the names probed for.
+create table ProbeSessions
+(
+  MACAddress   string,
+  FriendlyName string,
+  Vendor       string,
+  FirstSeen    text,
+  LastSeen     text,
+  Hits         integer,
+  MinSignal    real,
+  MaxSignal    real,
+  AvgSignal    real,
+  Channels     text,
+  SSIDs        text,
+  FirstLat     real,
+  FirstLon     real,
+  LastLat      real,
+  LastLon      real
+  );
+
+create index i_ProbeSessions_MACAddress on ProbeSessions(MACAddress);
+create index i_ProbeSessions_FirstSeen  on ProbeSessions(FirstSeen);
+
+
+
+
+
+.print "--Create HourlyRollup--"
+drop table if exists HourlyRollup;
+
+-- Sightings older than --rollup-days, one row per device per hour.
+-- Lat/Lon are the bounding box of the positions seen that hour.
+create table HourlyRollup
+(
+  Hour         text,                      -- '2026-10-18 14:00:00'
+  MACAddress   string,
+  Device       string,
+  FriendlyName string,
+  Vendor       string,
+  Hits         integer,
+  MinSignal    real,
+  MaxSignal    real,
+  AvgSignal    real,
+  MinLat       real,
+  MaxLat       real,
+  MinLon       real,
+  MaxLon       real,
+  Channels     text,
+  SSIDs        text,
+  primary key (Hour, MACAddress)
+  );
+
+create index i_HourlyRollup_MACAddress on HourlyRollup(MACAddress);
+
+
+.print "--Create RollupProgress--"
+drop table if exists RollupProgress;
+
+-- Last raw rowid rolled up, so an interrupted rollup resumes
+create table RollupProgress
+(
+  Source       text primary key,          -- GPSLog or Observations
+  LastRowID    integer,
+  Updated      text
+  );
+
+
+.print "--Create DeviceSummary--"
+drop table if exists DeviceSummary;
+
+-- Hits and first/last seen per device and SSID, upserted by the writer with
+-- every batch.  The unknown devices report reads this instead of GPSLog.
+create table DeviceSummary
+(
+  MACAddress   string,
+  SSID         string,
+  Device       string,
+  FriendlyName string,
+  Vendor       string,
+  Hits         integer,
+  FirstSeen    text,
+  LastSeen     text,
+  primary key (MACAddress, SSID)
+  );
+
+create index i_DeviceSummary_FriendlyName on DeviceSummary(FriendlyName, LastSeen);
+
+
+.print "--Create RecordCounts--"
+drop table if exists RecordCounts;
+
+-- Sightings per table, kept in step by the writer (and the rollup) so the
+-- probe never has to count(*) at startup
+create table RecordCounts
+(
+  Source       text primary key,          -- GPSLog, Observations or a shard file name
+  Rows         integer
+  );
+
+
+
+
+
+-- Schema 2 -------------------------------------------------------------------
+-- Normalized layout: each device and SSID is stored once, observations hold
+-- integer keys only.  gpsprobe.py --schema 2 creates these on an existing
+-- database, and "python3 probedb.py migrate <db>" copies GPSLog into them.
+
+.print "--Create Devices--"
+drop view  if exists GPSLogView;
+drop table if exists Devices;
+
+create table Devices
+(
+  DeviceID     integer primary key,
+  MAC          integer not null unique,   -- 48 bit MAC address
+  DeviceType   text,
+  Vendor       text,
+  FriendlyName text
+  );
+
+
+.print "--Create SSIDs--"
+drop table if exists SSIDs;
+
+create table SSIDs
+(
+  SSIDID       integer primary key,
+  SSID         blob not null unique
+  );
+
+
+.print "--Create Observations--"
+drop table if exists Observations;
+
+create table Observations
+(
+  Time         integer not null,          -- epoch milliseconds
+  DeviceID     integer not null,
+  SSIDID       integer,
+  Lat          real,
+  Lon          real,
+  Signal       integer,
+  Channel      integer,
+  PktType      integer,                   -- type * 16 + subtype
+  LogicalID    text                       -- logical device of a randomized MAC
+  );
+
+-- Time for the recent pages, Time, DeviceID and SSIDID for the distinct
+-- devices counts (see probedb.py for what the second one costs)
+create index i_Observations_Time       on Observations(Time);
+create index i_Observations_TimeDevice on Observations(Time, DeviceID, SSIDID);
+create index i_Observations_DeviceID   on Observations(DeviceID, Time);
+
+
+-- GPSLog columns rebuilt from the normalized tables, used by the reports
+create view GPSLogView as
+select datetime(o.Time / 1000, 'unixepoch', 'localtime') as DateTime,
+       o.Lat,
+       o.Lon,
+       o.Signal,
+       o.Channel,
+       (o.PktType >> 4) || '-' || (o.PktType & 15)       as PktType,
+       d.DeviceType                                       as Device,
+       printf('%02X-%02X-%02X-%02X-%02X-%02X',
+              (d.MAC >> 40) & 255, (d.MAC >> 32) & 255, (d.MAC >> 24) & 255,
+              (d.MAC >> 16) & 255, (d.MAC >> 8)  & 255,  d.MAC & 255) as MACAddress,
+       d.FriendlyName,
+       d.Vendor,
+       s.SSID,
+       o.LogicalID,
+       o.Time,
+       o.DeviceID,
+       o.rowid                                            as ObservationID
+  from Observations o
+  join Devices d   on d.DeviceID = o.DeviceID
+  left join SSIDs s on s.SSIDID  = o.SSIDID;
+
+
+.print "--Create SyncHashes--"
+drop table if exists SyncHashes;
+
+-- What derived tables were last built from (FriendlyNameList hash, the
+-- table SightingIndex covers), so unchanged ones are not rebuilt
+create table SyncHashes
+(
+  Name         text primary key,
+  Hash         text,
+  Updated      text
+  );
+
+
+.print "--Create SightingIndex--"
+drop table if exists SightingIndex;
+
+-- R*Tree over the position and time (epoch seconds) of every sighting with
+-- a GPS fix, ID is the GPSLog/Observations rowid (see probedb.py)
+create virtual table SightingIndex
+using rtree(ID, MinLat, MaxLat, MinLon, MaxLon, MinTime, MaxTime);
+
+
+.print "--Create RouterLocations--"
+drop table if exists RouterLocations;
+
+-- Router positions estimated from their beacons by probelocate.py, used for
+-- the router points of the map export
+create table RouterLocations
+(
+  MACAddress   string primary key,        -- as GPSLog / GPSLogView show it
+  Lat          real,
+  Lon          real,
+  Radius       real,                      -- meters
+  Samples      integer,
+  MaxSignal    real,
+  Method       text,                      -- fit or centroid
+  Updated      text
+  );
+
+
+.print "--Create LogicalDevices--"
+drop table if exists LogicalDevices;
+
+-- Randomized MACs linked to the logical device their probe fingerprint
+-- (signature plus probed SSIDs) belongs to, kept by gpsprobe.py
+create table LogicalDevices
+(
+  MACAddress   string primary key,        -- randomized MACs only
+  LogicalID    text,                      -- 'FP-' and 12 hex digits (and -2, -3 ...)
+  Signature    text,
+  SSIDs        text,                      -- json list
+  SSIDCount    integer,
+  FirstSeen    text,
+  Updated      text
+  );
+
+create index i_LogicalDevices_LogicalID on LogicalDevices(LogicalID);
@@ -0,0 +1,16 @@
+#------------------------------------------------------------------------------
+#  conftest.py                                                               --
+#                                                                            --
+#  The tests import the GPSProbe modules from the repository root and the    --
+#  synthetic frame builders from benchmarks/makesample.py.  Nothing here     --
+#  needs scapy, gps or a monitor mode radio.                                 --
+#                                                                            --
+#  usage: python3 -m pytest -q tests                                         --
+#------------------------------------------------------------------------------
+
+import os
+import sys
+
+Root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, Root)
+sys.path.insert(0, os.path.join(Root, 'benchmarks'))
@@ -0,0 +1,238 @@
+#------------------------------------------------------------------------------
+#  test_probedb.py                                                           --
+#                                                                            --
+#  The in-memory aggregators of the capture path and the report queries,     --
+#  on synthetic sightings in in-memory SQLite databases.                     --
+#------------------------------------------------------------------------------
+
+import sqlite3
+import time
+
+import pytest
+
+import probedb
+
+
+ROUTER = '00:aa:bb:cc:dd:ee'
+
+
+#--------------------------------------
+# Beacon suppression                 --
+#--------------------------------------
+
+def testBeaconWindow():
+  Beacons = probedb.BeaconSuppressor(60, 10)
+  Start   = 1000.0
+  assert Beacons.Check(ROUTER, b'Home', 6, -60, 't0', Start) == (True, [])
+  #the rest of the window is suppressed while the signal stays put
+  for Second in range(1, 30):
+    assert Beacons.Check(ROUTER, b'Home', 6, -60 - Second % 5, 't' + str(Second), Start + Second) == (False, [])
+  #a new window logs again and summarises the one before
+  Insert, Summary = Beacons.Check(ROUTER, b'Home', 6, -60, 't60', Start + 60)
+  assert Insert
+  assert Summary == [(ROUTER, b'Home', 6, 't0', 't29', 29, -64.0, -60.0)]
+
+
+def testBeaconSignalJump():
+  Beacons = probedb.BeaconSuppressor(60, 10)
+  assert Beacons.Check(ROUTER, b'Home', 6, -80, 't0', 1000.0)[0]
+  assert not Beacons.Check(ROUTER, b'Home', 6, -75, 't1', 1000.5)[0]
+  #moved more than SignalDelta: logged, and a window starts from there
+  Insert, Summary = Beacons.Check(ROUTER, b'Home', 6, -55, 't2', 1000.8)
+  assert Insert
+  assert Summary == [(ROUTER, b'Home', 6, 't0', 't1', 1, -80.0, -75.0)]
+  #other SSIDs and channels of the same router have windows of their own
+  assert Beacons.Check(ROUTER, b'Guest', 6, -55, 't3', 1000.9)[0]
+  assert Beacons.Check(ROUTER, b'Home', 11, -55, 't4', 1000.9)[0]
+
+
+def testBeaconSweepAndDrain():
+  Beacons = probedb.BeaconSuppressor(60, 10)
+  Beacons.Check(ROUTER, b'Home', 6, -60, 't0', 1000.0)
+  Beacons.Check(ROUTER, b'Home', 6, -60, 't1', 1001.0)
+  Beacons.Check('00:11:11:11:11:11', b'Cafe', 1, -70, 't2', 1001.0)
+  Beacons.Check('00:11:11:11:11:11', b'Cafe', 1, -70, 't3', 1002.0)
+  #windows of routers no longer heard are closed by the sweep
+  assert Beacons.Sweep(1061.5) == [(ROUTER, b'Home', 6, 't0', 't1', 1, -60.0, -60.0)]
+  assert Beacons.Drain() == [('00:11:11:11:11:11', b'Cafe', 1, 't2', 't3', 1, -70.0, -70.0)]
+  assert Beacons.Windows == {}
+
+
+#--------------------------------------
+# Probe request sessions             --
+#--------------------------------------
+
+def testSessionsCloseWhenIdle():
+  Sessions = probedb.SessionAggregator(300)
+  Phone    = '02:11:22:33:44:55'
+  assert Sessions.Add(Phone, '--', 'Apple', -60, 1, b'Home', '43.6', '-79.3', 't0', Now=1000.0) == []
+  assert Sessions.Add(Phone, '--', 'Apple', -40, 6, b'', '43.7', '-79.4', 't1', Now=1100.0) == []
+  #nothing else comes in, the writer's sweep closes it
+  assert Sessions.Sweep(1200.0) == []
+  Closed = Sessions.Sweep(1400.0)
+  assert Closed == [(Phone, '--', 'Apple', 't0', 't1', 2, -60.0, -40.0, -50.0, '1,6', '["Home", ""]',
+                     43.6, -79.3, 43.7, -79.4)]
+  assert Sessions.Sessions == {}
+
+  #a probe after the idle time starts a new session and returns the old one
+  Sessions.Add(Phone, '--', 'Apple', -60, 1, b'', None, None, 't2', Now=2000.0)
+  Closed = Sessions.Add(Phone, '--', 'Apple', -60, 1, b'', None, None, 't3', Now=2400.0)
+  assert [Row[3:6] for Row in Closed] == [('t2', 't2', 1)]
+  assert [Row[3:6] for Row in Sessions.Drain()] == [('t3', 't3', 1)]
+
+
+#--------------------------------------
+# Recent captures paging             --
+#--------------------------------------
+
+def CreateDatabase(conn, Schema):
+  probedb.CreateSupportTables(conn)
+  if (Schema >= 2):
+    probedb.CreateSchemaV2(conn)
+  else:
+    for SQL in probedb.GPSLogTables:
+      conn.execute(SQL)
+
+
+def AddSightings(conn, Schema, Count, Seed, Database='main', LogicalID=None):
+  #GPSLog rows from the last hour, three to a timestamp so the pages have
+  #ties to break
+  Now  = time.time()
+  Rows = []
+  for Number in range(Count):
+    When = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(Now - 3600 + (Number // 3) * 7))
+    MAC  = '02:00:00:00:%02x:%02x' % (Seed, Number % 40)
+    Rows.append((When, '43.6', '-79.3', '-60', '6', '0-4', 'mobile', MAC, '--', 'Apple', b'Home', LogicalID))
+  if (Schema >= 2):
+    Store = probedb.ObservationStore(conn, Database)
+    conn.executemany(probedb.OBSERVATION_INSERT.replace('INTO ', 'INTO ' + Database + '.'), [Store.Observation(Row) for Row in Rows])
+  else:
+    conn.executemany(probedb.GPSLOG_INSERT.replace('INTO ', 'INTO ' + Database + '.'), Rows)
+  conn.commit()
+
+
+def PageByKey(conn, Schema, Databases, Rows):
+  Pages = []
+  Key   = None
+  while True:
+    SQL = probedb.RecentCapturesQuery(Schema, 72, '', 0, Rows, Databases, Key != None)
+    Page = conn.execute(SQL, Key or {}).fetchall()
+    if (len(Page) == 0):
+      return Pages
+    Pages.append(Page)
+    Key = {'AfterTime': Page[-1][-3], 'AfterDB': Page[-1][-2], 'AfterID': Page[-1][-1]}
+
+
+@pytest.mark.parametrize('Schema', [1, 2])
+def testKeysetPagesMatchOffsetPages(Schema):
+  conn = sqlite3.connect(':memory:')
+  CreateDatabase(conn, Schema)
+  AddSightings(conn, Schema, 100, 1)
+  Pages = PageByKey(conn, Schema, ['main'], 7)
+  assert len(Pages) == 15
+  for Number, Page in enumerate(Pages):
+    assert Page == conn.execute(probedb.RecentCapturesQuery(Schema, 72, '', Number * 7, 7)).fetchall()
+
+
+@pytest.mark.parametrize('Schema', [1, 2])
+def testKeysetPagesAcrossShards(Schema, tmp_path):
+  #rowids repeat between main and the shards, the file name breaks the ties
+  conn = sqlite3.connect(':memory:')
+  CreateDatabase(conn, Schema)
+  AddSightings(conn, Schema, 30, 1)
+  Databases = ['main']
+  for Number in range(2):
+    FileName = str(tmp_path / ('shard' + str(Number)))
+    Shard = sqlite3.connect(FileName)
+    CreateDatabase(Shard, Schema)
+    Shard.close()
+    conn.execute('attach database ? as shard' + str(Number), (FileName,))
+    AddSightings(conn, Schema, 30, 2 + Number, 'shard' + str(Number))
+    Databases.append('shard' + str(Number))
+
+  Everything = conn.execute(probedb.RecentCapturesQuery(Schema, 72, '', 0, 1000, Databases)).fetchall()
+  assert len(Everything) == 90
+  assert [Row for Page in PageByKey(conn, Schema, Databases, 8) for Row in Page] == Everything
+
+  #a key stays good when the shards are attached in another order
+  Key = dict(zip(('AfterTime', 'AfterDB', 'AfterID'), Everything[40][-3:]))
+  Reordered = ['main', 'shard1', 'shard0']
+  assert conn.execute(probedb.RecentCapturesQuery(Schema, 72, '', 0, 8, Reordered, True), Key).fetchall() == Everything[41:49]
+
+
+#--------------------------------------
+# Logical devices                    --
+#--------------------------------------
+
+def Linker(MaxMACs=20000):
+  #the frame stands in for its own signature
+  return probedb.DeviceLinker(lambda Frame: Frame, MaxMACs, QuietSeconds=10)
+
+
+def testUniversalMACsAreNotLinked():
+  assert Linker().Link('00:11:22:33:44:55', 'sig', b'Home', 't0', 1000.0) == (None, [])
+
+
+def testRotatedMACJoinsItsDevice():
+  Links = Linker()
+  First, Rows = Links.Link('02:00:00:00:00:01', 'sig', b'Home', 't0', 1000.0)
+  assert First == probedb.LogicalDeviceID(probedb.Fingerprint('sig', [b'Home']))
+  assert [Row[0:2] for Row in Rows] == [('02:00:00:00:00:01', First)]
+  #the phone goes quiet and comes back with a new MAC
+  Second, Rows = Links.Link('06:00:00:00:00:02', 'sig', b'Home', 't1', 1030.0)
+  assert Second == First
+  assert [Row[0:2] for Row in Rows] == [('06:00:00:00:00:02', First)]
+  #the same frames give the same ID in another run
+  assert Linker().Link('0a:00:00:00:00:03', 'sig', b'Home', 't2', 5000.0)[0] == First
+
+
+def testPhonesSeenTogetherStayApart():
+  Links = Linker()
+  One, Rows = Links.Link('02:00:00:00:00:01', 'sig', b'', 't0', 1000.0)
+  Two, Rows = Links.Link('02:00:00:00:00:02', 'sig', b'', 't0', 1002.0)
+  assert Two == One + '-2'
+  #a different signature or SSID set is another device altogether
+  assert Links.Link('02:00:00:00:00:03', 'other', b'', 't0', 1030.0)[0] not in (One, Two)
+  assert Links.Link('02:00:00:00:00:04', 'sig', b'Work', 't0', 1030.0)[0] not in (One, Two)
+
+
+def testQuietMACThatComesBackSplitsItsDevice():
+  Links = Linker()
+  Device, Rows = Links.Link('02:00:00:00:00:01', 'sig', b'', 't0', 1000.0)
+  assert Links.Link('02:00:00:00:00:02', 'sig', b'', 't1', 1020.0)[0] == Device
+  #the first MAC is still in use, so the second one was another phone
+  Again, Rows = Links.Link('02:00:00:00:00:01', 'sig', b'', 't2', 1021.0)
+  assert Again == Device
+  assert [Row[0:2] for Row in Rows] == [('02:00:00:00:00:02', Device + '-2')]
+  assert Links.Splits == 1
+
+
+def testNewSSIDRelinks():
+  Links = Linker()
+  Wildcard, Rows = Links.Link('02:00:00:00:00:01', 'sig', b'', 't0', 1000.0)
+  assert Links.Link('02:00:00:00:00:01', 'sig', b'', 't1', 1001.0) == (Wildcard, [])
+  Named, Rows = Links.Link('02:00:00:00:00:01', 'sig', b'Home', 't2', 1002.0)
+  assert Named != Wildcard
+  assert Rows[0][0:5] == ('02:00:00:00:00:01', Named, 'sig', '["Home"]', 1)
+  assert Links.Devices.keys() == {Named}
+
+
+def testForgottenMACsFreeTheirSlot():
+  Links = Linker(MaxMACs=2)
+  One = Links.Link('02:00:00:00:00:01', 'sig', b'', 't0', 1000.0)[0]
+  Links.Link('02:00:00:00:00:02', 'other', b'', 't0', 1001.0)
+  Links.Link('02:00:00:00:00:03', 'other', b'', 't0', 1002.0)
+  assert '02:00:00:00:00:01' not in Links.MACs
+  assert One not in Links.Devices
+  assert Links.Link('02:00:00:00:00:04', 'sig', b'', 't0', 1003.0)[0] == One
+
+
+@pytest.mark.parametrize('Schema', [1, 2])
+def testLinksStayOutOfDeviceCounts(Schema):
+  #40 MACs linked to one phone: the logical report groups them, the
+  #distinct devices report still counts MACs
+  conn = sqlite3.connect(':memory:')
+  CreateDatabase(conn, Schema)
+  AddSightings(conn, Schema, 120, 1, LogicalID='FP-000000000001')
+  assert probedb.LogicalDeviceCounts(conn, Schema, 72) == (40, 1)
+  assert conn.execute(probedb.DistinctDevicesQuery(Schema, 72)).fetchall() == [(120, 40, '--', 'Apple', b'Home')]
@@ -0,0 +1,143 @@
+#------------------------------------------------------------------------------
+#  test_probeparser.py                                                       --
+#                                                                            --
+#  The fast path parser against hand built radiotap frames.                  --
+#------------------------------------------------------------------------------
+
+import struct
+
+import pytest
+
+import probeparser
+from makesample import RadiotapHeader, Dot11Header, Element
+
+
+PHONE  = '02:11:22:33:44:55'
+ROUTER = '00:aa:bb:cc:dd:ee'
+RATES  = Element(probeparser.ELEMENT_RATES, b'\x02\x04\x0b\x16')
+
+
+def ProbeRequest(MAC, SSID, Signal=-60, Extra=b''):
+  return (RadiotapHeader(Signal) + Dot11Header(4, 0, 'ff:ff:ff:ff:ff:ff', MAC, 'ff:ff:ff:ff:ff:ff') +
+          Element(probeparser.ELEMENT_SSID, SSID) + RATES + Extra)
+
+
+def Beacon(MAC, SSID, Signal=-70):
+  Fixed = struct.pack('<QHH', 0, 100, 0x0431)
+  return RadiotapHeader(Signal) + Dot11Header(8, 0, 'ff:ff:ff:ff:ff:ff', MAC, MAC) + Fixed + Element(0, SSID) + RATES
+
+
+def testBeaconFields():
+  Frame = probeparser.ParseFrame(Beacon(ROUTER, b'Home'))
+  assert Frame.IsBeacon()
+  assert Frame.Addr2 == ROUTER
+  assert Frame.Info == b'Home'
+  assert Frame.ElementID == probeparser.ELEMENT_SSID
+  assert Frame.Signal == -70
+
+
+def testProbeRequestElements():
+  Frame = probeparser.ExtractFrame(ProbeRequest(PHONE, b'CoffeeShop', -45))
+  assert Frame.IsProbeRequest()
+  assert Frame.Addr1 == 'ff:ff:ff:ff:ff:ff'
+  assert Frame.Addr2 == PHONE
+  assert Frame.Info == b'CoffeeShop'
+  assert Frame.Signal == -45
+  assert Frame.ProbeElements() == [(0, b'CoffeeShop'), (1, b'\x02\x04\x0b\x16')]
+
+
+def testWildcardProbe():
+  Frame = probeparser.ParseFrame(ProbeRequest(PHONE, b''))
+  assert Frame.Info == b''
+  assert Frame.ElementID == probeparser.ELEMENT_SSID
+
+
+def testDataFrameHasNoElement():
+  Raw   = RadiotapHeader(-80) + Dot11Header(0, 2, ROUTER, PHONE, ROUTER) + bytes(64)
+  Frame = probeparser.ParseFrame(Raw)
+  assert Frame.Type == 2
+  assert Frame.Addr1 == ROUTER and Frame.Addr2 == PHONE
+  assert Frame.ElementID == None
+
+
+def testFCSIsLeftOut():
+  #with the FCS flag set the last 4 bytes are not elements
+  Raw = bytearray(ProbeRequest(PHONE, b'Home') + b'\xde\xad\xbe\xef')
+  Raw[8] = probeparser.RT_FLAG_FCS
+  Frame = probeparser.ExtractFrame(bytes(Raw))
+  assert Frame.ProbeElements() == [(0, b'Home'), (1, b'\x02\x04\x0b\x16')]
+
+
+def testFallsBackToScapy():
+  #no signal reading, or a truncated first element: not for the fast path
+  NoSignal = struct.pack('<BBHI', 0, 0, 8, 0) + Dot11Header(4, 0, 'ff:ff:ff:ff:ff:ff', PHONE, PHONE)
+  assert probeparser.ParseFrame(NoSignal) == None
+  assert probeparser.ParseFrame(ProbeRequest(PHONE, b'Home')[:-len(RATES) - 2]) == None
+  assert probeparser.ParseFrame(b'\x00\x00') == None
+
+
+def testSignatureIgnoresMACAndSSID():
+  HT    = Element(probeparser.ELEMENT_HT_CAPABILITIES, bytes(26))
+  One   = probeparser.ExtractFrame(ProbeRequest(PHONE, b'Home', Extra=HT))
+  Other = probeparser.ExtractFrame(ProbeRequest('06:01:02:03:04:05', b'Work', Extra=HT))
+  Plain = probeparser.ExtractFrame(ProbeRequest(PHONE, b'Home'))
+  assert probeparser.FrameSignature(One) == probeparser.FrameSignature(Other)
+  assert probeparser.FrameSignature(One) != probeparser.FrameSignature(Plain)
+
+
+#--------------------------------------
+# Capture filter                     --
+#--------------------------------------
+
+def RunFilter(Program, Raw):
+  #just enough of a classic BPF machine for BuildFilterProgram
+  A = 0
+  X = 0
+  PC = 0
+  while True:
+    Code, JT, JF, K = Program[PC]
+    PC = PC + 1
+    if (Code == probeparser.BPF_LDB_ABS):
+      A = Raw[K]
+    elif (Code == probeparser.BPF_LDB_IND):
+      if (X + K >= len(Raw)):
+        return 0
+      A = Raw[X + K]
+    elif (Code == probeparser.BPF_LSH_K):
+      A = (A << K) & 0xffffffff
+    elif (Code == probeparser.BPF_OR_X):
+      A = A | X
+    elif (Code == probeparser.BPF_AND_K):
+      A = A & K
+    elif (Code == probeparser.BPF_TAX):
+      X = A
+    elif (Code == probeparser.BPF_JEQ_K):
+      PC = PC + (JT if A == K else JF)
+    elif (Code == probeparser.BPF_RET_K):
+      return K
+
+
+def testFilterOption():
+  assert probeparser.ParseFilterOption('none') == None
+  assert probeparser.ParseFilterOption('mgt') == []
+  assert probeparser.ParseFilterOption(probeparser.DEFAULT_FILTER) == [0x08, 0x04]
+  assert probeparser.FilterExpression([0x08, 0x04]) == 'type mgt subtype beacon or type mgt subtype probe-req'
+  with pytest.raises(ValueError):
+    probeparser.ParseFilterOption('beacon,bogus')
+
+
+def testFilterProgramMatchesFilterFrame():
+  Frames = {'beacon':   Beacon(ROUTER, b'Home'),
+            'probe':    ProbeRequest(PHONE, b'Home'),
+            'response': RadiotapHeader(-50) + Dot11Header(5, 0, PHONE, ROUTER, ROUTER) + bytes(20),
+            'auth':     RadiotapHeader(-50) + Dot11Header(11, 0, ROUTER, PHONE, ROUTER) + bytes(6),
+            'data':     RadiotapHeader(-50) + Dot11Header(0, 2, ROUTER, PHONE, ROUTER) + bytes(40)}
+  Expected = {'beacon,probe-req': {'beacon', 'probe'},
+              'probe-resp':       {'response'},
+              'mgt':              {'beacon', 'probe', 'response', 'auth'}}
+  for Option, Kept in Expected.items():
+    Subtypes = probeparser.ParseFilterOption(Option)
+    Program  = probeparser.BuildFilterProgram(Subtypes)
+    for Name, Raw in Frames.items():
+      assert probeparser.FilterFrame(Raw, Subtypes) == (Name in Kept), (Option, Name)
+      assert (RunFilter(Program, Raw) != 0) == (Name in Kept), (Option, Name)